@@ -3,17 +3,32 @@ Flask entry-point for the Nim LLM game.
 """
 from __future__ import annotations
 
+import json
 import os
+import threading
+import time
 import uuid
-from datetime import datetime
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from datetime import datetime, timezone
 
 from dotenv import load_dotenv
-from flask import Flask, jsonify, render_template, request, session
+from flask import Flask, Response, g, jsonify, render_template, request, session, stream_with_context
 
+from arena.admission import AdmissionRejected, admission_stats, admit
 from arena.game import Game
+from arena.jobs import JobLimitError, JobManager
 from arena.llm import LLM
 from arena.nim_game import BLUE, RED
 from arena.player import HumanTurnException
+from arena.record import RatingEngine, game_date_range, latest_game_id, on_commit
+from arena.matchstick_view import matchstick_defs
+from arena.metrics import CONTENT_TYPE, LEADERBOARD_LATENCY, gauge, observe_request, render_metrics
+from arena.sessions import SessionLockTimeout, create_session_store
+from arena.speculation import create_speculator
+from arena.state import state_delta
+from arena.tracing import begin_trace, end_trace, recent_traces, span, traced
+from arena.writer import writer_stats
 import random
 
 load_dotenv(override=True)
@@ -21,7 +36,34 @@ load_dotenv(override=True)
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev-secret")
 
-_GAMES: dict[str, Game] = {}
+# Parties par session, en mémoire ou dans SQLite (SESSION_BACKEND) pour plusieurs workers
+_GAMES = create_session_store()
+
+# Réponses des LLM préparées pendant que l'humain réfléchit (voir arena/speculation.py)
+_SPECULATOR = create_speculator(_GAMES)
+
+
+def _save_game(sid: str, game: Game) -> None:
+    _GAMES.set(sid, game)
+    # Au tour d'un humain face à un LLM, le LLM prépare sa réponse à chaque coup possible
+    _SPECULATOR.prepare(sid, game)
+
+
+# Coups joués pour /api/run/stream, et intervalle des heartbeats en secondes
+_STREAM_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv("STREAM_WORKERS", 32)))
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", 10))
+
+# Parties complètes jouées en arrière-plan (/api/jobs)
+_JOBS = JobManager(
+    render=state_delta, load=_GAMES.get, save=_save_game, session_lock=_GAMES.lock
+)
+
+gauge("nim_sessions", "Games held by the session store", lambda: len(_GAMES))
+gauge("nim_jobs_active", "Background runs queued or running", lambda: _JOBS.active_count())
+
+# Classement calculé, par moteur de classement; vidé à chaque partie enregistrée
+_LEADERBOARD_CACHE: dict[str, dict] = {}
+_LEADERBOARD_LOCK = threading.Lock()
 
 
 def _session_id() -> str:
@@ -32,12 +74,76 @@ def _session_id() -> str:
     return sid
 
 
-def _get_game() -> Game | None:
-    return _GAMES.get(_session_id())
+@contextmanager
+def _session_game(variant: str = "normal"):
+    # Verrouille la session, charge (ou crée) sa partie, puis l'enregistre après modification.
+    # Deux requêtes de la même session ne modifient donc jamais la partie en même temps.
+    sid = _session_id()
+    with _GAMES.lock(sid):
+        with span("session.load"):
+            game = _GAMES.get(sid)
+        if not game:
+            game = _create_game(None, None, variant)
+        try:
+            yield game
+        finally:
+            # Aussi quand un coup est refusé en cours de partie: les coups déjà joués sont gardés
+            with span("session.save"):
+                _save_game(sid, game)
+
+
+def _new_game(red_model: str | None, blue_model: str | None, variant: str) -> Game:
+    sid = _session_id()
+    with _GAMES.lock(sid):
+        game = _create_game(red_model, blue_model, variant)
+        _save_game(sid, game)
+    return game
+
+
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+    # Trace échantillonnée (TRACE_SAMPLE), ou demandée par le client avec l'en-tête X-Trace: 1
+    rule = request.url_rule.rule if request.url_rule else request.path
+    g.trace = begin_trace(f"{request.method} {rule}", forced=request.headers.get("X-Trace") == "1")
+
+
+@app.after_request
+def _observe_request(response):
+    # Latence par route (le motif, pas le chemin: /api/jobs/<job_id> reste une seule série)
+    start = g.pop("request_start", None)
+    if start is not None:
+        rule = request.url_rule.rule if request.url_rule else None
+        observe_request(request.method, rule, response.status_code, time.perf_counter() - start)
+    trace = end_trace(g.pop("trace", None), status=response.status_code)
+    if trace is not None:
+        response.headers["X-Trace-Id"] = trace.id
+    return response
+
+
+@app.teardown_request
+def _end_trace(error=None):
+    # Requête terminée par une exception non gérée: after_request n'a pas été appelé
+    end_trace(g.pop("trace", None), status=500)
 
 
-def _set_game(game: Game) -> None:
-    _GAMES[_session_id()] = game
+@app.errorhandler(SessionLockTimeout)
+def session_busy(e):
+    return jsonify({"error": str(e)}), 409
+
+
+@app.errorhandler(AdmissionRejected)
+def llm_busy(e):
+    # 429 si un modèle ou un fournisseur est saturé, 503 si c'est tout le serveur
+    response = jsonify({"error": str(e), "retry_after": e.retry_after})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, e.status
+
+
+def _pick(game: Game) -> None:
+    # Le coup n'est joué que si le modèle a une place libre (voir arena/admission.py)
+    with admit(game.players[game.nim_game.player_to_move].llm):
+        game.pick()
 
 
 def _default_models() -> tuple[str, str]:
@@ -58,6 +164,13 @@ def _message_html(game: Game) -> str:
     return f'<div class="status">{game.nim_game.message()}</div>'
 
 
+def _human_stop_message(game: Game) -> str:
+    return (
+        _message_html(game)
+        + "<br/><strong>Auto-run stopped: human player detected. Use single move.</strong>"
+    )
+
+
 def _human_turn(game: Game) -> tuple[bool, list[int]]:
     if not game.nim_game.is_active():
         return False, []
@@ -67,6 +180,7 @@ def _human_turn(game: Game) -> tuple[bool, list[int]]:
     return False, []
 
 
+@traced("render.state")
 def _state_payload(game: Game) -> dict:
     show_human, valid_moves = _human_turn(game)
     dropdowns_enabled = not game.nim_game.game_started()
@@ -94,6 +208,20 @@ def _state_payload(game: Game) -> dict:
     }
 
 
+def _state_reply(game: Game, args, since: str | None = None, stopped_for_human: bool = False) -> dict:
+    # ?protocol=2 : état brut (rendu par le client), seulement les champs modifiés
+    # depuis la version ?since=<v>; sinon l'état avec le HTML rendu par le serveur
+    if args.get("protocol") == "2":
+        payload = state_delta(game, since or args.get("since"))
+        if stopped_for_human:
+            payload["stopped_for_human"] = True
+        return payload
+    payload = _state_payload(game)
+    if stopped_for_human:
+        payload["message_html"] = _human_stop_message(game)
+    return payload
+
+
 def _create_game(red_model: str | None, blue_model: str | None, variant: str) -> Game:
     if not red_model or not blue_model:
         default_red, default_blue = _default_models()
@@ -102,6 +230,37 @@ def _create_game(red_model: str | None, blue_model: str | None, variant: str) ->
     return Game(red_model, blue_model, variant=variant)
 
 
+def _apply_human_move(game: Game, move: int) -> bool:
+    current_player = game.players[game.nim_game.player_to_move]
+    if current_player.model == "Humain" and move in game.nim_game.valid_moves():
+        current_player.make_human_move(game.nim_game, move)
+        if not game.nim_game.is_active():
+            game.record()
+        return True
+    return False
+
+
+def _speculated_reply(sid: str, game: Game) -> None:
+    # La réponse du LLM au coup de l'humain, si elle a été calculée pendant sa réflexion;
+    # sinon le coup du LLM est joué comme avant, avec /api/move
+    if game.nim_game.is_active() and _SPECULATOR.take(sid, game) and not game.nim_game.is_active():
+        game.record()
+
+
+def _apply_model(game: Game, player: str | None, model: str | None) -> None:
+    if not game.nim_game.game_started() and model:
+        if player == "red":
+            game.players[RED].switch_model(model)
+        elif player == "blue":
+            game.players[BLUE].switch_model(model)
+
+
+def _apply_variant(game: Game, variant: str) -> None:
+    if not game.nim_game.game_started():
+        game.variant = variant
+        game.nim_game.variant = variant
+
+
 def _combined_ratings(
     ratings_global: dict[str, float],
     ratings_normal: dict[str, float],
@@ -136,6 +295,7 @@ def index():
         default_red=default_red,
         default_blue=default_blue,
         default_variant="normal",
+        board_defs=matchstick_defs()[0],
     )
 
 
@@ -145,71 +305,182 @@ def api_init():
     red_model = payload.get("red_model")
     blue_model = payload.get("blue_model")
     variant = payload.get("variant", "normal")
-    game = _create_game(red_model, blue_model, variant)
-    _set_game(game)
-    return jsonify(_state_payload(game))
+    game = _new_game(red_model, blue_model, variant)
+    return jsonify(_state_reply(game, request.args))
 
 
 @app.route("/api/move", methods=["POST"])
 def api_move():
-    game = _get_game()
-    if not game:
-        red_model, blue_model = _default_models()
-        game = _create_game(red_model, blue_model, "normal")
-        _set_game(game)
-    try:
-        game.pick()
-        if not game.nim_game.is_active():
-            game.record()
-    except HumanTurnException:
-        pass
-    return jsonify(_state_payload(game))
+    with _session_game() as game:
+        try:
+            if game.nim_game.is_active():
+                _pick(game)
+            if not game.nim_game.is_active():
+                game.record()
+        except HumanTurnException:
+            pass
+    return jsonify(_state_reply(game, request.args))
 
 
 @app.route("/api/run", methods=["POST"])
 def api_run():
-    game = _get_game()
-    if not game:
-        red_model, blue_model = _default_models()
-        game = _create_game(red_model, blue_model, "normal")
-        _set_game(game)
+    stopped_for_human = False
+    with _session_game() as game:
+        game.reset()
+        while game.nim_game.is_active():
+            try:
+                _pick(game)
+            except HumanTurnException:
+                stopped_for_human = True
+                break
+
+        if not game.nim_game.is_active():
+            game.record()
+
+    return jsonify(_state_reply(game, request.args, stopped_for_human=stopped_for_human))
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 
-    game.reset()
-    message_override = ""
-    while game.nim_game.is_active():
+@app.route("/api/run/stream", methods=["GET"])
+def api_run_stream():
+    sid = _session_id()
+    args = request.args.to_dict()
+    # La session reste verrouillée pendant toute la partie: le verrou est libéré
+    # (et la partie enregistrée) à la fermeture de la réponse
+    session_game = ExitStack()
+    game = session_game.enter_context(_session_game())
+    if args.get("reset") or not game.nim_game.is_active():
+        game.reset()
+    futures = []
+
+    def events():
+        # Avec le protocole 2, chaque événement ne contient que les changements depuis le précédent
+        payload = _state_reply(game, args)
+        yield _sse("state", payload)
         try:
-            game.pick()
+            while game.nim_game.is_active():
+                # Le coup est joué dans un thread pour pouvoir envoyer des heartbeats
+                # pendant l'appel au LLM
+                future = _STREAM_EXECUTOR.submit(_pick, game)
+                futures.append(future)
+                while True:
+                    try:
+                        future.result(timeout=SSE_HEARTBEAT)
+                        break
+                    except FuturesTimeout:
+                        yield ": heartbeat\n\n"
+                if not game.nim_game.is_active():
+                    game.record()
+                _GAMES.set(sid, game)
+                payload = _state_reply(game, args, since=payload.get("v"))
+                yield _sse("state", payload)
         except HumanTurnException:
-            message_override = (
-                _message_html(game)
-                + "<br/><strong>Auto-run stopped: human player detected. Use single move.</strong>"
-            )
-            break
+            payload = _state_reply(game, args, since=payload.get("v"), stopped_for_human=True)
+            yield _sse("state", payload)
+        except AdmissionRejected as e:
+            yield _sse("busy", {"error": str(e), "retry_after": e.retry_after})
+        except GeneratorExit:
+            # Le client s'est déconnecté: on arrête après le coup en cours
+            return
+        yield _sse("done", {"game_over": not game.nim_game.is_active()})
+
+    def close():
+        # Attendre la fin du coup en cours avant de rendre la partie aux autres requêtes
+        for future in futures:
+            future.exception()
+        # Le coup en cours quand le client s'est déconnecté a pu finir la partie
+        if not game.nim_game.is_active():
+            game.record()
+        session_game.close()
 
-    if not game.nim_game.is_active():
-        game.record()
+    response = Response(stream_with_context(events()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.call_on_close(close)
+    return response
 
-    payload = _state_payload(game)
-    if message_override:
-        payload["message_html"] = message_override
-    return jsonify(payload)
+
+@app.route("/api/jobs", methods=["POST"])
+def api_job_start():
+    # La partie est jouée par un worker: la requête répond tout de suite avec l'id du job
+    payload = request.get_json(silent=True) or {}
+    with _session_game() as game:
+        if payload.get("reset") or not game.nim_game.is_active():
+            game.reset()
+    try:
+        # La limite par utilisateur porte sur l'adresse du client, toutes sessions confondues
+        job = _JOBS.submit(request.remote_addr or _session_id(), _session_id())
+    except JobLimitError as e:
+        return jsonify({"error": str(e)}), 429
+    return jsonify(job.to_dict()), 202
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def api_job(job_id: str):
+    job = _JOBS.get(job_id, _session_id())
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    # ?after=<version> : attendre (long polling) que le job avance au-delà de cette version
+    after = request.args.get("after", type=int)
+    if after is not None:
+        _JOBS.wait(job, after, min(request.args.get("timeout", 25, type=float), 60))
+    return jsonify(job.to_dict())
+
+
+@app.route("/api/jobs/<job_id>", methods=["DELETE"])
+def api_job_cancel(job_id: str):
+    job = _JOBS.cancel(job_id, _session_id())
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/api/jobs/<job_id>/events", methods=["GET"])
+def api_job_events(job_id: str):
+    job = _JOBS.get(job_id, _session_id())
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    def events():
+        version = -1
+        while True:
+            if not _JOBS.wait(job, version, SSE_HEARTBEAT):
+                yield ": heartbeat\n\n"
+                continue
+            payload = job.to_dict()
+            version = payload["version"]
+            yield _sse("state", payload["state"])
+            if not job.is_active():
+                yield _sse("done", payload)
+                return
+
+    response = Response(stream_with_context(events()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@app.route("/api/state", methods=["GET"])
+def api_state():
+    # Pour les spectateurs qui interrogent l'état sans jouer: lecture seule, sans verrou
+    game = _GAMES.get(_session_id())
+    if not game:
+        with _session_game() as game:
+            pass
+    return jsonify(_state_reply(game, request.args))
 
 
 @app.route("/api/human-move", methods=["POST"])
 def api_human_move():
     payload = request.get_json(silent=True) or {}
     move = int(payload.get("move", 0))
-    game = _get_game()
-    if not game:
-        red_model, blue_model = _default_models()
-        game = _create_game(red_model, blue_model, "normal")
-        _set_game(game)
-    current_player = game.players[game.nim_game.player_to_move]
-    if current_player.model == "Humain" and move in game.nim_game.valid_moves():
-        current_player.make_human_move(game.nim_game, move)
-        if not game.nim_game.is_active():
-            game.record()
-    return jsonify(_state_payload(game))
+    with _session_game() as game:
+        if _apply_human_move(game, move):
+            _speculated_reply(_session_id(), game)
+    return jsonify(_state_reply(game, request.args))
 
 
 @app.route("/api/reset", methods=["POST"])
@@ -218,9 +489,8 @@ def api_reset():
     red_model = payload.get("red_model")
     blue_model = payload.get("blue_model")
     variant = payload.get("variant", "normal")
-    game = _create_game(red_model, blue_model, variant)
-    _set_game(game)
-    return jsonify(_state_payload(game))
+    game = _new_game(red_model, blue_model, variant)
+    return jsonify(_state_reply(game, request.args))
 
 
 @app.route("/api/model", methods=["POST"])
@@ -228,38 +498,21 @@ def api_model():
     payload = request.get_json(silent=True) or {}
     player = payload.get("player")
     model = payload.get("model")
-    game = _get_game()
-    if not game:
-        game = _create_game(None, None, "normal")
-        _set_game(game)
-
-    if not game.nim_game.game_started() and model:
-        if player == "red":
-            game.players[RED].switch_model(model)
-        elif player == "blue":
-            game.players[BLUE].switch_model(model)
-
-    return jsonify(_state_payload(game))
+    with _session_game() as game:
+        _apply_model(game, player, model)
+    return jsonify(_state_reply(game, request.args))
 
 
 @app.route("/api/variant", methods=["POST"])
 def api_variant():
     payload = request.get_json(silent=True) or {}
     variant = payload.get("variant", "normal")
-    game = _get_game()
-    if not game:
-        game = _create_game(None, None, variant)
-        _set_game(game)
+    with _session_game(variant) as game:
+        _apply_variant(game, variant)
+    return jsonify(_state_reply(game, request.args))
 
-    if not game.nim_game.game_started():
-        game.variant = variant
-        game.nim_game.variant = variant
-
-    return jsonify(_state_payload(game))
 
-
-@app.route("/api/leaderboard", methods=["GET"])
-def api_leaderboard():
+def _leaderboard_payload(engine_name: str) -> dict:
     records = Game.get_games()
     results_rows = []
     for game in reversed(records):
@@ -279,21 +532,160 @@ def api_leaderboard():
             ]
         )
 
-    ratings_global = Game.get_ratings()
-    ratings_normal = Game.get_ratings_by_variant("normal")
-    ratings_a = Game.get_ratings_by_variant("a")
-    ratings_b = Game.get_ratings_by_variant("b")
+    ratings_global = Game.get_ratings(engine_name)
+    ratings_normal = Game.get_ratings_by_variant("normal", engine_name)
+    ratings_a = Game.get_ratings_by_variant("a", engine_name)
+    ratings_b = Game.get_ratings_by_variant("b", engine_name)
     ratings_rows = _combined_ratings(
         ratings_global, ratings_normal, ratings_a, ratings_b
     )
 
-    return jsonify(
-        {
-            "results": results_rows,
-            "ratings": ratings_rows,
-            "generated_at": datetime.utcnow().isoformat() + "Z",
+    return {
+        "results": results_rows,
+        "ratings": ratings_rows,
+        "engine": engine_name,
+        "generated_at": datetime.utcnow().isoformat() + "Z",
+    }
+
+
+def _cached_leaderboard(engine_name: str) -> dict:
+    # La clé est le dernier id de partie: une partie écrite par un autre processus
+    # invalide aussi le cache
+    key = latest_game_id()
+    entry = _LEADERBOARD_CACHE.get(engine_name)
+    if entry and entry["key"] == key:
+        return entry
+    with _LEADERBOARD_LOCK:
+        # Un seul calcul pour toutes les requêtes qui attendaient le verrou
+        entry = _LEADERBOARD_CACHE.get(engine_name)
+        if entry and entry["key"] == key:
+            return entry
+        with LEADERBOARD_LATENCY.time(engine=engine_name), span("leaderboard.compute", engine=engine_name):
+            payload = _leaderboard_payload(engine_name)
+            # Le classement change avec la dernière partie, pas avec l'heure du calcul
+            _, newest = game_date_range()
+        entry = {
+            "key": key,
+            # Sérialisé une fois: une requête servie par le cache ne refait pas le JSON
+            "body": json.dumps(payload),
+            "etag": f"{engine_name}-{key}",
+            # Les dates en base sont en heure locale, sans fuseau
+            "last_modified": (newest or datetime.now()).astimezone(timezone.utc).replace(microsecond=0),
         }
-    )
+        _LEADERBOARD_CACHE[engine_name] = entry
+        return entry
+
+
+def _invalidate_leaderboard() -> None:
+    _LEADERBOARD_CACHE.clear()
+
+
+on_commit(_invalidate_leaderboard)
+
+
+@app.route("/api/leaderboard", methods=["GET"])
+def api_leaderboard():
+    engine_name = request.args.get("engine", "elo")
+    if engine_name not in RatingEngine.engine_map():
+        engine_name = "elo"
+    entry = _cached_leaderboard(engine_name)
+
+    # Le client a déjà ce classement: 304 sans construire la réponse
+    if request.if_none_match.contains(entry["etag"]):
+        response = Response(status=304)
+    else:
+        response = Response(entry["body"], mimetype="application/json")
+    response.set_etag(entry["etag"])
+    response.last_modified = entry["last_modified"]
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def _parse_date(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    # Les dates en base sont en heure locale, sans fuseau
+    if date.tzinfo is not None:
+        date = date.astimezone().replace(tzinfo=None)
+    return date
+
+
+def _rating_history_payload(args) -> dict:
+    # Soit une date précise (as_of), soit des points répartis entre start et end
+    variant = args.get("variant") or None
+    as_of = _parse_date(args.get("as_of"))
+    if as_of:
+        dates = [as_of]
+    else:
+        first, last = game_date_range()
+        if first is None:
+            return {"variant": variant, "points": []}
+        start = _parse_date(args.get("start")) or first
+        end = _parse_date(args.get("end")) or last
+        try:
+            count = max(1, min(int(args.get("points", 30)), 500))
+        except ValueError:
+            count = 30
+        step = (end - start) / max(count - 1, 1)
+        dates = [start + step * i for i in range(count)]
+
+    history = Game.get_rating_history(dates, variant)
+    return {
+        "variant": variant,
+        "points": [
+            {
+                "date": date.replace(microsecond=0).isoformat(),
+                "ratings": {model: int(round(rating)) for model, rating in ratings.items()},
+            }
+            for date, ratings in zip(dates, history)
+        ],
+    }
+
+
+@app.route("/api/ratings/history", methods=["GET"])
+def api_rating_history():
+    return jsonify(_rating_history_payload(request.args))
+
+
+def _status_payload() -> dict:
+    return {
+        "writer": writer_stats(),
+        "sessions": _GAMES.stats(),
+        "jobs": _JOBS.stats(),
+        "admission": admission_stats(),
+        "speculation": _SPECULATOR.stats(),
+        "generated_at": datetime.utcnow().isoformat() + "Z",
+    }
+
+
+@app.route("/api/status", methods=["GET"])
+def api_status():
+    return jsonify(_status_payload())
+
+
+def _traces_payload(args) -> dict:
+    try:
+        limit = int(args.get("limit", 50))
+        min_ms = float(args.get("min_ms", 0))
+    except ValueError:
+        limit, min_ms = 50, 0.0
+    return {"traces": recent_traces(limit, min_ms)}
+
+
+@app.route("/api/traces", methods=["GET"])
+def api_traces():
+    # Dernières requêtes tracées, avec le temps passé dans chaque phase (?min_ms= pour les lentes)
+    return jsonify(_traces_payload(request.args))
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # Format texte de Prometheus; chaque processus (worker) expose ses propres compteurs
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,352 @@
+# Admission control for LLM calls: global, per-provider and per-model concurrency limits
+
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+from arena.llm import LLM, Human
+from arena.tracing import span
+
+LLM_GLOBAL_LIMIT = int(os.getenv("LLM_GLOBAL_LIMIT", 64))
+LLM_PROVIDER_LIMIT = int(os.getenv("LLM_PROVIDER_LIMIT", 16))  # default for each provider
+# Limites par modèle ou par fournisseur (nom de la classe), comme MODELS:
+# LLM_LIMITS="gpt-4o-mini=4,Claude=8"
+LLM_LIMITS = os.getenv("LLM_LIMITS", "")
+ADMISSION_TIMEOUT = float(os.getenv("ADMISSION_TIMEOUT", 5))  # longest wait for a slot
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", 2))  # waiting calls per slot
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    """
+    Parse "name=limit,name=limit" into a dict, ignoring malformed entries
+    """
+    limits = {}
+    for item in spec.split(","):
+        name, _, value = item.strip().partition("=")
+        if name and value.strip().isdigit():
+            limits[name.strip()] = int(value)
+    return limits
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when an LLM call can't get a slot: the queue is full, or the deadline passed.
+    status is 503 when the whole server is saturated, 429 when one provider or model is.
+    """
+
+    def __init__(self, limiter: str, status: int, retry_after: int):
+        self.limiter = limiter
+        self.status = status
+        self.retry_after = retry_after
+        super().__init__(f"Too many calls in progress for {limiter}, retry in {retry_after}s")
+
+
+class Limiter:
+    """
+    A counting semaphore with a bounded wait queue, which also tracks how long slots
+    are held so it can tell rejected callers when to retry
+    """
+
+    def __init__(self, name: str, limit: int, status: int, max_waiting: int):
+        """
+        Initialize the limiter; status is the HTTP status of its rejections
+        """
+        self.name = name
+        self.limit = limit
+        self.status = status
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.hold_time = 1.0  # moyenne glissante de la durée d'un appel, en secondes
+        self.condition = threading.Condition()
+
+    def _reject(self) -> AdmissionRejected:
+        """
+        Count a rejection and estimate when a slot is likely to be free. The condition must be held.
+        """
+        self.rejected += 1
+        queue = self.waiting + 1
+        retry_after = max(1, round(self.hold_time * queue / max(self.limit, 1)))
+        return AdmissionRejected(self.name, self.status, retry_after)
+
+    def try_acquire(self) -> bool:
+        """
+        Take a slot if one is free right now
+        """
+        with self.condition:
+            if self.active < self.limit:
+                self.active += 1
+                self.admitted += 1
+                return True
+            return False
+
+    def try_acquire_idle(self, headroom: int = 0) -> bool:
+        """
+        Take a slot for background work: only if no call is waiting for one and more than
+        `headroom` slots are free, without joining the wait queue or counting a rejection
+        """
+        with self.condition:
+            if self.waiting == 0 and self.active < self.limit - headroom:
+                self.active += 1
+                self.admitted += 1
+                return True
+            return False
+
+    def acquire(self, deadline: float) -> None:
+        """
+        Take a slot, waiting until the deadline (time.monotonic()); raise AdmissionRejected
+        at once if the wait queue is full, or when the deadline passes
+        """
+        with self.condition:
+            if self.active >= self.limit:
+                if self.waiting >= self.max_waiting:
+                    raise self._reject()
+                self.waiting += 1
+                try:
+                    admitted = self.condition.wait_for(
+                        lambda: self.active < self.limit, max(0.0, deadline - time.monotonic())
+                    )
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    raise self._reject()
+            self.active += 1
+            self.admitted += 1
+
+    async def aacquire(self, deadline: float) -> None:
+        """
+        Async version of acquire(): polls for a free slot without blocking the event loop
+        """
+        if self.try_acquire():
+            return
+        with self.condition:
+            if self.waiting >= self.max_waiting:
+                raise self._reject()
+            self.waiting += 1
+        try:
+            while not self.try_acquire():
+                if time.monotonic() >= deadline:
+                    with self.condition:
+                        raise self._reject()
+                await asyncio.sleep(0.02)
+        finally:
+            with self.condition:
+                self.waiting -= 1
+
+    def release(self, held: Optional[float]) -> None:
+        """
+        Free a slot that was held for `held` seconds; None when it is given back unused
+        (the call was not made), which leaves the average call duration alone
+        """
+        with self.condition:
+            self.active -= 1
+            if held is not None:
+                self.hold_time = 0.8 * self.hold_time + 0.2 * held
+            self.condition.notify()
+
+    def stats(self) -> Dict:
+        with self.condition:
+            return {
+                "limit": self.limit,
+                "active": self.active,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "hold_time": round(self.hold_time, 3),
+            }
+
+
+class Admission:
+    """
+    The limiters in front of the LLM calls: a call holds a slot of its model (if it has
+    a limit of its own), of its provider, and of the whole server
+    """
+
+    def __init__(
+        self,
+        global_limit: int = LLM_GLOBAL_LIMIT,
+        provider_limit: int = LLM_PROVIDER_LIMIT,
+        limits: Optional[Dict[str, int]] = None,
+        timeout: float = ADMISSION_TIMEOUT,
+        max_waiting: int = ADMISSION_MAX_WAITING,
+    ):
+        """
+        Initialize the global limiter; the others are created on first use
+        """
+        self.provider_limit = provider_limit
+        self.limits = parse_limits(LLM_LIMITS) if limits is None else limits
+        self.timeout = timeout
+        self.max_waiting = max_waiting
+        self.global_limiter = Limiter("server", global_limit, 503, global_limit * max_waiting)
+        self.limiters: Dict[str, Limiter] = {}
+        self.lock = threading.Lock()
+
+    def _limiter(self, name: str, limit: int) -> Limiter:
+        with self.lock:
+            limiter = self.limiters.get(name)
+            if limiter is None:
+                limiter = self.limiters[name] = Limiter(name, limit, 429, limit * self.max_waiting)
+            return limiter
+
+    def limiters_for(self, llm: LLM) -> List[Limiter]:
+        """
+        Return the limiters of an LLM, narrowest first; a human player has none
+        """
+        if isinstance(llm, Human):
+            return []
+        provider = type(llm).__name__
+        limiters = []
+        if llm.model_name in self.limits:
+            limiters.append(self._limiter(f"model:{llm.model_name}", self.limits[llm.model_name]))
+        limiters.append(
+            self._limiter(f"provider:{provider}", self.limits.get(provider, self.provider_limit))
+        )
+        limiters.append(self.global_limiter)
+        return limiters
+
+    @contextmanager
+    def admit(self, llm: LLM, timeout: Optional[float] = None) -> Iterator[None]:
+        """
+        Hold a slot of every limiter of this LLM during the call; raise AdmissionRejected
+        if they can't all be taken within the timeout
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        # Le plus étroit d'abord: on ne garde pas une place globale en attendant un modèle
+        taken = []
+        admitted = False
+        try:
+            with span("admission", model=llm.model_name):
+                for limiter in self.limiters_for(llm):
+                    limiter.acquire(deadline)
+                    taken.append(limiter)
+            admitted = True
+        finally:
+            # Refus, mais aussi annulation (client déconnecté) ou Ctrl-C: on rend les places prises
+            if not admitted:
+                for limiter in taken:
+                    limiter.release(None)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - start
+            for limiter in taken:
+                limiter.release(held)
+
+    @asynccontextmanager
+    async def aadmit(self, llm: LLM, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """
+        Async version of admit(), for the ASGI server
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        taken = []
+        admitted = False
+        try:
+            with span("admission", model=llm.model_name):
+                for limiter in self.limiters_for(llm):
+                    await limiter.aacquire(deadline)
+                    taken.append(limiter)
+            admitted = True
+        finally:
+            # Refus, mais aussi annulation (client déconnecté) ou Ctrl-C: on rend les places prises
+            if not admitted:
+                for limiter in taken:
+                    limiter.release(None)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - start
+            for limiter in taken:
+                limiter.release(held)
+
+    def _take_idle(self, llm: LLM, headroom: int) -> Optional[List[Limiter]]:
+        taken = []
+        for limiter in self.limiters_for(llm):
+            if not limiter.try_acquire_idle(headroom):
+                for held in taken:
+                    held.release(None)
+                return None
+            taken.append(limiter)
+        return taken
+
+    @contextmanager
+    def admit_background(
+        self,
+        llm: LLM,
+        headroom: int = 0,
+        wait: float = 0.0,
+        stop: Optional[threading.Event] = None,
+    ) -> Iterator[bool]:
+        """
+        Hold slots for a call nobody is waiting on (a background job, a speculation). Slots
+        are only taken when no interactive call waits for them and more than `headroom` are
+        free, so background work never fills the bounded wait queue nor delays a user.
+        Yields False if no slot could be taken within `wait` seconds, or once stop is set
+        """
+        deadline = time.monotonic() + wait
+        with span("admission", model=llm.model_name, background=True):
+            taken = self._take_idle(llm, headroom)
+            while taken is None and time.monotonic() < deadline:
+                if stop is not None and stop.wait(0.05):
+                    break
+                if stop is None:
+                    time.sleep(0.05)
+                taken = self._take_idle(llm, headroom)
+        if taken is None:
+            yield False
+            return
+        start = time.monotonic()
+        try:
+            yield True
+        finally:
+            held = time.monotonic() - start
+            for limiter in taken:
+                limiter.release(held)
+
+    def stats(self) -> Dict:
+        """
+        Return the counts of every limiter, for monitoring
+        """
+        with self.lock:
+            limiters = list(self.limiters.values())
+        return {
+            "server": self.global_limiter.stats(),
+            **{limiter.name: limiter.stats() for limiter in limiters},
+        }
+
+
+_admission = Admission()
+
+
+def admit(llm: LLM, timeout: Optional[float] = None):
+    """
+    Hold a slot of the process-wide limiters for a call to this LLM
+    """
+    return _admission.admit(llm, timeout)
+
+
+def aadmit(llm: LLM, timeout: Optional[float] = None):
+    """
+    Async version of admit()
+    """
+    return _admission.aadmit(llm, timeout)
+
+
+def admit_background(llm: LLM, headroom: int = 0, wait: float = 0.0, stop: Optional[threading.Event] = None):
+    """
+    Hold slots of the process-wide limiters for a background call, behind interactive calls
+    """
+    return _admission.admit_background(llm, headroom, wait, stop)
+
+
+def admission_stats() -> Dict:
+    """
+    Return the stats of the process-wide limiters
+    """
+    return _admission.stats()
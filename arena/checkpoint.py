@@ -0,0 +1,433 @@
+# Tournament progress stored in the games DB: resumable runs, and a work queue shared by several nodes
+
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Collection, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from arena import record
+from arena.tournament import Matchup, Outcome
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SCHEDULING = "scheduling"  # un planificateur adaptatif ajoute encore des parties (sous bail)
+
+# Durée d'un bail sur une partie; le worker le renouvelle tous les tiers de cette durée
+TOURNAMENT_LEASE = float(os.getenv("TOURNAMENT_LEASE", 60))
+TOURNAMENT_POLL = float(os.getenv("TOURNAMENT_POLL", 1.0))  # attente quand la file est vide
+
+
+class CheckpointError(Exception):
+    """
+    Raised when a tournament can't be found or its progress can't be stored
+    """
+
+
+def _owner_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class TournamentCheckpoint:
+    """
+    The schedule and progress of one tournament, in the tournaments and tournament_games
+    tables. Every game has a number (seq) and a seed; it is pending, running, done or failed.
+
+    The games table doubles as a work queue: a worker (a process, on any machine sharing
+    the DB file) claims a pending game with a lease, renews the leases of its games while
+    they are played, and a game whose lease expired (its worker died) is claimed again.
+    A game is marked done in the same transaction that records its result (see
+    record.record_game), and a game already done is never recorded again, so a game
+    finished by two workers is stored once.
+
+    The node running an adaptive scheduler holds a lease on the tournament row in the
+    same way: if it dies, the tournament is treated as running once the lease expires,
+    and the other workers finish the games left instead of waiting for new ones.
+    """
+
+    def __init__(self, tournament_id: str, config: Dict, seed: int, lease: float = TOURNAMENT_LEASE):
+        """
+        Initialize the handle; owner identifies this process in the leases it takes
+        """
+        self.id = tournament_id
+        self.config = config
+        self.seed = seed
+        self.lease = lease
+        self.owner = _owner_id()
+        self.producing = False  # ce nœud planifie: il renouvelle le bail du tournoi
+
+    @staticmethod
+    def _connect():
+        conn = record._get_db()
+        if conn is None:
+            raise CheckpointError("The database is unavailable")
+        return conn
+
+    @classmethod
+    def create(
+        cls, config: Dict, matchups: Iterable[Matchup] = (), seed: Optional[int] = None, scheduling: bool = False
+    ) -> "TournamentCheckpoint":
+        """
+        Store a new tournament, with its configuration and the matchups known in advance.
+        An adaptive schedule has none yet: it is created with scheduling=True, and its
+        games are added as they are chosen
+        """
+        seed = seed if seed is not None else random.randrange(2**31)
+        checkpoint = cls(uuid.uuid4().hex[:12], config, seed)
+        now = datetime.now().isoformat()
+        conn = cls._connect()
+        try:
+            conn.execute(
+                "INSERT INTO tournaments (id, config, seed, status, created, updated, lease_expires)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    checkpoint.id, json.dumps(config), seed, SCHEDULING if scheduling else RUNNING, now, now,
+                    time.time() + checkpoint.lease if scheduling else None,
+                ),
+            )
+            conn.executemany(
+                "INSERT INTO tournament_games (tournament_id, seq, red_player, blue_player, variant, seed, status, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (checkpoint.id, seq, matchup.red, matchup.blue, matchup.variant, checkpoint._game_seed(seq), PENDING, now)
+                    for seq, matchup in enumerate(matchups)
+                ],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return checkpoint
+
+    @classmethod
+    def load(cls, tournament_id: str) -> "TournamentCheckpoint":
+        """
+        Return a stored tournament; its failed games become pending again. Games left running
+        by a worker that died are claimed again once their lease expires
+        """
+        conn = cls._connect()
+        try:
+            row = conn.execute("SELECT config, seed FROM tournaments WHERE id = ?", (tournament_id,)).fetchone()
+            if row is None:
+                raise CheckpointError(f"Unknown tournament: {tournament_id}")
+            conn.execute(
+                "UPDATE tournament_games SET status = ?, owner = NULL, updated = ? WHERE tournament_id = ? AND status = ?",
+                (PENDING, datetime.now().isoformat(), tournament_id, FAILED),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return cls(tournament_id, json.loads(row[0]), row[1])
+
+    def _game_seed(self, seq: int) -> int:
+        """
+        The seed of game number seq, derived from the tournament seed
+        """
+        return random.Random(self.seed * 1_000_003 + seq).randrange(2**31)
+
+    def _set_status(self, status: str) -> None:
+        """
+        Change the status of the tournament; SCHEDULING takes the scheduler's lease
+        """
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE tournaments SET status = ?, updated = ?, lease_expires = ? WHERE id = ?",
+                (
+                    status, datetime.now().isoformat(),
+                    time.time() + self.lease if status == SCHEDULING else None, self.id,
+                ),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _set(self, matchup: Matchup, status: str, error: str = "") -> None:
+        """
+        Change the status of a game this worker holds; a game claimed since by another
+        worker is left alone
+        """
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE tournament_games SET status = ?, error = ?, owner = NULL, updated = ?"
+                " WHERE tournament_id = ? AND seq = ? AND status = ? AND owner = ?",
+                (status, error, datetime.now().isoformat(), self.id, matchup.seq, RUNNING, self.owner),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _without(skip: Collection[str]) -> Tuple[str, List[str]]:
+        """
+        Return the SQL condition (and its parameters) leaving out the games of these models
+        """
+        if not skip:
+            return "", []
+        marks = ", ".join("?" * len(skip))
+        return f" AND red_player NOT IN ({marks}) AND blue_player NOT IN ({marks})", [*skip, *skip]
+
+    def claim(self, skip: Collection[str] = ()) -> Optional[Matchup]:
+        """
+        Take the first game that is pending, or whose lease expired, and lease it to this
+        worker; games of the models in skip (out of budget) are left pending
+        """
+        now = time.time()
+        without, params = self._without(skip)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT seq, red_player, blue_player, variant, seed FROM tournament_games"
+                " WHERE tournament_id = ? AND (status = ? OR (status = ? AND lease_expires < ?))" + without +
+                " ORDER BY seq LIMIT 1",
+                (self.id, PENDING, RUNNING, now, *params),
+            ).fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            seq, red, blue, variant, seed = row
+            conn.execute(
+                "UPDATE tournament_games SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1, updated = ?"
+                " WHERE tournament_id = ? AND seq = ?",
+                (RUNNING, self.owner, now + self.lease, datetime.now().isoformat(), self.id, seq),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return Matchup(red, blue, variant, seq=seq, seed=seed)
+
+    def heartbeat(self) -> int:
+        """
+        Renew the leases of the games this worker is playing, and the scheduler's lease if
+        this node schedules; returns how many games
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE tournament_games SET lease_expires = ? WHERE tournament_id = ? AND status = ? AND owner = ?",
+                (time.time() + self.lease, self.id, RUNNING, self.owner),
+            )
+            if self.producing:
+                conn.execute(
+                    "UPDATE tournaments SET lease_expires = ? WHERE id = ? AND status = ?",
+                    (time.time() + self.lease, self.id, SCHEDULING),
+                )
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def keep_alive(self, stop: threading.Event) -> threading.Thread:
+        """
+        Start a thread renewing this worker's leases until stop is set
+        """
+
+        def loop():
+            while not stop.wait(self.lease / 3):
+                try:
+                    self.heartbeat()
+                except Exception as e:
+                    logging.error("Failed to renew the tournament leases")
+                    logging.exception(e)
+
+        thread = threading.Thread(target=loop, name="tournament-heartbeat", daemon=True)
+        thread.start()
+        return thread
+
+    def fail(self, matchup: Matchup, error: str) -> None:
+        """
+        Mark a game as failed; it is played again on resume
+        """
+        self._set(matchup, FAILED, error)
+
+    def release(self, matchup: Matchup) -> None:
+        """
+        Put back a game that was stopped before its end, for any worker to claim
+        """
+        self._set(matchup, PENDING)
+
+    def slot(self, matchup: Matchup) -> Tuple[str, int]:
+        """
+        Return the slot to pass to Game.record for this game
+        """
+        return self.id, matchup.seq
+
+    def add(self, matchup: Matchup) -> int:
+        """
+        Queue a matchup chosen by a scheduler, and return its seq
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            (last,) = conn.execute(
+                "SELECT COALESCE(MAX(seq), -1) FROM tournament_games WHERE tournament_id = ?", (self.id,)
+            ).fetchone()
+            seq = last + 1
+            conn.execute(
+                "INSERT INTO tournament_games (tournament_id, seq, red_player, blue_player, variant, seed, status, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.id, seq, matchup.red, matchup.blue, matchup.variant, self._game_seed(seq), PENDING,
+                 datetime.now().isoformat()),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return seq
+
+    def counts(self, skip: Collection[str] = ()) -> Dict[str, int]:
+        """
+        Return the number of games in each status, leaving out the games of the models in skip
+        """
+        without, params = self._without(skip)
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) FROM tournament_games WHERE tournament_id = ?" + without + " GROUP BY status",
+                (self.id, *params),
+            ).fetchall()
+        finally:
+            conn.close()
+        return dict(rows)
+
+    def scheduling(self) -> bool:
+        """
+        True while a scheduler may still add games: its lease has not expired
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT status, lease_expires FROM tournaments WHERE id = ?", (self.id,)).fetchone()
+        finally:
+            conn.close()
+        return row is not None and _status(*row) == SCHEDULING
+
+    def results(self, after: int = -1) -> List[Outcome]:
+        """
+        Return the games done with seq > after, whichever worker played them, in seq order
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT t.seq, t.red_player, t.blue_player, t.variant, g.red_won, g.blue_won"
+                " FROM tournament_games t JOIN games g ON g.id = t.game_id"
+                " WHERE t.tournament_id = ? AND t.status = ? AND t.seq > ? ORDER BY t.seq",
+                (self.id, DONE, after),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            Outcome(
+                Matchup(red, blue, variant, seq=seq),
+                winner="red" if red_won and not blue_won else "blue" if blue_won and not red_won else None,
+            )
+            for seq, red, blue, variant, red_won, blue_won in rows
+        ]
+
+    def work(
+        self,
+        producer: Optional[Iterator[Matchup]] = None,
+        lookahead: int = 1,
+        observe: Optional[Callable[[Outcome], None]] = None,
+        exhausted: Optional[Callable[[Collection[str]], Collection[str]]] = None,
+    ) -> Iterator[Matchup]:
+        """
+        Yield the games this worker claims, until none is left anywhere.
+
+        With a producer (the adaptive scheduler of the node that runs it), the queue is
+        topped up to `lookahead` pending games, and every game done by any worker is
+        passed to observe so that the scheduler sees the results of the other nodes (the
+        games done before the call are left out: the scheduler read them from the DB).
+        Without one, the worker waits while another node may still add games.
+
+        exhausted returns the models, among those given, that are out of budget: their
+        games stay pending (a later --resume plays them) and are not waited for
+        """
+        # Les parties déjà terminées font partie de l'historique du planificateur
+        observed = {outcome.matchup.seq for outcome in self.results()} if observe is not None else set()
+        floor = -1  # toutes les parties jusqu'à ce numéro ont été vues
+        producing = producer is not None
+        if producing:
+            # Un planificateur relancé (--resume) reprend le bail du tournoi
+            self._set_status(SCHEDULING)
+            self.producing = True
+        while True:
+            if observe is not None:
+                for outcome in self.results(floor):
+                    if outcome.matchup.seq not in observed:
+                        observed.add(outcome.matchup.seq)
+                        observe(outcome)
+                while floor + 1 in observed:
+                    floor += 1
+                    observed.discard(floor)
+            if producing and self.counts().get(PENDING, 0) < lookahead:
+                matchup = next(producer, None)
+                if matchup is None:
+                    producing = self.producing = False
+                    self._set_status(RUNNING)
+                else:
+                    self.add(matchup)
+                continue
+            skip = exhausted(self.config["models"]) if exhausted is not None else ()
+            matchup = self.claim(skip)
+            if matchup is not None:
+                yield matchup
+                continue
+            counts = self.counts(skip)
+            if not producing and not counts.get(PENDING) and not counts.get(RUNNING) and not self.scheduling():
+                return
+            # Parties en cours ailleurs (ou ici): leur bail peut encore expirer
+            time.sleep(TOURNAMENT_POLL)
+
+    def finish(self) -> None:
+        """
+        Mark the tournament finished if no game is left to play
+        """
+        counts = self.counts()
+        if counts.get(PENDING) or counts.get(RUNNING) or counts.get(FAILED) or self.scheduling():
+            return
+        self._set_status(DONE)
+
+
+def _status(status: str, lease_expires: Optional[float]) -> str:
+    """
+    The status of a tournament, where a scheduler whose lease expired (its node died) counts as gone
+    """
+    if status == SCHEDULING and (lease_expires or 0) < time.time():
+        return RUNNING
+    return status
+
+
+def list_tournaments() -> List[Dict]:
+    """
+    Return the stored tournaments with their progress, newest first
+    """
+    conn = TournamentCheckpoint._connect()
+    try:
+        rows = conn.execute(
+            """
+            SELECT t.id, t.status, t.lease_expires, t.created, t.config,
+                   SUM(CASE WHEN g.status = 'done' THEN 1 ELSE 0 END), COUNT(g.seq)
+            FROM tournaments t LEFT JOIN tournament_games g ON g.tournament_id = t.id
+            GROUP BY t.id ORDER BY t.created DESC
+            """
+        ).fetchall()
+    except Exception as e:
+        logging.error("Failed to list the tournaments")
+        logging.exception(e)
+        rows = []
+    finally:
+        conn.close()
+    return [
+        {
+            "id": id_, "status": _status(status, lease_expires), "created": created,
+            "config": json.loads(config), "done": done or 0, "games": games,
+        }
+        for id_, status, lease_expires, created, config, done, games in rows
+    ]
@@ -0,0 +1,200 @@
+# Token prices, cost of the recorded moves, and spending budgets per model or provider
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from arena import record
+
+# Prix en USD par million de jetons (entrée, sortie); les modèles locaux ne coûtent rien
+PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-5-nano": (0.05, 0.40),
+    "gpt-5-mini": (0.25, 2.00),
+    "gpt-5": (1.25, 10.00),
+    "claude-opus-4-1-20250805": (15.00, 75.00),
+    "claude-sonnet-4-5": (3.00, 15.00),
+    "claude-haiku-4-5": (1.00, 5.00),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.5-pro": (1.25, 10.00),
+    "deepseek-chat V3": (0.27, 1.10),
+    "deepseek-reasoner R1": (0.55, 2.19),
+    "openai/gpt-oss-120b via Groq": (0.15, 0.75),
+    "llama3.2 local": (0.0, 0.0),
+    "gemma2 local": (0.0, 0.0),
+    "qwen2.5 local": (0.0, 0.0),
+    "phi4 local": (0.0, 0.0),
+    "Humain": (0.0, 0.0),
+    "stub": (0.0, 0.0),
+    "stub-slow": (0.0, 0.0),
+}
+
+BUDGET_REFRESH = float(os.getenv("BUDGET_REFRESH", 1.0))  # secondes entre deux lectures des dépenses
+# Jetons (entrée, sortie) d'un modèle sur une partie, tant qu'il n'en a aucune en base
+BUDGET_GAME_TOKENS = tuple(int(n) for n in os.getenv("BUDGET_GAME_TOKENS", "6000/2000").split("/"))
+
+_warned: Set[str] = set()
+
+
+def parse_prices(spec: str) -> Dict[str, Tuple[float, float]]:
+    """
+    Parse "model=input/output,model=input/output" (USD per million tokens), ignoring malformed entries
+    """
+    prices = {}
+    for item in spec.split(","):
+        name, _, value = item.strip().partition("=")
+        prompt, _, completion = value.partition("/")
+        try:
+            prices[name.strip()] = (float(prompt), float(completion or prompt))
+        except ValueError:
+            continue
+    return prices
+
+
+def parse_budgets(spec: str) -> Dict[str, float]:
+    """
+    Parse "name=usd,name=usd", where a name is a model or a provider class (as in LLM_LIMITS)
+    """
+    budgets = {}
+    for item in spec.split(","):
+        name, _, value = item.strip().partition("=")
+        try:
+            budgets[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return budgets
+
+
+PRICES.update(parse_prices(os.getenv("LLM_PRICES", "")))
+
+
+def cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """
+    Return the estimated cost of a call in USD; a model missing from the price table costs nothing
+    """
+    price = PRICES.get(model)
+    if price is None:
+        if model not in _warned:
+            _warned.add(model)
+            logging.warning(f"No price for {model}, its calls are counted as free (set LLM_PRICES)")
+        return 0.0
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+
+def month_start(now: Optional[datetime] = None) -> datetime:
+    now = now or datetime.now()
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def spending(since: datetime) -> Dict[str, Tuple[float, int]]:
+    """
+    Return the cost and number of games of every model, for the moves recorded since that date
+    """
+    conn = record._get_db()
+    if conn is None:
+        return {}
+    try:
+        rows = conn.execute(
+            """
+            SELECT m.model, SUM(m.cost), COUNT(DISTINCT m.game_id)
+            FROM moves m JOIN games g ON g.id = m.game_id
+            WHERE g.date >= ?
+            GROUP BY m.model
+            """,
+            (since.isoformat(),),
+        ).fetchall()
+        conn.close()
+        return {model: (total or 0.0, games) for model, total, games in rows}
+    except Exception as e:
+        logging.error("Error reading the spending from the database")
+        logging.exception(e)
+        conn.close()
+        return {}
+
+
+class Budget:
+    """
+    Spending limits in USD, per model or per provider class, over the games recorded since
+    a date (the start of the month by default). The recorded spend is read from the moves
+    table, so every process sharing the DB counts against the same budget; the games this
+    process has in progress are counted at the average cost of a game of their models, or
+    from the price table for a model with no recorded game.
+    """
+
+    def __init__(self, limits: Dict[str, float], since: Optional[datetime] = None, refresh: float = BUDGET_REFRESH):
+        """
+        Initialize the budget; nothing is read from the DB until the first check
+        """
+        self.limits = limits
+        self.since = since or month_start()
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.recorded: Dict[str, Tuple[float, int]] = {}
+        self.read_at = 0.0
+        self.in_flight: Dict[str, int] = {}
+
+    @staticmethod
+    def _provider(model: str) -> str:
+        from arena.llm import LLM
+
+        provider = LLM.model_map().get(model)
+        return provider.__name__ if provider is not None else ""
+
+    def _spend(self) -> Dict[str, float]:
+        """
+        Return the spend of every model: recorded, plus the games in progress
+        """
+        if time.monotonic() - self.read_at > self.refresh:
+            self.recorded = spending(self.since)
+            self.read_at = time.monotonic()
+        spend = {model: total for model, (total, _) in self.recorded.items()}
+        for model, games in self.in_flight.items():
+            total, played = self.recorded.get(model, (0.0, 0))
+            # Sans historique, on estime une partie d'après la table de prix
+            per_game = total / played if played else cost(model, *BUDGET_GAME_TOKENS)
+            spend[model] = spend.get(model, 0.0) + games * per_game
+        return spend
+
+    def spent(self) -> Dict[str, float]:
+        """
+        Return the spend counted against every limit
+        """
+        with self.lock:
+            spend = self._spend()
+        return {
+            name: sum(total for model, total in spend.items() if name in (model, self._provider(model)))
+            for name in self.limits
+        }
+
+    def exhausted_models(self, models: Iterable[str]) -> Set[str]:
+        """
+        Return the models, among these, that have a spent limit (their own or their provider's)
+        """
+        spent = self.spent()
+        over = {name for name, limit in self.limits.items() if spent[name] >= limit}
+        return {model for model in models if model in over or self._provider(model) in over}
+
+    def affordable(self, model: str) -> bool:
+        return not self.exhausted_models([model])
+
+    def reserve(self, models: Iterable[str]) -> None:
+        """
+        Count a game about to be played by these models
+        """
+        with self.lock:
+            for model in models:
+                self.in_flight[model] = self.in_flight.get(model, 0) + 1
+
+    def settle(self, models: Iterable[str]) -> None:
+        """
+        Stop counting a game in progress; once recorded, its moves count instead
+        """
+        with self.lock:
+            for model in models:
+                self.in_flight[model] = max(self.in_flight.get(model, 0) - 1, 0)
+            # Relire les dépenses au prochain contrôle: la partie vient d'être enregistrée
+            self.read_at = 0.0
@@ -0,0 +1,193 @@
+# Columnar export of the games DB for offline analytics
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from arena import record
+
+STATE_FILE = "_export_state.json"
+
+GAMES_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("red_player", pa.string()),
+    ("blue_player", pa.string()),
+    ("red_won", pa.bool_()),
+    ("blue_won", pa.bool_()),
+    ("date", pa.timestamp("us")),
+])
+
+
+def _load_state(out_dir: str) -> Dict[str, int]:
+    """
+    Return the last exported id of each table (empty on a first export)
+    """
+    path = os.path.join(out_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_state(out_dir: str, state: Dict[str, int]) -> None:
+    """
+    Atomically store the last exported id of each table
+    """
+    path = os.path.join(out_dir, STATE_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    """
+    Return True if the table exists in the DB
+    """
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def _chunks(cursor: sqlite3.Cursor, chunk_size: int) -> Iterator[List[tuple]]:
+    """
+    Yield the rows of a cursor chunk by chunk, so only one chunk is ever in memory
+    """
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+def _write_partitions(
+    out_dir: str, table_name: str, columns: List[str], schema: pa.Schema, rows: List[tuple]
+) -> int:
+    """
+    Split a chunk by (variant, month) and write one Parquet file per partition.
+    The last two values of each row are the variant and the month; the first is the id.
+    Returns the number of files written.
+    """
+    partitions: Dict[tuple, List[tuple]] = {}
+    for row in rows:
+        partitions.setdefault((row[-2], row[-1]), []).append(row[:-2])
+
+    for (variant, month), part in partitions.items():
+        data = {name: [row[i] for row in part] for i, name in enumerate(columns)}
+        table = pa.Table.from_pydict(data, schema=schema)
+        directory = os.path.join(out_dir, table_name, f"variant={variant}", f"month={month}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{part[0][0]:012d}-{part[-1][0]:012d}.parquet")
+        pq.write_table(table, path + ".tmp", compression="zstd")
+        os.replace(path + ".tmp", path)
+    return len(partitions)
+
+
+def _export_games(conn: sqlite3.Connection, out_dir: str, state: Dict[str, int], chunk_size: int) -> None:
+    """
+    Stream the games table, saving the export state after every chunk
+    """
+    cursor = conn.execute("""
+        SELECT id, red_player, blue_player, red_won, blue_won, date,
+               variant, substr(date, 1, 7)
+        FROM games
+        WHERE id > ?
+        ORDER BY id
+    """, (state.get("games", 0),))
+    for rows in _chunks(cursor, chunk_size):
+        rows = [
+            (row[0], row[1], row[2], bool(row[3]), bool(row[4]), datetime.fromisoformat(row[5]), row[6], row[7])
+            for row in rows
+        ]
+        _write_partitions(out_dir, "games", GAMES_SCHEMA.names, GAMES_SCHEMA, rows)
+        state["games"] = rows[-1][0]
+        _save_state(out_dir, state)
+        logging.info(f"Exported games up to id {state['games']}")
+
+
+def _export_moves(conn: sqlite3.Connection, out_dir: str, state: Dict[str, int], chunk_size: int) -> None:
+    """
+    Stream the move-level table, if the DB records one; partitioned like its games
+    """
+    if not _has_table(conn, "moves"):
+        return
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(moves)")]
+    cursor = conn.execute(f"""
+        SELECT {", ".join("m." + column for column in columns)},
+               g.variant, substr(g.date, 1, 7)
+        FROM moves m JOIN games g ON g.id = m.game_id
+        WHERE m.id > ?
+        ORDER BY m.id
+    """, (state.get("moves", 0),))
+    schema = None
+    for rows in _chunks(cursor, chunk_size):
+        if schema is None:
+            # Let Arrow infer the column types from the first chunk, then keep them for the rest
+            schema = pa.Table.from_pylist([dict(zip(columns, row[:-2])) for row in rows]).schema
+        _write_partitions(out_dir, "moves", columns, schema, rows)
+        state["moves"] = rows[-1][0]
+        _save_state(out_dir, state)
+        logging.info(f"Exported moves up to id {state['moves']}")
+
+
+def export_parquet(
+    out_dir: str,
+    incremental: bool = True,
+    chunk_size: int = 50_000,
+    db_file: Optional[str] = None,
+) -> Dict[str, int]:
+    """
+    Export the games (and moves, if recorded) into Parquet files partitioned by variant
+    and month, reading at most chunk_size rows at a time.
+
+    Args:
+        out_dir: Directory of the dataset; games/ and moves/ are created below it
+        incremental: If True, only export rows with an id above the last export
+        chunk_size: Number of rows read and written per chunk
+        db_file: SQLite file to read (defaults to the record layer's DB_FILE)
+
+    Returns:
+        The last exported id of each table
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    if incremental:
+        state = _load_state(out_dir)
+    else:
+        # A full export replaces the previous files rather than adding to them
+        for table_name in ("games", "moves"):
+            shutil.rmtree(os.path.join(out_dir, table_name), ignore_errors=True)
+        state = {}
+    conn = sqlite3.connect(db_file or record.DB_FILE)
+    try:
+        # The state is saved after every chunk, so an interrupted export resumes where it stopped
+        _export_games(conn, out_dir, state, chunk_size)
+        _export_moves(conn, out_dir, state, chunk_size)
+    finally:
+        conn.close()
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the Nim games DB to Parquet")
+    parser.add_argument("out_dir", help="Destination directory of the Parquet dataset")
+    parser.add_argument("--full", action="store_true", help="Re-export everything instead of only new ids")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="Rows per chunk")
+    parser.add_argument("--db", default=None, help="SQLite file (defaults to nim_games.db)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    state = export_parquet(args.out_dir, incremental=not args.full, chunk_size=args.chunk_size, db_file=args.db)
+    print(f"Export complete: {state}")
+
+
+if __name__ == "__main__":
+    main()
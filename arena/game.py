@@ -1,39 +1,131 @@
 from arena.nim_game import NimGame, RED, BLUE
 from arena.player import Player
-from arena.record import get_games, Result, record_game, ratings, ratings_by_variant
+from arena.record import get_games, Move, Result, ratings, ratings_by_variant, rating_history, record_game
+from arena.writer import submit_game
+from arena.costs import cost
 from datetime import datetime
-from typing import List
-from arena.llm import LLM
+from typing import Callable, Dict, List, Optional, Tuple
+from arena.llm import LLM, track_usage
+from arena.tracing import span
 
 class Game:
     """
     A Game consists of a bunch of matchsticks and 2 players
     """
     
-    def __init__(self, model_red: str, model_BLUE: str, variant="normal", n=21):
-        """
-        Initialize this Game; a new nim_game, and new Player objects
-        """
+    def __init__(
+        self,
+        model_red: str,
+        model_BLUE: str,
+        variant="normal",
+        n=21,
+        llm_factory: Optional[Callable[[str], LLM]] = None,
+    ):
+        """
+        Initialize this Game; a new nim_game, and new Player objects.
+        llm_factory lets callers reuse LLM clients across games, as in from_dict
+        """
+        factory = llm_factory or LLM.create
         self.variant = variant
         self.n = n
         self.nim_game = NimGame(variant=variant, n=n)
         self.players = {
-            RED: Player(model_red, RED),
-            BLUE: Player(model_BLUE, BLUE),
+            RED: Player(model_red, RED, llm=factory(model_red)),
+            BLUE: Player(model_BLUE, BLUE, llm=factory(model_BLUE)),
         }
+        self.recorded = False
+        self.usage: Dict[int, Tuple[int, int]] = {}  # coup -> jetons (prompt, réponse) facturés
         
+    def to_dict(self) -> Dict:
+        """
+        Return the state of this Game: variant, starting pile, board and both players
+        """
+        return {
+            "variant": self.variant,
+            "n": self.n,
+            "nim_game": self.nim_game.to_dict(),
+            "recorded": self.recorded,
+            "usage": [[ply, prompt, completion] for ply, (prompt, completion) in self.usage.items()],
+            "players": {RED: self.players[RED].to_dict(), BLUE: self.players[BLUE].to_dict()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict, llm_factory: Optional[Callable[[str], LLM]] = None) -> "Game":
+        """
+        Rebuild a Game saved by to_dict; llm_factory lets callers reuse LLM clients across games
+        """
+        factory = llm_factory or LLM.create
+        # Les clés JSON sont des chaînes
+        players = {int(color): player for color, player in data["players"].items()}
+        game = cls.__new__(cls)
+        game.variant = data["variant"]
+        game.n = data["n"]
+        game.nim_game = NimGame.from_dict(data["nim_game"])
+        game.recorded = data.get("recorded", False)
+        game.usage = {ply: (prompt, completion) for ply, prompt, completion in data.get("usage", [])}
+        game.players = {}
+        for color in (RED, BLUE):
+            model = players[color]["model"]
+            game.players[color] = Player(model, color, llm=factory(model))
+            game.players[color].load_thoughts(players[color])
+        return game
+
     def reset(self):
         """
         Restart the game by resetting the nim_game; keep players the same
         """
         self.nim_game = NimGame(variant=self.variant, n=self.n)
+        self.recorded = False
+        self.usage = {}
         
     def pick(self):
         """
         Let the current player pick a move
         """
         current_player = self.players[self.nim_game.player_to_move]
-        current_player.pick(self.nim_game)
+        ply = len(self.nim_game.history)
+        with track_usage() as usage:
+            try:
+                current_player.pick(self.nim_game)
+            finally:
+                self._add_usage(ply, usage)
+
+    async def apick(self):
+        """
+        Let the current player pick a move, awaiting the LLM
+        """
+        current_player = self.players[self.nim_game.player_to_move]
+        ply = len(self.nim_game.history)
+        with track_usage() as usage:
+            try:
+                await current_player.apick(self.nim_game)
+            finally:
+                self._add_usage(ply, usage)
+
+    def _add_usage(self, ply: int, usage) -> None:
+        if usage.prompt_tokens or usage.completion_tokens:
+            prompt, completion = self.usage.get(ply, (0, 0))
+            self.usage[ply] = (prompt + usage.prompt_tokens, completion + usage.completion_tokens)
+
+    def moves(self) -> List[Move]:
+        """
+        Return the moves played so far, with the tokens billed for each; a forfeited
+        move comes last, without a move_remove
+        """
+        moves = []
+        sticks = self.n
+        plies = len(self.nim_game.history) + (1 if self.nim_game.forfeited else 0)
+        for ply in range(plies):
+            color = RED if ply % 2 == 0 else BLUE
+            model = self.players[color].llm.model_name
+            move_remove = self.nim_game.history[ply] if ply < len(self.nim_game.history) else None
+            prompt, completion = self.usage.get(ply, (0, 0))
+            moves.append(Move(
+                ply, "red" if color == RED else "blue", model, sticks, move_remove,
+                prompt, completion, cost(model, prompt, completion),
+            ))
+            sticks -= move_remove or 0
+        return moves
         
     def is_active(self):
         """
@@ -61,38 +153,60 @@ class Game:
         return get_games()
     
     @staticmethod
-    def get_ratings():
+    def get_ratings(engine_name: str = "elo"):
         """
-        Return the ELO ratings of all players - filter out any models that are not supported
+        Return the ratings of all players (ELO by default) - filter out any models that are not supported
         """
         return {
             model: rating
-            for model, rating in ratings().items()
+            for model, rating in ratings(engine_name).items()
             if model in LLM.all_supported_model_names()
         }
     
     @staticmethod
-    def get_ratings_by_variant(variant: str):
+    def get_ratings_by_variant(variant: str, engine_name: str = "elo"):
         """
-        Return the ELO ratings of all players for a specific variant - filter out any models that are not supported
+        Return the ratings of all players for a specific variant - filter out any models that are not supported
         """
         return {
             model: rating
-            for model, rating in ratings_by_variant(variant).items()
+            for model, rating in ratings_by_variant(variant, engine_name).items()
             if model in LLM.all_supported_model_names()
         }
 
-    def record(self):
+    @staticmethod
+    def get_rating_history(dates: List[datetime], variant: str = None):
+        """
+        Return the ELO ratings of all players at each date - filter out any models that are not supported
+        """
+        supported = LLM.all_supported_model_names()
+        return [
+            {model: rating for model, rating in point.items() if model in supported}
+            for point in rating_history(dates, variant)
+        ]
+
+    def record(self, slot: Optional[Tuple[str, int]] = None) -> bool:
         """
-        Store the results of this game in the DB
+        Store the results of this game in the DB, once; the write happens in the background.
+        A tournament game passes its slot (tournament id, game number): it is then written
+        at once, in the same transaction that marks the slot done. Returns False if that failed
         """
+        if self.recorded or self.nim_game.is_active():
+            return True
+        self.recorded = True
         red_player = self.players[RED].llm.model_name
         blue_player = self.players[BLUE].llm.model_name
         variant = self.nim_game.variant
         red_won = self.nim_game.winner == RED
         blue_won = self.nim_game.winner == BLUE
-        result = Result(red_player, blue_player, variant, red_won, blue_won, datetime.now())
-        record_game(result)
+        result = Result(red_player, blue_player, variant, red_won, blue_won, datetime.now(), self.moves())
+        if slot is not None:
+            with span("db.record"):
+                self.recorded = record_game(result, slot)
+            return self.recorded
+        # Partie d'interface: on ne mesure ici que la mise en file pour l'écrivain
+        with span("writer.enqueue"):
+            return submit_game(result)
 
     def run(self):
         """
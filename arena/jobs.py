@@ -0,0 +1,342 @@
+# Background jobs that play full games, so HTTP requests never wait on the LLMs
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, ContextManager, Dict, List, Optional, Tuple
+
+from arena.admission import admit_background
+from arena.game import Game
+from arena.player import HumanTurnException
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 32))
+JOB_USER_LIMIT = int(os.getenv("JOB_USER_LIMIT", 2))  # queued or running jobs per user
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", 1000))  # queued or running jobs overall
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", 600))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobLimitError(Exception):
+    """
+    Raised when a job is refused because a concurrency limit is reached
+    """
+
+
+@dataclass
+class Job:
+    """
+    One full-game run: the game of the session is played by a worker, and a snapshot of
+    its state is rendered after every move. The job keeps the state of the game it was
+    queued for; the game itself is loaded from the session store when the run starts
+    """
+
+    id: str
+    user: str
+    session: str
+    queued: Optional[Dict] = None
+    game: Optional[Game] = None
+    status: str = QUEUED
+    state: Dict = field(default_factory=dict)
+    version: int = 0
+    error: str = ""
+    stopped_for_human: bool = False
+    created: float = field(default_factory=time.monotonic)
+    finished: Optional[float] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    # Coroutines du serveur ASGI qui attendent un changement: (boucle, événement)
+    waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = field(default_factory=list)
+
+    def is_active(self) -> bool:
+        return self.status not in FINISHED
+
+    def to_dict(self) -> Dict:
+        """
+        Return the public fields of the job
+        """
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "version": self.version,
+            "error": self.error,
+            "stopped_for_human": self.stopped_for_human,
+            "state": self.state,
+        }
+
+
+class JobManager:
+    """
+    Runs games on a worker pool. Each user may have a few jobs at once, and the moves
+    wait for the LLM limits of arena.admission; finished jobs are kept for the result TTL
+    """
+
+    def __init__(
+        self,
+        render: Callable[[Game], Dict],
+        load: Callable[[str], Optional[Game]],
+        save: Optional[Callable[[str, Game], None]] = None,
+        session_lock: Optional[Callable[[str], ContextManager]] = None,
+        workers: int = JOB_WORKERS,
+        user_limit: int = JOB_USER_LIMIT,
+        max_pending: int = JOB_MAX_PENDING,
+        result_ttl: float = JOB_RESULT_TTL,
+    ):
+        """
+        Initialize the manager; render turns a game into the state snapshot of its job,
+        load returns the game of a session, save (if given) stores it after every move,
+        and session_lock (if given) is held on the session for the whole run
+        """
+        self.render = render
+        self.load = load
+        self.save = save
+        self.session_lock = session_lock
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="game-job")
+        self.user_limit = user_limit
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.futures: Dict[str, object] = {}
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+    def submit(self, user: str, session: str) -> Job:
+        """
+        Queue a run of the game of this session, and return the job at once.
+        Raises JobLimitError if the user, the session or the whole queue is at its limit.
+        """
+        game = self.load(session)
+        state = self.render(game) if game is not None else {}
+        with self.lock:
+            self._expire()
+            active = [job for job in self.jobs.values() if job.is_active()]
+            reason = ""
+            if any(job.session == session for job in active):
+                reason = "A run is already in progress for this game"
+            elif sum(1 for job in active if job.user == user) >= self.user_limit:
+                reason = f"At most {self.user_limit} runs at once per user"
+            elif len(active) >= self.max_pending:
+                reason = "Too many runs in progress, try again later"
+            if reason:
+                self.rejected += 1
+                raise JobLimitError(reason)
+            job = Job(
+                id=uuid.uuid4().hex, user=user, session=session,
+                queued=game.to_dict() if game is not None else None, state=state,
+            )
+            self.jobs[job.id] = job
+            self.futures[job.id] = self.executor.submit(self._run, job)
+            return job
+
+    def get(self, job_id: str, session: Optional[str] = None) -> Optional[Job]:
+        """
+        Return a job, or None if it is unknown, expired, or belongs to another session
+        """
+        with self.lock:
+            self._expire()
+            job = self.jobs.get(job_id)
+        if job is None or (session is not None and job.session != session):
+            return None
+        return job
+
+    def wait(self, job: Job, version: int, timeout: float) -> bool:
+        """
+        Block until the job moves past this version or finishes; False on timeout
+        """
+        with self.changed:
+            return self.changed.wait_for(
+                lambda: job.version > version or not job.is_active(), timeout
+            )
+
+    async def await_change(self, job: Job, version: int, timeout: float) -> bool:
+        """
+        Async version of wait(), for the ASGI server: awaits an event set by the worker
+        instead of holding a thread of the default executor; False on timeout
+        """
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            job.waiters.append(waiter)
+        try:
+            while True:
+                with self.lock:
+                    if job.version > version or not job.is_active():
+                        return True
+                    waiter[1].clear()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self.lock:
+                job.waiters.remove(waiter)
+
+    def _notify(self, job: Job) -> None:
+        """
+        Wake up whoever waits on the job, threads and coroutines. The lock must be held.
+        """
+        self.changed.notify_all()
+        for loop, event in job.waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Boucle déjà fermée (arrêt du serveur)
+                pass
+
+    def cancel(self, job_id: str, session: Optional[str] = None) -> Optional[Job]:
+        """
+        Cancel a job: a queued job never starts, a running one stops after its current move
+        """
+        job = self.get(job_id, session)
+        if job is None:
+            return None
+        job.cancel_event.set()
+        future = self.futures.get(job.id)
+        if future is not None and future.cancel():
+            self._finish(job, CANCELLED)
+        return job
+
+    def active_count(self) -> int:
+        """
+        Return the number of queued or running jobs
+        """
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if job.is_active())
+
+    def stats(self) -> Dict:
+        """
+        Return the counts of the manager, for monitoring
+        """
+        with self.lock:
+            self._expire()
+            statuses: Dict[str, int] = {}
+            for job in self.jobs.values():
+                statuses[job.status] = statuses.get(job.status, 0) + 1
+            return {
+                "jobs": statuses,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "rejected": self.rejected,
+                "user_limit": self.user_limit,
+            }
+
+    def _pick(self, job: Job) -> bool:
+        """
+        Play one move once the model has a free slot; False if the job was cancelled meanwhile
+        """
+        llm = job.game.players[job.game.nim_game.player_to_move].llm
+        # Un job n'a pas de client qui attend: il patiente hors de la file d'attente bornée,
+        # derrière les requêtes interactives, jusqu'à obtenir une place
+        with admit_background(llm, wait=float("inf"), stop=job.cancel_event) as admitted:
+            if not admitted:
+                return False
+            job.game.pick()
+        return True
+
+    def _publish(self, job: Job, status: Optional[str] = None) -> None:
+        """
+        Save and render the game, and wake up whoever waits on the job
+        """
+        if self.save is not None:
+            self.save(job.session, job.game)
+        state = self.render(job.game)
+        with self.changed:
+            job.state = state
+            job.version += 1
+            if status is not None:
+                job.status = status
+            self._notify(job)
+
+    def _finish(self, job: Job, status: str, error: str = "") -> None:
+        with self.changed:
+            if not job.is_active():
+                return
+            job.status = status
+            job.error = error
+            job.finished = time.monotonic()
+            self.futures.pop(job.id, None)
+            if status == DONE:
+                self.completed += 1
+            elif status == FAILED:
+                self.failed += 1
+            else:
+                self.cancelled += 1
+            self._notify(job)
+
+    def _run(self, job: Job) -> None:
+        """
+        Play the game to the end in a worker thread, holding the session lock
+        """
+        if job.cancel_event.is_set():
+            self._finish(job, CANCELLED)
+            return
+        try:
+            if self.session_lock is None:
+                self._start(job)
+            else:
+                with self.session_lock(job.session):
+                    self._start(job)
+        except Exception as e:
+            logging.error("Game job failed")
+            logging.exception(e)
+            self._finish(job, FAILED, str(e))
+
+    def _start(self, job: Job) -> None:
+        """
+        Load the game of the session and play it, unless it is gone or was changed since
+        the job was queued (a reset, another request): the run would overwrite it
+        """
+        game = self.load(job.session)
+        if game is None or job.queued is None or game.to_dict() != job.queued:
+            self._finish(job, CANCELLED, "The game changed before the run started")
+            return
+        job.game = game
+        self._play(job)
+
+    def _play(self, job: Job) -> None:
+        """
+        Play the moves of a job until the game ends, a human must play, or it is cancelled
+        """
+        self._publish(job, RUNNING)
+        game = job.game
+        try:
+            while game.nim_game.is_active():
+                if job.cancel_event.is_set() or not self._pick(job):
+                    self._finish(job, CANCELLED)
+                    return
+                if not game.nim_game.is_active():
+                    game.record()
+                self._publish(job)
+        except HumanTurnException:
+            job.stopped_for_human = True
+            self._publish(job)
+        self._finish(job, DONE)
+
+    def _expire(self) -> None:
+        """
+        Drop the finished jobs older than the result TTL. The lock must be held.
+        """
+        deadline = time.monotonic() - self.result_ttl
+        for job_id in [
+            job.id for job in self.jobs.values()
+            if job.finished is not None and job.finished < deadline
+        ]:
+            del self.jobs[job_id]
@@ -1,14 +1,25 @@
 from abc import ABC
+from openai import OpenAI, AsyncOpenAI
+from anthropic import Anthropic, AsyncAnthropic
 from openai import OpenAI
-from anthropic import Anthropic
-from openai import OpenAI
-from groq import Groq
+from groq import Groq, AsyncGroq
 from dotenv import load_dotenv
+import asyncio
+import json
 import logging
+import random
+import re
 import time
-from typing import Dict, Type, List
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional, Type, List
 import os
 
+from arena.costs import cost
+from arena.metrics import LLM_COST, LLM_FAILURES, LLM_LATENCY, LLM_RETRIES, LLM_TOKENS
+from arena.tracing import span
+
 # Pour la compatibilité Python 3.9
 try:
     from typing import Self
@@ -22,6 +33,44 @@ logger = logging.getLogger(__name__)
 class LLMException(Exception):
     pass
 
+
+@dataclass
+class Usage:
+    """
+    Tokens billed for one or more LLM calls (retries included)
+    """
+
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+# L'usage de l'appel en cours: une variable de contexte, car un même LLM sert plusieurs
+# threads et plusieurs tâches à la fois
+_usage: ContextVar[Optional[Usage]] = ContextVar("llm_usage", default=None)
+
+
+@contextmanager
+def track_usage() -> Iterator[Usage]:
+    """
+    Add up the tokens of the LLM calls made inside the block, in this thread or task
+    """
+    usage = Usage()
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+
+def strip_thoughts(reply: str) -> str:
+    """
+    Log and remove the <think> section that reasoning models put before their answer
+    """
+    if "</think>" in reply:
+        logging.info("Thoughts:\n" + reply.split("</think>")[0].replace("<think>", ""))
+        reply = reply.split("</think>")[1]
+    return reply
+
 class LLM(ABC):
     """
     An abstract superclass for interacting with LLMs - subclass for Claude and GPT
@@ -35,6 +84,7 @@ class LLM(ABC):
         """
         self.model_name = model_name
         self.client = None
+        self._async_client = None
         self.temperature = temperature
         self.reasoning_effort = None
         
@@ -62,14 +112,75 @@ class LLM(ABC):
         retries = 3
         while retries:
             retries -= 1
-            try:
-                return self._send(system, user, max_tokens)
-            except Exception as e:
-                logging.error(f"Exception on calling LLM of {e}")
-                if retries:
-                    logging.warning("Waiting 2s and retrying")
+            start = time.perf_counter()
+            with span("llm.call", model=self.model_name, attempt=3 - retries) as current:
+                try:
+                    result = self._send(system, user, max_tokens)
+                    LLM_LATENCY.observe(time.perf_counter() - start, model=self.model_name, outcome="ok")
+                    return result
+                except Exception as e:
+                    LLM_LATENCY.observe(time.perf_counter() - start, model=self.model_name, outcome="error")
+                    logging.error(f"Exception on calling LLM of {e}")
+                    if current is not None:
+                        current.attributes["error"] = str(e)
+            if retries:
+                LLM_RETRIES.inc(model=self.model_name)
+                logging.warning("Waiting 2s and retrying")
+                with span("llm.backoff", model=self.model_name):
                     time.sleep(2)
+        LLM_FAILURES.inc(model=self.model_name)
         return "{}"
+
+    async def asend(self, system: str, user: str, max_tokens: int = 3000) -> str:
+        """
+        Send a message without blocking the event loop; same contract as send()
+        """
+        result = await self.protected_asend(system, user, max_tokens)
+        left = result.find("{")
+        right = result.rfind("}")
+        if left > -1 and right > -1:
+            result = result[left : right + 1]
+        return result
+
+    async def protected_asend(self, system: str, user: str, max_tokens: int = 3000) -> str:
+        """
+        Async version of protected_send: 3 chances in total, then forfeit
+        """
+        retries = 3
+        while retries:
+            retries -= 1
+            start = time.perf_counter()
+            with span("llm.call", model=self.model_name, attempt=3 - retries) as current:
+                try:
+                    result = await self._asend(system, user, max_tokens)
+                    LLM_LATENCY.observe(time.perf_counter() - start, model=self.model_name, outcome="ok")
+                    return result
+                except Exception as e:
+                    LLM_LATENCY.observe(time.perf_counter() - start, model=self.model_name, outcome="error")
+                    logging.error(f"Exception on calling LLM of {e}")
+                    if current is not None:
+                        current.attributes["error"] = str(e)
+            if retries:
+                LLM_RETRIES.inc(model=self.model_name)
+                logging.warning("Waiting 2s and retrying")
+                with span("llm.backoff", model=self.model_name):
+                    await asyncio.sleep(2)
+        LLM_FAILURES.inc(model=self.model_name)
+        return "{}"
+
+    @property
+    def async_client(self):
+        """
+        Return an async client with the same credentials and endpoint as self.client
+        """
+        if self._async_client is None:
+            if isinstance(self.client, OpenAI):
+                self._async_client = AsyncOpenAI(api_key=self.client.api_key, base_url=self.client.base_url)
+            elif isinstance(self.client, Anthropic):
+                self._async_client = AsyncAnthropic(api_key=self.client.api_key)
+            elif isinstance(self.client, Groq):
+                self._async_client = AsyncGroq(api_key=self.client.api_key)
+        return self._async_client
     
     def _send(self, system: str, user: str, max_tokens: int = 3000) -> str:
         """
@@ -98,8 +209,47 @@ class LLM(ABC):
                 ],
                 response_format={"type": "json_object"},
             )
+        self._track(response.usage)
+        return response.choices[0].message.content
+
+    async def _asend(self, system: str, user: str, max_tokens: int = 3000) -> str:
+        """
+        Async version of _send, following the OpenAI API structure
+        """
+        if type(self)._send is not LLM._send or self.async_client is None:
+            # A subclass with its own _send and no async version: run it off the event loop
+            return await asyncio.to_thread(self._send, system, user, max_tokens)
+        kwargs = {}
+        if self.reasoning_effort:
+            kwargs["reasoning_effort"] = self.reasoning_effort
+        response = await self.async_client.chat.completions.create(
+            model=self.api_model_name(),
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": user},
+            ],
+            response_format={"type": "json_object"},
+            **kwargs,
+        )
+        self._track(response.usage)
         return response.choices[0].message.content
     
+    def _track(self, usage) -> None:
+        """
+        Count the tokens of a provider response's usage (OpenAI or Anthropic field names)
+        """
+        if usage is None:
+            return
+        prompt = getattr(usage, "prompt_tokens", None) or getattr(usage, "input_tokens", None) or 0
+        completion = getattr(usage, "completion_tokens", None) or getattr(usage, "output_tokens", None) or 0
+        LLM_TOKENS.inc(prompt, model=self.model_name, kind="prompt")
+        LLM_TOKENS.inc(completion, model=self.model_name, kind="completion")
+        LLM_COST.inc(cost(self.model_name, prompt, completion), model=self.model_name)
+        current = _usage.get()
+        if current is not None:
+            current.prompt_tokens += prompt
+            current.completion_tokens += completion
+
     def api_model_name(self) -> str:
         """
         Return the actual model_name to be used in the call to the API; strip out anything after a space
@@ -191,6 +341,23 @@ class Claude(LLM):
                 {"role": "user", "content": user},
             ],
         )
+        self._track(response.usage)
+        return response.content[0].text
+
+    async def _asend(self, system: str, user: str, max_tokens: int = 3000) -> str:
+        """
+        Async version of _send for Claude
+        """
+        response = await self.async_client.messages.create(
+            model=self.api_model_name(),
+            max_tokens=max_tokens,
+            temperature=self.temperature,
+            system=system,
+            messages=[
+                {"role": "user", "content": user},
+            ],
+        )
+        self._track(response.usage)
         return response.content[0].text
 
 
@@ -245,6 +412,7 @@ class O1(LLM):
                 {"role": "user", "content": message},
             ],
         )
+        self._track(response.usage)
         return response.choices[0].message.content
 
 
@@ -282,6 +450,7 @@ class O3(LLM):
                 {"role": "user", "content": message},
             ],
         )
+        self._track(response.usage)
         return response.choices[0].message.content
 
 
@@ -344,11 +513,23 @@ class Ollama(LLM):
             ],
             response_format={"type": "json_object"},
         )
-        reply = response.choices[0].message.content
-        if "</think>" in reply:
-            logging.info("Thoughts:\n" + reply.split("</think>")[0].replace("<think>", ""))
-            reply = reply.split("</think>")[1]
-        return reply
+        self._track(response.usage)
+        return strip_thoughts(response.choices[0].message.content)
+
+    async def _asend(self, system: str, user: str, max_tokens: int = 3000) -> str:
+        """
+        Async version of _send for Ollama
+        """
+        response = await self.async_client.chat.completions.create(
+            model=self.api_model_name(),
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": user},
+            ],
+            response_format={"type": "json_object"},
+        )
+        self._track(response.usage)
+        return strip_thoughts(response.choices[0].message.content)
 
 
 class DeepSeekAPI(LLM):
@@ -401,11 +582,8 @@ class DeepSeekLocal(LLM):
                 {"role": "user", "content": user},
             ],
         )
-        reply = response.choices[0].message.content
-        if "</think>" in reply:
-            logging.info("Thoughts:\n" + reply.split("</think>")[0].replace("<think>", ""))
-            reply = reply.split("</think>")[1]
-        return reply
+        self._track(response.usage)
+        return strip_thoughts(response.choices[0].message.content)
 
 
 class GroqAPI(LLM):
@@ -448,3 +626,46 @@ class Human(LLM):
         """
         # This should never be called in normal flow
         return "{}"
+
+
+class Stub(LLM):
+    """
+    A fake provider that answers a random legal move after a configurable delay - for
+    load tests and local development. Only available when ENABLE_STUB_LLM is set.
+    """
+
+    model_names = ["stub", "stub-slow"] if os.getenv("ENABLE_STUB_LLM") else []
+
+    def __init__(self, model_name: str, temperature: float):
+        """
+        Read the simulated latency (in seconds) from the environment
+        """
+        super().__init__(model_name, temperature)
+        self.latency = float(os.getenv("STUB_LLM_LATENCY", 1.0))
+        if model_name == "stub-slow":
+            self.latency *= 5
+
+    def _reply(self, system: str, user: str) -> str:
+        """
+        Pick a random move among the legal moves listed in the system prompt, and count
+        about one token per 4 characters as a provider would
+        """
+        legal = re.search(r"must be one of: ([\d, ]+)", system)
+        moves = legal.group(1).split(", ") if legal else ["1"]
+        reply = json.dumps({
+            "evaluation": "Stub",
+            "threats": "Stub",
+            "opportunities": "Stub",
+            "strategy": "Random legal move",
+            "move_remove": random.choice(moves).strip(),
+        })
+        self._track(Usage((len(system) + len(user)) // 4, len(reply) // 4))
+        return reply
+
+    def _send(self, system: str, user: str, max_tokens: int = 3000) -> str:
+        time.sleep(self.latency)
+        return self._reply(system, user)
+
+    async def _asend(self, system: str, user: str, max_tokens: int = 3000) -> str:
+        await asyncio.sleep(self.latency)
+        return self._reply(system, user)
@@ -1,3 +1,6 @@
+import re
+from functools import lru_cache
+
 MATCHSTICKS_SVG_PATH = "assets/matchstick.svg"
 
 def display_matchsticks_img(n=5, height=75):
@@ -28,50 +31,70 @@ def load_svg(path):
     with open(path, "r", encoding="utf-8") as f:
         return f.read()
 
+@lru_cache(maxsize=1)
+def matchstick_defs():
+    """
+    Return the SVG definitions of a matchstick and of a group of five, read from disk once.
+    Their ids are prefixed so they don't clash with the rest of the page.
+    """
+    svg = load_svg(MATCHSTICKS_SVG_PATH)
+    view_box = re.search(r'viewBox="([^"]+)"', svg).group(1)
+    width, height = (float(value) for value in view_box.split()[2:])
+    inner = svg[svg.index(">", svg.index("<svg")) + 1 : svg.rindex("</svg>")]
+    inner = re.sub(r"<!--.*?-->", "", inner, flags=re.S)
+    inner = re.sub(r">\s+<", "><", inner).strip()
+    inner = inner.replace('id="', 'id="nim-').replace("url(#", "url(#nim-")
+
+    five = "".join(
+        f'<use href="#nim-matchstick" x="{width * i:g}" width="{width:g}" height="{height:g}"></use>'
+        for i in range(5)
+    )
+    return (
+        '<svg class="nim-defs" aria-hidden="true" width="0" height="0" '
+        'style="position: absolute; width: 0; height: 0; overflow: hidden;"><defs>'
+        f'<symbol id="nim-matchstick" viewBox="{view_box}">{inner}</symbol>'
+        f'<symbol id="nim-five" viewBox="0 0 {width * 5:g} {height:g}">{five}</symbol>'
+        "</defs></svg>"
+    ), width, height
+
+
+@lru_cache(maxsize=256)
 def display_matchsticks(n=5, height=80):
     """
-    Return HTML for a row of inline SVG matchsticks.
+    Return HTML for a row of matchsticks. The SVG is defined once as a <symbol>, and each
+    group of five sticks is a single <use>, so the HTML stays small even for large piles.
     """
-    match_svg_inline = load_svg(MATCHSTICKS_SVG_PATH)
-    
+    defs, stick_width, stick_height = matchstick_defs()
+    five_width = stick_width * 5
+
     # Déterminer comment répartir les allumettes
     if n <= 10:
         lines = [n]
     else:
         lines = [10, n - 10]
-    
-    html = "<div style='display: flex; flex-direction: column; gap: 10px;'>"
-    
-    for line_count in lines:
-        html += "<div style='display: flex; align-items: center;'>"
-        
-        for i in range(line_count):
-            gap = height / 7 if (i + 1) % 5 == 0 else 0
 
-            html += f"""
-            <div style="
-                height: {height}px;
-                margin-right: {gap}px;
-                display: flex;
-                align-items: center;
-            ">
-                <div style="height: 100%; width: auto;">
-                    {match_svg_inline}
-                </div>
-            </div>
-            """
-        
-        html += "</div>"
-    
-    html += "</div>"
-    
-    html += """
-    <style>
-        .board svg {
-            height: 100% !important;
+    parts = ["<div class='nim-board'>", defs]
+    for line_count in lines:
+        parts.append("<div class='nim-row'>")
+        # Un groupe de 5 allumettes par <use>, suivi d'un petit espace
+        parts.append(
+            f'<svg class="nim-five" viewBox="0 0 {five_width:g} {stick_height:g}">'
+            '<use href="#nim-five"></use></svg>'
+            * (line_count // 5)
+        )
+        parts.append(
+            f'<svg class="nim-stick" viewBox="0 0 {stick_width:g} {stick_height:g}">'
+            '<use href="#nim-matchstick"></use></svg>'
+            * (line_count % 5)
+        )
+        parts.append("</div>")
+    parts.append(f"""<style>
+        .nim-board {{ display: flex; flex-direction: column; gap: 10px; }}
+        .nim-row {{ display: flex; flex-wrap: wrap; align-items: center; row-gap: 10px; }}
+        .nim-board svg.nim-stick, .nim-board svg.nim-five {{
+            height: {height}px !important;
             width: auto !important;
-        }
-    </style>
-    """
-    
-    return html
+        }}
+        .nim-board svg.nim-five {{ margin-right: {height / 7:g}px; }}
+    </style></div>""")
+    return "".join(parts)
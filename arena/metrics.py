@@ -0,0 +1,241 @@
+# In-process metrics, exposed in the Prometheus text format by the /metrics routes
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Bornes des histogrammes, en secondes: de la requête en mémoire à l'appel LLM lent
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """
+    A metric family: one series per combination of label values
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    A value that only goes up
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in items]
+
+
+class Gauge(Metric):
+    """
+    A value read when the metrics are scraped, from a callback
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        super().__init__(name, help)
+        self.read = read
+
+    def samples(self) -> List[str]:
+        return [f"{self.name} {_number(self.read())}"]
+
+
+class Histogram(Metric):
+    """
+    Durations counted into cumulative buckets, with their sum and count
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.series: Dict[Tuple[str, ...], List[float]] = {}  # counts per bucket, then sum
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        Observe the duration of the block, even if it raises
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        with self.lock:
+            series = self.series.get(self._key(labels))
+            return int(sum(series[:-1])) if series else 0
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            items = sorted((key, list(series)) for key, series in self.series.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    The metrics of the process; each worker process exposes its own
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Add a metric, or return the one already registered under that name
+        """
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        """
+        Return every metric in the Prometheus text exposition format
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def histogram(
+    name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+
+def gauge(name: str, help: str, read: Callable[[], float]) -> Gauge:
+    """
+    Register a gauge; registering the same name again replaces its callback
+    """
+    metric = REGISTRY.register(Gauge(name, help, read))
+    metric.read = read
+    return metric
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+
+LLM_LATENCY = histogram(
+    "nim_llm_request_seconds", "Duration of one LLM call attempt", ("model", "outcome")
+)
+LLM_RETRIES = counter("nim_llm_retries_total", "LLM calls retried after an error", ("model",))
+LLM_FAILURES = counter(
+    "nim_llm_failures_total", "LLM calls that failed on every attempt", ("model",)
+)
+LLM_TOKENS = counter(
+    "nim_llm_tokens_total", "Tokens billed by the providers, per model", ("model", "kind")
+)
+LLM_COST = counter(
+    "nim_llm_cost_usd_total", "Estimated cost of the LLM calls in USD, from arena.costs", ("model",)
+)
+FORFEITS = counter(
+    "nim_forfeits_total", "Moves forfeited because the response was unusable", ("model", "reason")
+)
+SPECULATIONS = counter(
+    "nim_speculations_total",
+    "LLM replies computed during a human's turn, by what became of them (see arena.speculation)",
+    ("outcome",),
+)
+DB_WRITE_LATENCY = histogram(
+    "nim_db_write_seconds", "Duration of a transaction recording game results", ("outcome",)
+)
+LEADERBOARD_LATENCY = histogram(
+    "nim_leaderboard_compute_seconds", "Duration of a leaderboard computation", ("engine",)
+)
+HTTP_LATENCY = histogram(
+    "nim_http_request_seconds", "Duration of HTTP requests per route", ("method", "route", "status")
+)
+
+
+def observe_request(method: str, route: Optional[str], status: int, seconds: float) -> None:
+    """
+    Record a request; route is the route pattern, so ids in paths don't create series
+    """
+    HTTP_LATENCY.observe(seconds, method=method, route=route or "unmatched", status=str(status))
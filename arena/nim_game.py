@@ -1,6 +1,7 @@
 # The Nim game implementation
 
 from arena.matchstick_view import display_matchsticks
+from arena.tracing import traced
 
 RED = 1
 BLUE = 2
@@ -22,6 +23,7 @@ class NimGame:
         self.player_to_move = RED  # RED starts
         self.forfeited = False
         
+    @traced("render.board")
     def __repr__(self):
         """
         Return HTML for the current matchstick display.
@@ -53,6 +55,10 @@ class NimGame:
             return
         else:
             self.player_to_move = BLUE if self.player_to_move == RED else RED
+            # Variante B: avec 1 bâtonnet après un retrait de 1, le joueur suivant
+            # n'a aucun coup permis et perd; celui qui vient de jouer gagne
+            if not self.valid_moves():
+                self.winner = BLUE if self.player_to_move == RED else RED
     
     def valid_moves(self):
         """
@@ -96,6 +102,31 @@ class NimGame:
         """
         return self.winner == EMPTY and not self.forfeited
     
+    def to_dict(self):
+        """
+        Return the state of the game, for serialization.
+        """
+        return {
+            "variant": self.variant,
+            "n": self.n,
+            "history": self.history,
+            "winner": self.winner,
+            "player_to_move": self.player_to_move,
+            "forfeited": self.forfeited,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuild a game saved by to_dict.
+        """
+        nim_game = cls(variant=data["variant"], n=data["n"])
+        nim_game.history = list(data["history"])
+        nim_game.winner = data["winner"]
+        nim_game.player_to_move = data["player_to_move"]
+        nim_game.forfeited = data["forfeited"]
+        return nim_game
+
     def game_started(self):
         """
         Returns True if at least one move has been made.
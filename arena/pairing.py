@@ -0,0 +1,239 @@
+# Adaptive pairing: choose the next matchups where a game teaches the most about the ratings
+
+import random
+import threading
+from collections import Counter
+from typing import Callable, Collection, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.special import expit
+
+from arena.record import ELO_SCALE, BradleyTerryEngine, pair_counts_from_db
+from arena.tournament import Matchup, Outcome
+
+STRATEGIES = ("information", "swiss")
+
+
+class AdaptiveScheduler:
+    """
+    Yields matchups one at a time from the current Bradley-Terry fit of the games so far
+    (the stored games, then the outcomes reported through observe()).
+
+    The posterior of the log-strengths is approximated by a Gaussian whose precision is
+    the Fisher information of the games played. One more game between i and j adds
+    p(1 - p) of information along e_i - e_j, which reduces the entropy of the posterior by
+    0.5 * log(1 + p(1 - p) * Var(theta_i - theta_j)). The "information" strategy plays the
+    pair with the largest reduction: close pairs whose order is still uncertain, rather than
+    mismatches whose outcome is already known. The "swiss" strategy plays neighbours in
+    the current ranking, the pair with the fewest games first.
+
+    Games in flight count as played (with their expected information) so that concurrent
+    workers get different pairs.
+    """
+
+    def __init__(
+        self,
+        models: Sequence[str],
+        variants: Sequence[str] = ("normal",),
+        games: Optional[int] = None,
+        target_sd: Optional[float] = None,
+        strategy: str = "information",
+        history: bool = True,
+        prior: float = 0.01,
+        seed: Optional[int] = None,
+        exhausted: Optional[Callable[[Collection[str]], Collection[str]]] = None,
+    ):
+        """
+        Initialize the scheduler.
+
+        Args:
+            models: Models to pair, at least two
+            variants: Variants to play, in turn; their games are pooled into one rating
+            games: Number of matchups to yield (no limit if None)
+            target_sd: Stop once every rating's standard deviation, in ELO points, is below this
+            strategy: "information" or "swiss"
+            history: Start from the games stored in the DB between these models
+            prior: Gaussian prior of the Bradley-Terry fit, as in BradleyTerryEngine
+            seed: Seed for breaking ties between equally good pairs
+            exhausted: Returns the models, among those given, that must not play any more
+                games (e.g. Budget.exhausted_models); pairs are chosen among the others
+        """
+        if len(models) < 2:
+            raise ValueError("Pairing needs at least two models")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unrecognized pairing strategy: {strategy}")
+        self.models = list(models)
+        self.variants = list(variants)
+        self.games = games
+        self.target_sd = target_sd
+        self.strategy = strategy
+        self.exhausted = exhausted
+        self.engine = BradleyTerryEngine(prior=prior)
+        self.rng = random.Random(seed)
+        self.index = {model: i for i, model in enumerate(self.models)}
+        size = len(self.models)
+        self.scores = np.zeros((size, size))  # scores[i, j]: score of i against j, draws count half
+        self.pending: Counter = Counter()  # pairs (i, j) with i < j in flight
+        self.red_games: Counter = Counter()  # (i, j): games i played as red against j in this run
+        self.scheduled = 0
+        self.theta = np.zeros(size)
+        self.lock = threading.Lock()
+        if history:
+            self._load_history()
+        self._refit()
+
+    def _load_history(self) -> None:
+        """
+        Add the stored games between the scheduled models, in the scheduled variants
+        """
+        for variant in self.variants:
+            counts = pair_counts_from_db(variant)
+            known = [(k, self.index[player]) for k, player in enumerate(counts.players) if player in self.index]
+            for a, i in known:
+                for b, j in known:
+                    self.scores[i, j] += counts.scores[a, b]
+
+    def _refit(self) -> None:
+        self.theta = self.engine.strengths(self.scores)
+
+    def _covariance(self) -> np.ndarray:
+        """
+        Return the covariance of the log-strengths: the inverse of the Fisher information
+        of the games played and in flight, plus the prior
+        """
+        size = len(self.models)
+        games = self.scores + self.scores.T
+        for (i, j), count in self.pending.items():
+            games[i, j] += count
+            games[j, i] += count
+        p = expit(self.theta[:, None] - self.theta[None, :])
+        weights = games * p * (1 - p)
+        information = np.diag(weights.sum(axis=1)) - weights + self.engine.prior * np.eye(size)
+        return np.linalg.inv(information)
+
+    def deviations(self) -> Dict[str, float]:
+        """
+        Return the standard deviation of every rating, in ELO points
+        """
+        with self.lock:
+            covariance = self._covariance()
+        # Les classements sont centrés: seule la variance relative à la moyenne compte
+        size = len(self.models)
+        centering = np.eye(size) - np.full((size, size), 1 / size)
+        covariance = centering @ covariance @ centering
+        return {
+            model: float(ELO_SCALE * np.sqrt(max(covariance[i, i], 0.0)))
+            for model, i in self.index.items()
+        }
+
+    def ratings(self) -> List[Tuple[str, float, float]]:
+        """
+        Return (model, rating, standard deviation) rows, best first
+        """
+        deviations = self.deviations()
+        with self.lock:
+            fitted = dict(zip(self.models, self.engine.default_rating + ELO_SCALE * self.theta))
+        rows = [(model, float(fitted[model]), deviations[model]) for model in self.models]
+        rows.sort(key=lambda row: row[1], reverse=True)
+        return rows
+
+    def _gains(self, covariance: np.ndarray) -> np.ndarray:
+        """
+        Return the entropy reduction expected from one more game, for every pair
+        """
+        variance = np.diag(covariance)
+        difference = variance[:, None] + variance[None, :] - 2 * covariance
+        p = expit(self.theta[:, None] - self.theta[None, :])
+        return 0.5 * np.log1p(p * (1 - p) * np.maximum(difference, 0.0))
+
+    def _playable(self) -> List[int]:
+        """
+        Return the indices of the models that may still play
+        """
+        if self.exhausted is None:
+            return list(range(len(self.models)))
+        excluded = set(self.exhausted(self.models))
+        return [i for i, model in enumerate(self.models) if model not in excluded]
+
+    def _pair(self, playable: List[int]) -> Tuple[int, int]:
+        """
+        Return the next pair (i, j), i < j, among the playable models, for the current strategy
+        """
+        if self.strategy == "swiss":
+            order = [i for i in np.argsort(-self.theta) if i in playable]
+            played = self.scores + self.scores.T
+            candidates = []
+            for a, b in zip(order, order[1:]):
+                i, j = sorted((int(a), int(b)))
+                candidates.append((played[i, j] + self.pending[(i, j)], self.rng.random(), (i, j)))
+            return min(candidates)[2]
+        gains = self._gains(self._covariance())
+        best = max(
+            (gains[i, j], self.rng.random(), (i, j)) for i in playable for j in playable if i < j
+        )
+        return best[2]
+
+    def _colours(self, i: int, j: int) -> Tuple[int, int]:
+        """
+        Give red to whichever of the two has played red less often against the other
+        """
+        if self.red_games[(i, j)] > self.red_games[(j, i)]:
+            i, j = j, i
+        elif self.red_games[(i, j)] == self.red_games[(j, i)] and self.rng.random() < 0.5:
+            i, j = j, i
+        self.red_games[(i, j)] += 1
+        return i, j
+
+    def done(self) -> bool:
+        """
+        True once the game budget is spent, or every rating is precise enough
+        """
+        if self.games is not None and self.scheduled >= self.games:
+            return True
+        if self.target_sd is not None:
+            # Les parties en cours comptent déjà: on ne lance pas de parties superflues
+            return max(self.deviations().values()) <= self.target_sd
+        return False
+
+    def next_matchup(self) -> Optional[Matchup]:
+        """
+        Return the next matchup to play, or None when the scheduler is done
+        """
+        if self.done():
+            return None
+        playable = self._playable()
+        if len(playable) < 2:
+            return None
+        with self.lock:
+            i, j = self._pair(playable)
+            self.pending[(i, j)] += 1
+            red, blue = self._colours(i, j)
+            variant = self.variants[self.scheduled % len(self.variants)]
+            self.scheduled += 1
+        return Matchup(self.models[red], self.models[blue], variant)
+
+    def observe(self, outcome: Outcome) -> None:
+        """
+        Take the result of a matchup into account; pass this as Tournament.run's on_outcome
+        """
+        matchup = outcome.matchup
+        red, blue = self.index[matchup.red], self.index[matchup.blue]
+        with self.lock:
+            pair = (min(red, blue), max(red, blue))
+            if self.pending[pair] > 0:
+                self.pending[pair] -= 1
+            if outcome.winner == "red":
+                self.scores[red, blue] += 1
+            elif outcome.winner == "blue":
+                self.scores[blue, red] += 1
+            else:
+                # Partie échouée: rien à apprendre, la paire pourra être choisie de nouveau
+                return
+            self._refit()
+
+    def __iter__(self) -> Iterator[Matchup]:
+        while True:
+            matchup = self.next_matchup()
+            if matchup is None:
+                return
+            yield matchup
@@ -1,6 +1,8 @@
 import json
 import random
 from arena.llm import LLM
+from arena.metrics import FORFEITS
+from arena.tracing import traced
 
 from arena.nim_game import RED, BLUE
 
@@ -16,13 +18,13 @@ class HumanTurnException(Exception):
 
 
 class Player:
-    def __init__(self, model, color):
+    def __init__(self, model, color, llm=None):
         """
-        Initialize a player and its LLM client.
+        Initialize a player and its LLM client (an existing LLM of that model can be reused).
         """
         self.model = model
         self.color = color
-        self.llm = LLM.create(self.model)
+        self.llm = llm if llm is not None else LLM.create(self.model)
         
         # Handle llm response
         self.evaluation = ""
@@ -31,6 +33,7 @@ class Player:
         self.strategy = ""
         self.move_remove = None
         
+    @traced("prompt")
     def system(self, nim_game):
         """
         Build the system prompt for the LLM.
@@ -53,6 +56,7 @@ You should respond in JSON, and only in JSON, according to this spec:
 """
         return prompt
     
+    @traced("prompt")
     def user(self, nim_game):
         """
         Build the user prompt for the LLM.
@@ -98,7 +102,25 @@ You must remove a number of sticks from the pile between {legal_moves_str}.
         user_prompt = self.user(nim_game)
         
         response = self.llm.send(system_prompt, user_prompt)
-        
+        self.apply_response(response, nim_game, system_prompt, user_prompt)
+
+    async def apick(self, nim_game):
+        """
+        Async version of pick: await the LLM instead of blocking the thread
+        """
+        if self.model == "Humain":
+            raise HumanTurnException(nim_game.valid_moves())
+
+        system_prompt = self.system(nim_game)
+        user_prompt = self.user(nim_game)
+
+        response = await self.llm.asend(system_prompt, user_prompt)
+        self.apply_response(response, nim_game, system_prompt, user_prompt)
+
+    def apply_response(self, response, nim_game, system_prompt, user_prompt):
+        """
+        Process the LLM response, printing the prompts if it could not be handled
+        """
         try:
             self.process_move(response, nim_game)
         except Exception as e:
@@ -109,17 +131,20 @@ You must remove a number of sticks from the pile between {legal_moves_str}.
             print("User Prompt:")
             print(user_prompt)
         
+    @traced("parse")
     def process_move(self, response, nim_game):
         """
         Parse the model response and update game state.
         """
         print(response)
+        reason = "bad_response"
         try:
             result = json.loads(response)
             move_remove = int(result.get("move_remove"))
             
             # Check if move is valid
             if move_remove not in nim_game.valid_moves():
+                reason = "invalid_move"
                 raise ValueError(f"Invalid move: {move_remove}")
             nim_game.pick(move_remove)
             
@@ -130,6 +155,7 @@ You must remove a number of sticks from the pile between {legal_moves_str}.
             self.move_remove = move_remove
         except Exception as e:
             print(f"Exception {e}")
+            FORFEITS.inc(model=self.llm.model_name, reason=reason)
             # If invalid, set user who just played as loser
             nim_game.forfeited = True
             nim_game.winner = BLUE if self.color == RED else RED
@@ -147,6 +173,29 @@ You must remove a number of sticks from the pile between {legal_moves_str}.
         result += "</div>"
         return result
     
+    def to_dict(self):
+        """
+        Return the model and last thoughts of the player, for serialization
+        """
+        return {
+            "model": self.model,
+            "evaluation": self.evaluation,
+            "threats": self.threats,
+            "opportunities": self.opportunities,
+            "strategy": self.strategy,
+            "move_remove": self.move_remove,
+        }
+
+    def load_thoughts(self, data):
+        """
+        Restore the last thoughts saved by to_dict
+        """
+        self.evaluation = data.get("evaluation", "")
+        self.threats = data.get("threats", "")
+        self.opportunities = data.get("opportunities", "")
+        self.strategy = data.get("strategy", "")
+        self.move_remove = data.get("move_remove")
+
     def switch_model(self, new_model_name: str):
         """
         Change the underlying LLM to the new model
@@ -0,0 +1,361 @@
+# Move policies distilled from the recorded moves, to predict matchups without calling the APIs
+
+import argparse
+import logging
+import math
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from arena import record
+from arena.nim_game import NimGame
+
+PRIOR = 2.0  # poids (en coups fictifs) du comportement global du modèle dans chaque position
+MIN_OBS = 3  # coups observés pour qu'une position compte comme couverte
+
+# Une position telle que le modèle la voit: le prompt ne donne que le nombre de bâtonnets et
+# les coups permis, donc le dernier coup ne compte que dans la variante B où il les change
+State = Tuple[int, Optional[int]]
+FORFEIT = None
+
+_MOVES_SQL = """
+    SELECT model, variant, sticks, last_move, move_remove, COUNT(*)
+    FROM (
+        SELECT m.model, g.variant, m.sticks, m.move_remove,
+               CASE WHEN g.variant = 'b'
+                    THEN LAG(m.move_remove) OVER (PARTITION BY m.game_id ORDER BY m.ply) END AS last_move
+        FROM moves m JOIN games g ON g.id = m.game_id
+        {where}
+    )
+    GROUP BY model, variant, sticks, last_move, move_remove
+"""
+
+
+@lru_cache(maxsize=None)
+def legal_moves(variant: str, n: int, last: Optional[int] = None) -> Tuple[int, ...]:
+    game = NimGame(variant=variant, n=n)
+    if last is not None:
+        game.history.append(last)
+    return tuple(game.valid_moves())
+
+
+def state_key(variant: str, n: int, last: Optional[int]) -> State:
+    return (n, last if variant == "b" else None)
+
+
+@dataclass
+class Policy:
+    """
+    How often a model played each move (or forfeited, move None) in each position of a
+    variant. Unseen or rarely seen positions fall back on the model's overall habits in the
+    variant: the counts get PRIOR pseudo-moves spread like its choices everywhere else
+    (restricted to the legal moves) and like its forfeit rate.
+    """
+
+    model: str
+    variant: str
+    counts: Dict[State, Counter] = field(default_factory=lambda: defaultdict(Counter))
+    prior: float = PRIOR
+    _pooled: Optional[Tuple[Counter, float]] = field(default=None, init=False, repr=False, compare=False)
+
+    def add(self, n: int, last: Optional[int], move: Optional[int], count: int = 1) -> None:
+        self.counts[state_key(self.variant, n, last)][move] += count
+        self._pooled = None
+
+    @property
+    def observed(self) -> int:
+        return sum(sum(moves.values()) for moves in self.counts.values())
+
+    def observations(self, n: int, last: Optional[int] = None) -> int:
+        moves = self.counts.get(state_key(self.variant, n, last))
+        return sum(moves.values()) if moves else 0
+
+    def _pooled_moves(self) -> Tuple[Counter, float]:
+        """
+        Return the model's choices over all positions and its forfeit rate (add-one smoothed)
+        """
+        if self._pooled is None:
+            pooled: Counter = Counter()
+            for moves in self.counts.values():
+                pooled.update(moves)
+            forfeits = pooled.pop(FORFEIT, 0)
+            self._pooled = (pooled, forfeits / (sum(pooled.values()) + forfeits + 1))
+        return self._pooled
+
+    def distribution(self, n: int, last: Optional[int] = None) -> Dict[Optional[int], float]:
+        """
+        Return the probability of each legal move, and of a forfeit (key None), in a position
+        """
+        legal = legal_moves(self.variant, n, last)
+        pooled, forfeit_rate = self._pooled_moves()
+        weights = {move: pooled[move] + 1 for move in legal}
+        total_weight = sum(weights.values())
+        prior = {move: (1 - forfeit_rate) * weight / total_weight for move, weight in weights.items()}
+        prior[FORFEIT] = forfeit_rate
+
+        seen = self.counts.get(state_key(self.variant, n, last), Counter())
+        # Un coup enregistré qui n'est plus permis (partie d'une ancienne version) est ignoré
+        seen = {move: count for move, count in seen.items() if move in prior}
+        total = sum(seen.values()) + self.prior
+        return {move: (seen.get(move, 0) + self.prior * p) / total for move, p in prior.items()}
+
+
+@dataclass
+class Prediction:
+    red: str
+    blue: str
+    variant: str
+    red_wins: float
+    plies: Tuple[float, float]  # coups attendus de Rouge et de Bleu
+    coverage: float  # part des coups attendus joués dans des positions observées au moins MIN_OBS fois
+    cost: float = 0.0  # coût attendu d'une partie en USD
+
+    @property
+    def decisiveness(self) -> float:
+        return abs(2 * self.red_wins - 1)
+
+    @property
+    def worth(self) -> float:
+        """
+        How much a real game would add to the prediction: 1 for an open outcome or a guess
+        from few observations, 0 for a one-sided outcome predicted from well-observed play
+        """
+        return 1 - self.coverage * self.decisiveness
+
+
+def load_policies(
+    variants: Optional[Sequence[str]] = None,
+    models: Optional[Sequence[str]] = None,
+    holdout: Optional[Tuple[int, int]] = None,
+    prior: float = PRIOR,
+) -> Dict[Tuple[str, str], Policy]:
+    """
+    Build the policy of every (model, variant) from the moves table. holdout=(k, r) leaves
+    out the games whose id is r modulo k, to evaluate the predictions on them
+    """
+    conn = record._get_db()
+    if conn is None:
+        return {}
+    where, params = [], []
+    if variants:
+        where.append(f"g.variant IN ({', '.join('?' * len(variants))})")
+        params.extend(variants)
+    if holdout:
+        where.append("g.id % ? != ?")
+        params.extend(holdout)
+    try:
+        rows = conn.execute(
+            _MOVES_SQL.format(where=f"WHERE {' AND '.join(where)}" if where else ""), params
+        ).fetchall()
+        conn.close()
+    except Exception as e:
+        logging.error("Error reading the moves from the database")
+        logging.exception(e)
+        conn.close()
+        return {}
+
+    policies: Dict[Tuple[str, str], Policy] = {}
+    for model, variant, sticks, last, move, count in rows:
+        if models and model not in models:
+            continue
+        policy = policies.get((model, variant))
+        if policy is None:
+            policy = policies[(model, variant)] = Policy(model, variant, prior=prior)
+        policy.add(sticks, last, move, count)
+    return policies
+
+
+def predict(red: Policy, blue: Policy, n: int = 21, min_obs: int = MIN_OBS) -> Prediction:
+    """
+    Return the exact outcome distribution of a game between two policies. The positions
+    only go down in sticks, so the probability of reaching each one is pushed forward from
+    the start in order of decreasing n (at most 4 positions per n and colour), with no sampling
+    """
+    assert red.variant == blue.variant, "Both policies must be of the same variant"
+    variant = red.variant
+    players = (red, blue)
+    reach: Dict[Tuple[int, Optional[int], int], float] = {(n, None, 0): 1.0}
+    wins = [0.0, 0.0]
+    plies = [0.0, 0.0]
+    covered = 0.0
+    for sticks in range(n, 0, -1):
+        for (left, last, mover), p in [(key, p) for key, p in reach.items() if key[0] == sticks]:
+            policy = players[mover]
+            plies[mover] += p
+            if policy.observations(left, last) >= min_obs:
+                covered += p
+            for move, q in policy.distribution(left, last).items():
+                if q == 0:
+                    continue
+                if move is FORFEIT:
+                    wins[1 - mover] += p * q
+                    continue
+                after = left - move
+                # Le dernier bâtonnet gagne; en variante B, un adversaire sans coup permis perd aussi
+                if after == 0 or not legal_moves(variant, after, move):
+                    wins[mover] += p * q
+                    continue
+                key = (after, move if variant == "b" else None, 1 - mover)
+                reach[key] = reach.get(key, 0.0) + p * q
+    total = plies[0] + plies[1]
+    return Prediction(
+        red.model, blue.model, variant, wins[0] / (wins[0] + wins[1]), (plies[0], plies[1]),
+        covered / total if total else 0.0,
+    )
+
+
+def move_costs(variants: Optional[Sequence[str]] = None) -> Dict[str, float]:
+    """
+    Return the average recorded cost of one move of every model, in USD
+    """
+    conn = record._get_db()
+    if conn is None:
+        return {}
+    try:
+        if variants:
+            rows = conn.execute(
+                f"""
+                SELECT m.model, AVG(m.cost) FROM moves m JOIN games g ON g.id = m.game_id
+                WHERE g.variant IN ({', '.join('?' * len(variants))}) GROUP BY m.model
+                """,
+                list(variants),
+            ).fetchall()
+        else:
+            rows = conn.execute("SELECT model, AVG(cost) FROM moves GROUP BY model").fetchall()
+        conn.close()
+        return {model: average or 0.0 for model, average in rows}
+    except Exception as e:
+        logging.error("Error reading the move costs from the database")
+        logging.exception(e)
+        conn.close()
+        return {}
+
+
+def predict_all(
+    policies: Dict[Tuple[str, str], Policy],
+    models: Sequence[str],
+    variants: Sequence[str],
+    costs: Optional[Dict[str, float]] = None,
+    n: int = 21,
+    min_obs: int = MIN_OBS,
+) -> List[Prediction]:
+    """
+    Predict every ordered pairing of the models in each variant, including pairs that never
+    met; a model without recorded moves in a variant plays uniformly at random
+    """
+    costs = costs or {}
+    predictions = []
+    for variant in variants:
+        for red in models:
+            for blue in models:
+                if red == blue:
+                    continue
+                prediction = predict(
+                    policies.get((red, variant)) or Policy(red, variant),
+                    policies.get((blue, variant)) or Policy(blue, variant),
+                    n, min_obs,
+                )
+                prediction.cost = (
+                    prediction.plies[0] * costs.get(red, 0.0) + prediction.plies[1] * costs.get(blue, 0.0)
+                )
+                predictions.append(prediction)
+    return predictions
+
+
+def evaluate(holdout: Tuple[int, int] = (5, 0), variants: Optional[Sequence[str]] = None) -> Dict[str, float]:
+    """
+    Fit the policies without the held-out games, then score the predicted P(red wins) of
+    those games against their outcome (Brier score and log loss, next to a coin flip's)
+    """
+    policies = load_policies(variants, holdout=holdout)
+    conn = record._get_db()
+    if conn is None:
+        return {}
+    where, params = ["g.id % ? = ?", "m.ply = 0", "g.red_won != g.blue_won"], list(holdout)
+    if variants:
+        where.append(f"g.variant IN ({', '.join('?' * len(variants))})")
+        params.extend(variants)
+    try:
+        games = conn.execute(
+            f"""
+            SELECT g.red_player, g.blue_player, g.variant, g.red_won, m.sticks
+            FROM games g JOIN moves m ON m.game_id = g.id
+            WHERE {' AND '.join(where)}
+            """,
+            params,
+        ).fetchall()
+        conn.close()
+    except Exception as e:
+        logging.error("Error reading the held-out games from the database")
+        logging.exception(e)
+        conn.close()
+        return {}
+
+    cache: Dict[Tuple[str, str, str, int], float] = {}
+    brier = log_loss = 0.0
+    for red, blue, variant, red_won, sticks in games:
+        key = (red, blue, variant, sticks)
+        if key not in cache:
+            cache[key] = predict(
+                policies.get((red, variant)) or Policy(red, variant),
+                policies.get((blue, variant)) or Policy(blue, variant),
+                sticks,
+            ).red_wins
+        p = min(max(cache[key], 1e-6), 1 - 1e-6)
+        brier += (p - red_won) ** 2
+        log_loss -= math.log(p if red_won else 1 - p)
+    count = len(games)
+    if not count:
+        return {"games": 0}
+    return {"games": count, "brier": brier / count, "log_loss": log_loss / count,
+            "coin_brier": 0.25, "coin_log_loss": math.log(2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Predict matchups from the move policies recorded in the DB, without calling any model"
+    )
+    parser.add_argument("--models", nargs="+", help="Models to pair (default: every model with recorded moves)")
+    parser.add_argument("--variants", nargs="+", default=["normal"], choices=["normal", "a", "b"])
+    parser.add_argument("--sticks", type=int, default=21, help="Sticks at the start of a game")
+    parser.add_argument("--prior", type=float, default=PRIOR, help="Pseudo-moves of the model's overall habits per position")
+    parser.add_argument("--min-obs", type=int, default=MIN_OBS, help="Observed moves for a position to count as covered")
+    parser.add_argument("--top", type=int, default=30, help="Pairings listed, most worth playing first")
+    parser.add_argument("--max-cost", type=float, default=None, help="Skip pairings whose expected game costs more (USD)")
+    parser.add_argument("--evaluate", action="store_true", help="Score the predictions on held-out games (1 in 5) and exit")
+    args = parser.parse_args()
+
+    if args.evaluate:
+        scores = evaluate(variants=args.variants)
+        if not scores.get("games"):
+            raise SystemExit("No held-out games with recorded moves")
+        print(
+            f"{scores['games']} held-out games: Brier {scores['brier']:.4f} (coin {scores['coin_brier']:.4f}),"
+            f" log loss {scores['log_loss']:.4f} (coin {scores['coin_log_loss']:.4f})"
+        )
+        return
+
+    policies = load_policies(args.variants, args.models, prior=args.prior)
+    models = args.models or sorted({model for model, _ in policies if model != "Humain"})
+    if len(models) < 2:
+        raise SystemExit("Need at least two models (no recorded moves yet?)")
+    for variant in args.variants:
+        for model in models:
+            policy = policies.get((model, variant))
+            print(f"{variant:<7} {model:<32} {policy.observed if policy else 0:>7} moves recorded")
+
+    predictions = predict_all(policies, models, args.variants, move_costs(args.variants), args.sticks, args.min_obs)
+    if args.max_cost is not None:
+        predictions = [prediction for prediction in predictions if prediction.cost <= args.max_cost]
+    predictions.sort(key=lambda prediction: (-prediction.worth, prediction.cost))
+    print(f"\n{'variant':<7} {'red':<24} {'blue':<24} {'P(red)':>7} {'covered':>8} {'worth':>6} {'USD/game':>9}")
+    for prediction in predictions[:args.top]:
+        print(
+            f"{prediction.variant:<7} {prediction.red[:24]:<24} {prediction.blue[:24]:<24} {prediction.red_wins:>7.3f}"
+            f" {prediction.coverage:>8.0%} {prediction.worth:>6.2f} {prediction.cost:>9.5f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,37 @@
+import json
 import logging
 import os
 import math
 import sqlite3
+import time
 from datetime import datetime
-from typing import List, Dict, Optional
-from dataclasses import dataclass, asdict
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Tuple
+from dataclasses import dataclass, asdict, field
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
+from scipy.optimize import minimize
+from scipy.special import expit
+
+from arena.metrics import DB_WRITE_LATENCY
+from arena.tracing import traced
+
+
+
+@dataclass
+class Move:
+    """
+    One move of a recorded game; move_remove is None for a forfeited move
+    """
+
+    ply: int
+    color: str
+    model: str
+    sticks: int
+    move_remove: Optional[int]
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
 
 
 @dataclass
@@ -16,9 +42,13 @@ class Result:
     red_won: bool
     blue_won: bool
     date: datetime
+    moves: List[Move] = field(default_factory=list)
 
 
-DB_FILE = "nim_games.db"
+DB_FILE = os.getenv("DB_FILE", "nim_games.db")
+
+# Callbacks run after new games are committed, e.g. to invalidate caches
+_commit_listeners: List[Callable[[], None]] = []
 
 
 def _init_db(conn: sqlite3.Connection) -> None:
@@ -35,6 +65,76 @@ def _init_db(conn: sqlite3.Connection) -> None:
             date TEXT NOT NULL
         )
     """)
+    # ELO ratings checkpointed every SNAPSHOT_EVERY games; scope is '' for all variants
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rating_snapshots (
+            scope TEXT NOT NULL,
+            game_id INTEGER NOT NULL,
+            games INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            ratings TEXT NOT NULL,
+            PRIMARY KEY (scope, game_id)
+        )
+    """)
+    # Un coup par ligne, avec les jetons facturés et leur coût estimé (voir arena/costs.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS moves (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            game_id INTEGER NOT NULL,
+            ply INTEGER NOT NULL,
+            color TEXT NOT NULL,
+            model TEXT NOT NULL,
+            sticks INTEGER NOT NULL,
+            move_remove INTEGER,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            cost REAL NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_moves_game ON moves (game_id)")
+    # Tournois reprenables (voir arena/checkpoint.py): la configuration, puis une ligne par
+    # partie prévue; game_id pointe vers la partie enregistrée dans games
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tournaments (
+            id TEXT PRIMARY KEY,
+            config TEXT NOT NULL,
+            seed INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            created TEXT NOT NULL,
+            updated TEXT NOT NULL,
+            lease_expires REAL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tournament_games (
+            tournament_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            red_player TEXT NOT NULL,
+            blue_player TEXT NOT NULL,
+            variant TEXT NOT NULL,
+            seed INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            game_id INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT NOT NULL DEFAULT '',
+            updated TEXT NOT NULL,
+            owner TEXT,
+            lease_expires REAL,
+            PRIMARY KEY (tournament_id, seq)
+        )
+    """)
+    # Colonnes ajoutées après coup: les bases existantes n'ont pas encore les baux
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(tournament_games)")}
+    for column, kind in (("owner", "TEXT"), ("lease_expires", "REAL")):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE tournament_games ADD COLUMN {column} {kind}")
+    # Bail du planificateur adaptatif, renouvelé tant qu'il peut ajouter des parties
+    if "lease_expires" not in {row[1] for row in cursor.execute("PRAGMA table_info(tournaments)")}:
+        cursor.execute("ALTER TABLE tournaments ADD COLUMN lease_expires REAL")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_tournament_games_status
+        ON tournament_games (tournament_id, status, seq)
+    """)
     conn.commit()
 
 
@@ -49,32 +149,108 @@ def _get_db() -> Optional[sqlite3.Connection]:
         return None
 
 
-def record_game(result: Result) -> bool:
+def _insert_game(cursor: sqlite3.Cursor, result: Result) -> int:
+    """
+    Insert a game and its moves; returns the id of the game
+    """
+    cursor.execute(
+        "INSERT INTO games (red_player, blue_player, variant, red_won, blue_won, date) VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            result.red_player,
+            result.blue_player,
+            result.variant,
+            1 if result.red_won else 0,
+            1 if result.blue_won else 0,
+            result.date.isoformat(),
+        ),
+    )
+    game_id = cursor.lastrowid
+    if result.moves:
+        cursor.executemany(
+            "INSERT INTO moves (game_id, ply, color, model, sticks, move_remove, prompt_tokens, completion_tokens, cost)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (game_id, move.ply, move.color, move.model, move.sticks, move.move_remove,
+                 move.prompt_tokens, move.completion_tokens, move.cost)
+                for move in result.moves
+            ],
+        )
+    return game_id
+
+
+def record_game(result: Result, slot: Optional[Tuple[str, int]] = None) -> bool:
     """
     Store the results in the database, if database is available.
     Returns True if successful, False if database is unavailable.
+    If slot is a (tournament id, game number), the game is stored in the same transaction
+    that marks that tournament game done, and not stored at all if it already was.
+    """
+    if slot is None:
+        return record_games([result])
+
+    start = time.perf_counter()
+    conn = _get_db()
+    if conn is None:
+        DB_WRITE_LATENCY.observe(time.perf_counter() - start, outcome="unavailable")
+        return False
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            "SELECT status FROM tournament_games WHERE tournament_id = ? AND seq = ?", slot
+        )
+        row = cursor.fetchone()
+        if row is None or row[0] == "done":
+            conn.rollback()
+            conn.close()
+            return row is not None
+        game_id = _insert_game(cursor, result)
+        cursor.execute(
+            "UPDATE tournament_games SET status = 'done', game_id = ?, error = '', updated = ?"
+            " WHERE tournament_id = ? AND seq = ?",
+            (game_id, datetime.now().isoformat(), *slot),
+        )
+        conn.commit()
+        conn.close()
+        DB_WRITE_LATENCY.observe(time.perf_counter() - start, outcome="ok")
+        _notify_commit()
+        return True
+    except Exception as e:
+        DB_WRITE_LATENCY.observe(time.perf_counter() - start, outcome="error")
+        logging.error("Failed to record a tournament game in the database")
+        logging.exception(e)
+        if conn:
+            conn.close()
+        return False
+
+
+def record_games(results: List[Result]) -> bool:
+    """
+    Store several results in a single transaction, if database is available.
+    Returns True if successful, False if database is unavailable.
     """
+    if not results:
+        return True
+
+    start = time.perf_counter()
     conn = _get_db()
     if conn is None:
+        DB_WRITE_LATENCY.observe(time.perf_counter() - start, outcome="unavailable")
         return False
 
     try:
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO games (red_player, blue_player, variant, red_won, blue_won, date)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            result.red_player,
-            result.blue_player,
-            result.variant,
-            1 if result.red_won else 0,
-            1 if result.blue_won else 0,
-            result.date.isoformat()
-        ))
+        # Une insertion par partie: les coups ont besoin de l'id de leur partie
+        for result in results:
+            _insert_game(cursor, result)
         conn.commit()
         conn.close()
+        DB_WRITE_LATENCY.observe(time.perf_counter() - start, outcome="ok")
+        _notify_commit()
         return True
     except Exception as e:
+        DB_WRITE_LATENCY.observe(time.perf_counter() - start, outcome="error")
         logging.error("Failed to record a game in the database")
         logging.exception(e)
         if conn:
@@ -82,6 +258,46 @@ def record_game(result: Result) -> bool:
         return False
 
 
+def on_commit(listener: Callable[[], None]) -> None:
+    """
+    Register a callback to run every time new games are committed to the DB
+    """
+    _commit_listeners.append(listener)
+
+
+def _notify_commit() -> None:
+    """
+    Run the commit listeners; a failing listener never fails the write
+    """
+    for listener in _commit_listeners:
+        try:
+            listener()
+        except Exception as e:
+            logging.exception(e)
+
+
+@traced("db.latest_game")
+def latest_game_id() -> int:
+    """
+    Return the id of the most recent game, or 0 if there is none or the DB is unavailable
+    """
+    conn = _get_db()
+    if conn is None:
+        return 0
+
+    try:
+        row = conn.execute("SELECT MAX(id) FROM games").fetchone()
+        conn.close()
+        return row[0] or 0
+    except Exception as e:
+        logging.error("Error getting the latest game id")
+        logging.exception(e)
+        if conn:
+            conn.close()
+        return 0
+
+
+@traced("db.read_games")
 def get_games() -> List[Result]:
     """
     Return all games in the order that they were played.
@@ -186,7 +402,20 @@ def calculate_elo_ratings(
         Dictionary mapping player names to their final ELO ratings
     """
     calculator = EloCalculator()
+    replay_elo(calculator, results, exclude_self_play)
+    return calculator.ratings
+
 
+def replay_elo(
+    calculator: EloCalculator, results: Iterable[Result], exclude_self_play: bool = True
+) -> int:
+    """
+    Apply game results, in order, to an existing calculator.
+
+    Returns:
+        The number of games that were applied
+    """
+    applied = 0
     for result in results:
         # Skip self-play games if requested
         if exclude_self_play and result.red_player == result.blue_player:
@@ -204,28 +433,670 @@ def calculate_elo_ratings(
         calculator.update_ratings(
             result.red_player, result.blue_player, red_score, blue_score
         )
+        applied += 1
 
-    return calculator.ratings
+    return applied
 
 
-def ratings() -> Dict[str, float]:
+def ratings(engine_name: str = "elo") -> Dict[str, float]:
     """
-    Return the ELO ratings from all prior games in the DB
+    Return the ratings from all prior games in the DB, ELO unless another engine is named
     """
+    if engine_name != "elo":
+        return engine_ratings(engine_name)
     games = get_games()
     return calculate_elo_ratings(games)
 
 
-def ratings_by_variant(variant: str) -> Dict[str, float]:
+def ratings_by_variant(variant: str, engine_name: str = "elo") -> Dict[str, float]:
     """
-    Return the ELO ratings for a specific variant from all prior games in the DB
+    Return the ratings for a specific variant from all prior games in the DB
     
     Args:
         variant: The game variant to filter by ('normal', 'a', 'b')
+        engine_name: The rating engine to use ('elo', 'bradley-terry', 'glicko2')
     
     Returns:
-        Dictionary mapping player names to their ELO ratings for that variant
+        Dictionary mapping player names to their ratings for that variant
     """
+    if engine_name != "elo":
+        return engine_ratings(engine_name, variant)
     games = get_games()
     filtered_games = [game for game in games if game.variant == variant]
-    return calculate_elo_ratings(filtered_games)
\ No newline at end of file
+    return calculate_elo_ratings(filtered_games)
+
+
+@dataclass
+class PairCounts:
+    """
+    Aggregated outcomes between every pair of players; the rating engines work on
+    these matrices rather than on individual games
+    """
+    players: List[str]
+    wins: np.ndarray   # wins[i, j]: number of games player i won against player j
+    draws: np.ndarray  # draws[i, j]: number of drawn games between i and j (symmetric)
+
+    @property
+    def scores(self) -> np.ndarray:
+        """Score of i against j, counting a draw as half a win."""
+        return self.wins + 0.5 * self.draws
+
+    @property
+    def total(self) -> int:
+        """Total number of games in the matrix."""
+        return int(self.wins.sum() + np.triu(self.draws).sum())
+
+
+def _counts_from_rows(rows, players: Optional[List[str]] = None) -> PairCounts:
+    """
+    Build a PairCounts from (red, blue, red_wins, blue_wins, draws) rows
+    """
+    rows = list(rows)
+    if players is None:
+        players = sorted({row[0] for row in rows} | {row[1] for row in rows})
+    index = {player: i for i, player in enumerate(players)}
+    size = len(players)
+    wins = np.zeros((size, size))
+    draws = np.zeros((size, size))
+    for red, blue, red_wins, blue_wins, drawn in rows:
+        i, j = index[red], index[blue]
+        wins[i, j] += red_wins
+        wins[j, i] += blue_wins
+        draws[i, j] += drawn
+        draws[j, i] += drawn
+    return PairCounts(players, wins, draws)
+
+
+def pair_counts(results: List[Result], exclude_self_play: bool = True) -> PairCounts:
+    """
+    Aggregate a list of game results into pair-count matrices
+    """
+    totals: Dict[tuple, List[int]] = {}
+    for result in results:
+        if exclude_self_play and result.red_player == result.blue_player:
+            continue
+        row = totals.setdefault((result.red_player, result.blue_player), [0, 0, 0])
+        if result.red_won and not result.blue_won:
+            row[0] += 1
+        elif result.blue_won and not result.red_won:
+            row[1] += 1
+        else:
+            row[2] += 1
+    return _counts_from_rows((red, blue, *row) for (red, blue), row in totals.items())
+
+
+_PAIR_COUNTS_SQL = """
+    SELECT red_player, blue_player,
+           SUM(CASE WHEN red_won = 1 AND blue_won = 0 THEN 1 ELSE 0 END),
+           SUM(CASE WHEN blue_won = 1 AND red_won = 0 THEN 1 ELSE 0 END),
+           SUM(CASE WHEN red_won = blue_won THEN 1 ELSE 0 END)
+    FROM games
+    WHERE red_player != blue_player {where}
+    GROUP BY red_player, blue_player
+"""
+
+
+@traced("db.pair_counts")
+def pair_counts_from_db(variant: Optional[str] = None) -> PairCounts:
+    """
+    Aggregate the games in the DB into pair-count matrices, letting SQLite do the grouping.
+    Returns empty matrices if database is unavailable.
+    """
+    empty = _counts_from_rows([])
+    conn = _get_db()
+    if conn is None:
+        return empty
+
+    try:
+        cursor = conn.cursor()
+        if variant:
+            cursor.execute(_PAIR_COUNTS_SQL.format(where="AND variant = ?"), (variant,))
+        else:
+            cursor.execute(_PAIR_COUNTS_SQL.format(where=""))
+        rows = cursor.fetchall()
+        conn.close()
+        return _counts_from_rows(rows)
+    except Exception as e:
+        logging.error("Error aggregating games")
+        logging.exception(e)
+        if conn:
+            conn.close()
+        return empty
+
+
+class RatingEngine:
+    """
+    A superclass for rating systems - subclass for each engine and give it a name
+    """
+
+    name = ""
+
+    def __init__(self, default_rating: float = 1000):
+        """
+        Initialize the engine; ratings are centered on default_rating like EloCalculator
+        """
+        self.default_rating = default_rating
+
+    def fit(self, results: List[Result]) -> Dict[str, float]:
+        """
+        Return the ratings for a list of game results, sorted by date
+        """
+        return self.fit_counts(pair_counts(results))
+
+    def fit_counts(self, counts: PairCounts) -> Dict[str, float]:
+        """
+        Return the ratings for aggregated pair counts
+        """
+        raise NotImplementedError(f"{self.name} cannot be fitted on pair counts")
+
+    def fit_db(self, variant: Optional[str] = None) -> Dict[str, float]:
+        """
+        Return the ratings for the games stored in the DB
+        """
+        return self.fit_counts(pair_counts_from_db(variant))
+
+    @classmethod
+    def engine_map(cls) -> Dict[str, type]:
+        """
+        Generate a mapping of engine names to RatingEngine classes, by looking at all subclasses
+        """
+        return {engine.name: engine for engine in cls.__subclasses__() if engine.name}
+
+    @classmethod
+    def create(cls, name: str, **kwargs) -> "RatingEngine":
+        """
+        Return an instance of the engine with this name
+        """
+        engine = cls.engine_map().get(name)
+        if not engine:
+            raise ValueError(f"Unrecognized rating engine: {name}")
+        return engine(**kwargs)
+
+
+class EloEngine(RatingEngine):
+    """
+    The original sequential ELO calculation; depends on the order of the games
+    """
+
+    name = "elo"
+
+    def fit(self, results: List[Result]) -> Dict[str, float]:
+        return calculate_elo_ratings(results)
+
+    def fit_db(self, variant: Optional[str] = None) -> Dict[str, float]:
+        games = get_games()
+        if variant:
+            games = [game for game in games if game.variant == variant]
+        return self.fit(games)
+
+
+# Scale factor between natural log-odds and ELO points
+ELO_SCALE = 400 / math.log(10)
+
+
+class BradleyTerryEngine(RatingEngine):
+    """
+    Maximum likelihood Bradley-Terry ratings, fitted on the pair-count matrix.
+    The result does not depend on game order, and a small Gaussian prior keeps
+    unbeaten (or winless) players at a finite rating.
+    """
+
+    name = "bradley-terry"
+
+    def __init__(self, default_rating: float = 1000, prior: float = 0.01):
+        super().__init__(default_rating)
+        self.prior = prior
+
+    def strengths(self, scores: np.ndarray) -> np.ndarray:
+        """
+        Return the log-strengths maximizing the likelihood of the score matrix
+        """
+        size = scores.shape[0]
+        if size == 0:
+            return np.zeros(0)
+
+        def objective(theta):
+            diff = theta[:, None] - theta[None, :]
+            # log(sigmoid(x)) = -log(1 + e^-x), computed stably
+            nll = np.sum(scores * np.logaddexp(0, -diff)) + 0.5 * self.prior * theta @ theta
+            weighted = scores * (1 - expit(diff))
+            grad = -(weighted.sum(axis=1) - weighted.sum(axis=0)) + self.prior * theta
+            return nll, grad
+
+        fitted = minimize(objective, np.zeros(size), jac=True, method="L-BFGS-B")
+        theta = fitted.x
+        return theta - theta.mean()
+
+    def fit_counts(self, counts: PairCounts) -> Dict[str, float]:
+        theta = self.strengths(counts.scores)
+        return {
+            player: self.default_rating + ELO_SCALE * value
+            for player, value in zip(counts.players, theta)
+        }
+
+
+# Glicko-2 conversion factor between the Glicko and Glicko-2 scales
+GLICKO2_SCALE = 173.7178
+
+
+class Glicko2Engine(RatingEngine):
+    """
+    Glicko-2 ratings. Games are grouped into rating periods (one per day); within a
+    period every player is updated at once from the pair-count matrix of that period.
+    After a fit, self.deviations holds each player's rating deviation.
+    """
+
+    name = "glicko2"
+
+    def __init__(
+        self,
+        default_rating: float = 1000,
+        deviation: float = 350,
+        volatility: float = 0.06,
+        tau: float = 0.5,
+    ):
+        super().__init__(default_rating)
+        self.deviation = deviation
+        self.volatility = volatility
+        self.tau = tau
+        self.deviations: Dict[str, float] = {}
+
+    def fit(self, results: List[Result]) -> Dict[str, float]:
+        periods: Dict[str, List[Result]] = {}
+        for result in results:
+            periods.setdefault(result.date.date().isoformat(), []).append(result)
+        players = sorted({r.red_player for r in results} | {r.blue_player for r in results})
+        return self._fit_periods(
+            players, [pair_counts(periods[day]) for day in sorted(periods)]
+        )
+
+    def fit_counts(self, counts: PairCounts) -> Dict[str, float]:
+        # Without dates, everything is a single rating period
+        return self._fit_periods(counts.players, [counts])
+
+    def fit_db(self, variant: Optional[str] = None) -> Dict[str, float]:
+        conn = _get_db()
+        if conn is None:
+            return {}
+
+        try:
+            cursor = conn.cursor()
+            sql = _PAIR_COUNTS_SQL.replace(
+                "SELECT red_player", "SELECT substr(date, 1, 10), red_player"
+            ).replace("GROUP BY red_player", "GROUP BY substr(date, 1, 10), red_player")
+            if variant:
+                cursor.execute(sql.format(where="AND variant = ?"), (variant,))
+            else:
+                cursor.execute(sql.format(where=""))
+            rows = cursor.fetchall()
+            conn.close()
+        except Exception as e:
+            logging.error("Error aggregating games")
+            logging.exception(e)
+            if conn:
+                conn.close()
+            return {}
+
+        periods: Dict[str, list] = {}
+        for row in rows:
+            periods.setdefault(row[0], []).append(row[1:])
+        players = sorted({row[1] for row in rows} | {row[2] for row in rows})
+        return self._fit_periods(
+            players, [_counts_from_rows(periods[day], players) for day in sorted(periods)]
+        )
+
+    def _fit_periods(self, players: List[str], periods: List[PairCounts]) -> Dict[str, float]:
+        """
+        Run one Glicko-2 update per rating period, vectorized over players
+        """
+        index = {player: i for i, player in enumerate(players)}
+        size = len(players)
+        mu = np.zeros(size)
+        phi = np.full(size, self.deviation / GLICKO2_SCALE)
+        sigma = np.full(size, self.volatility)
+
+        for counts in periods:
+            # Expand the period onto the full player list
+            rows = [index[player] for player in counts.players]
+            scores = np.zeros((size, size))
+            games = np.zeros((size, size))
+            scores[np.ix_(rows, rows)] = counts.scores
+            games[np.ix_(rows, rows)] = counts.wins + counts.wins.T + counts.draws
+            mu, phi, sigma = self._update(mu, phi, sigma, scores, games)
+
+        self.deviations = {
+            player: float(GLICKO2_SCALE * phi[i]) for player, i in index.items()
+        }
+        return {
+            player: float(self.default_rating + GLICKO2_SCALE * mu[i])
+            for player, i in index.items()
+        }
+
+    def _update(self, mu, phi, sigma, scores, games):
+        """
+        Apply one rating period to every player at once
+        """
+        g = 1 / np.sqrt(1 + 3 * phi ** 2 / math.pi ** 2)
+        expected = expit(g[None, :] * (mu[:, None] - mu[None, :]))
+        played = games.sum(axis=1) > 0
+
+        info = (games * g[None, :] ** 2 * expected * (1 - expected)).sum(axis=1)
+        v = 1 / np.where(info > 0, info, 1)
+        improvement = (g[None, :] * (scores - games * expected)).sum(axis=1)
+        delta = v * improvement
+
+        new_sigma = sigma.copy()
+        for i in np.flatnonzero(played):
+            new_sigma[i] = self._volatility(phi[i], sigma[i], v[i], delta[i])
+
+        phi_star = np.sqrt(phi ** 2 + new_sigma ** 2)
+        new_phi = np.where(played, 1 / np.sqrt(1 / phi_star ** 2 + 1 / v), phi_star)
+        new_mu = np.where(played, mu + new_phi ** 2 * improvement, mu)
+        return new_mu, new_phi, new_sigma
+
+    def _volatility(self, phi: float, sigma: float, v: float, delta: float) -> float:
+        """
+        Solve for the new volatility with the Illinois algorithm (step 5 of Glicko-2)
+        """
+        a = math.log(sigma ** 2)
+        tau2 = self.tau ** 2
+
+        def f(x):
+            ex = math.exp(x)
+            return ex * (delta ** 2 - phi ** 2 - v - ex) / (2 * (phi ** 2 + v + ex) ** 2) - (x - a) / tau2
+
+        low = a
+        if delta ** 2 > phi ** 2 + v:
+            high = math.log(delta ** 2 - phi ** 2 - v)
+        else:
+            k = 1
+            while f(a - k * self.tau) < 0:
+                k += 1
+            high = a - k * self.tau
+        f_low, f_high = f(low), f(high)
+        while abs(high - low) > 1e-6:
+            c = low + (low - high) * f_low / (f_high - f_low)
+            f_c = f(c)
+            if f_c * f_high <= 0:
+                low, f_low = high, f_high
+            else:
+                f_low /= 2
+            high, f_high = c, f_c
+        return math.exp(low / 2)
+
+
+def _bootstrap_chunk(
+    engine_name: str, counts: PairCounts, replicates: int, seed: int
+) -> np.ndarray:
+    """
+    Refit the engine on resampled pair counts; runs inside a worker process.
+    Resampling games with replacement is a multinomial draw over the outcome cells.
+    """
+    engine = RatingEngine.create(engine_name)
+    rng = np.random.default_rng(seed)
+    size = len(counts.players)
+    upper = np.triu_indices(size, k=1)
+    cells = np.concatenate([counts.wins.ravel(), counts.draws[upper]])
+    total = int(cells.sum())
+    samples = np.empty((replicates, size))
+    for r in range(replicates):
+        drawn = rng.multinomial(total, cells / total)
+        wins = drawn[: size * size].reshape(size, size).astype(float)
+        draws = np.zeros((size, size))
+        draws[upper] = drawn[size * size:]
+        draws += draws.T
+        fitted = engine.fit_counts(PairCounts(counts.players, wins, draws))
+        samples[r] = [fitted[player] for player in counts.players]
+    return samples
+
+
+def bootstrap_intervals(
+    counts: PairCounts,
+    engine_name: str = "bradley-terry",
+    replicates: int = 200,
+    confidence: float = 0.95,
+    workers: Optional[int] = None,
+    seed: int = 0,
+) -> Dict[str, tuple]:
+    """
+    Return a (low, high) confidence interval for every player's rating, from bootstrap
+    refits computed in parallel with a process pool.
+
+    Args:
+        counts: Aggregated pair counts to resample
+        engine_name: Name of an engine that supports fit_counts
+        replicates: Number of bootstrap refits
+        confidence: Width of the interval
+        workers: Number of worker processes (defaults to the CPU count; 1 runs in-process)
+        seed: Seed for reproducible intervals
+    """
+    if counts.total == 0:
+        return {}
+    workers = workers or os.cpu_count() or 1
+    chunks = [replicates // workers + (1 if i < replicates % workers else 0) for i in range(workers)]
+    chunks = [chunk for chunk in chunks if chunk]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    jobs = [(engine_name, counts, chunk, s.generate_state(1)[0]) for chunk, s in zip(chunks, seeds)]
+
+    if len(jobs) == 1:
+        samples = _bootstrap_chunk(*jobs[0])
+    else:
+        with ProcessPoolExecutor(max_workers=len(jobs)) as pool:
+            samples = np.vstack(list(pool.map(_bootstrap_chunk, *zip(*jobs))))
+
+    tail = (1 - confidence) / 2 * 100
+    low = np.percentile(samples, tail, axis=0)
+    high = np.percentile(samples, 100 - tail, axis=0)
+    return {
+        player: (float(low[i]), float(high[i]))
+        for i, player in enumerate(counts.players)
+    }
+
+
+def engine_ratings(engine_name: str = "bradley-terry", variant: Optional[str] = None) -> Dict[str, float]:
+    """
+    Return the ratings computed by the named engine from all prior games in the DB,
+    optionally restricted to one variant
+    """
+    return RatingEngine.create(engine_name).fit_db(variant)
+
+
+def rating_intervals(
+    engine_name: str = "bradley-terry",
+    variant: Optional[str] = None,
+    replicates: int = 200,
+    confidence: float = 0.95,
+) -> Dict[str, tuple]:
+    """
+    Return bootstrap confidence intervals for the ratings of the games in the DB
+    """
+    return bootstrap_intervals(
+        pair_counts_from_db(variant), engine_name, replicates=replicates, confidence=confidence
+    )
+
+
+# Number of games between two rating snapshots
+SNAPSHOT_EVERY = int(os.getenv("SNAPSHOT_EVERY", 500))
+
+
+def _iter_games(
+    conn: sqlite3.Connection,
+    after_id: int = 0,
+    until_id: Optional[int] = None,
+    variant: Optional[str] = None,
+) -> Iterator[Tuple[int, Result]]:
+    """
+    Stream (id, result) pairs in id order, without loading the whole table
+    """
+    sql = """
+        SELECT id, red_player, blue_player, variant, red_won, blue_won, date
+        FROM games
+        WHERE id > ?
+    """
+    params: list = [after_id]
+    if until_id is not None:
+        sql += " AND id <= ?"
+        params.append(until_id)
+    if variant:
+        sql += " AND variant = ?"
+        params.append(variant)
+    cursor = conn.execute(sql + " ORDER BY id", params)
+    for row in cursor:
+        yield row[0], Result(
+            red_player=row[1],
+            blue_player=row[2],
+            variant=row[3],
+            red_won=bool(row[4]),
+            blue_won=bool(row[5]),
+            date=datetime.fromisoformat(row[6])
+        )
+
+
+def _latest_snapshot(
+    conn: sqlite3.Connection, scope: str, until_id: Optional[int] = None
+) -> Tuple[int, int, Dict[str, float]]:
+    """
+    Return (game_id, games, ratings) of the latest snapshot at or before until_id;
+    (0, 0, {}) if there is none
+    """
+    sql = "SELECT game_id, games, ratings FROM rating_snapshots WHERE scope = ?"
+    params: list = [scope]
+    if until_id is not None:
+        sql += " AND game_id <= ?"
+        params.append(until_id)
+    row = conn.execute(sql + " ORDER BY game_id DESC LIMIT 1", params).fetchone()
+    if row is None:
+        return 0, 0, {}
+    return row[0], row[1], json.loads(row[2])
+
+
+def update_snapshots(variant: Optional[str] = None, every: int = SNAPSHOT_EVERY) -> int:
+    """
+    Replay the games played since the latest snapshot and store a new snapshot
+    every `every` games. Cheap to call often: only new games are replayed.
+
+    Args:
+        variant: Restrict to one variant; None snapshots the ratings across all variants
+        every: Number of games between two snapshots
+
+    Returns:
+        The number of snapshots written
+    """
+    conn = _get_db()
+    if conn is None:
+        return 0
+
+    scope = variant or ""
+    try:
+        game_id, games, saved = _latest_snapshot(conn, scope)
+        calculator = EloCalculator()
+        calculator.ratings = saved
+        written = []
+        last_games = games
+        for game_id, result in _iter_games(conn, game_id, variant=variant):
+            games += replay_elo(calculator, [result])
+            if games != last_games and games % every == 0:
+                written.append((scope, game_id, games, result.date.isoformat(), json.dumps(calculator.ratings)))
+                last_games = games
+        if written:
+            conn.executemany("""
+                INSERT OR REPLACE INTO rating_snapshots (scope, game_id, games, date, ratings)
+                VALUES (?, ?, ?, ?, ?)
+            """, written)
+            conn.commit()
+        conn.close()
+        return len(written)
+    except Exception as e:
+        logging.error("Failed to update rating snapshots")
+        logging.exception(e)
+        if conn:
+            conn.close()
+        return 0
+
+
+def _ratings_at(
+    conn: sqlite3.Connection, until_id: int, variant: Optional[str], start=None
+) -> Tuple[Dict[str, float], Tuple[int, EloCalculator]]:
+    """
+    Return the ELO ratings after game until_id, replaying from the nearest snapshot,
+    or from `start` (game_id, calculator) when it is closer. Also returns the new start.
+    """
+    game_id, _, saved = _latest_snapshot(conn, variant or "", until_id)
+    if start is not None and start[0] >= game_id:
+        game_id, calculator = start
+    else:
+        calculator = EloCalculator()
+        calculator.ratings = dict(saved)
+    replay_elo(calculator, (result for _, result in _iter_games(conn, game_id, until_id, variant)))
+    return dict(calculator.ratings), (max(game_id, until_id), calculator)
+
+
+def _last_id_at(conn: sqlite3.Connection, date: datetime) -> int:
+    """
+    Return the id of the last game played at or before date (0 if none)
+    """
+    row = conn.execute("SELECT MAX(id) FROM games WHERE date <= ?", (date.isoformat(),)).fetchone()
+    return row[0] or 0
+
+
+def game_date_range() -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    Return the dates of the first and last games, or (None, None) if there are none
+    """
+    conn = _get_db()
+    if conn is None:
+        return None, None
+
+    try:
+        first, last = conn.execute("SELECT MIN(date), MAX(date) FROM games").fetchone()
+        conn.close()
+        if first is None:
+            return None, None
+        return datetime.fromisoformat(first), datetime.fromisoformat(last)
+    except Exception as e:
+        logging.error("Error getting the game date range")
+        logging.exception(e)
+        if conn:
+            conn.close()
+        return None, None
+
+
+def ratings_as_of(date: datetime, variant: Optional[str] = None) -> Dict[str, float]:
+    """
+    Return the ELO ratings as they were at the given date, replaying only from the
+    nearest snapshot. Returns an empty dict if the database is unavailable.
+    """
+    return rating_history([date], variant)[0]
+
+
+def rating_history(dates: List[datetime], variant: Optional[str] = None) -> List[Dict[str, float]]:
+    """
+    Return the ELO ratings at each of the given dates, e.g. for a rating-over-time chart.
+    Points are computed in date order; each one continues from the previous point or
+    from the nearest snapshot, whichever is closer.
+
+    Args:
+        dates: The dates of the points
+        variant: Restrict to one variant; None for the ratings across all variants
+
+    Returns:
+        One ratings dictionary per date, in the order of `dates`
+    """
+    update_snapshots(variant)
+    conn = _get_db()
+    if conn is None:
+        return [{} for _ in dates]
+
+    try:
+        points: Dict[datetime, Dict[str, float]] = {}
+        start = None
+        for date in sorted(set(dates)):
+            points[date], start = _ratings_at(conn, _last_id_at(conn, date), variant, start)
+        conn.close()
+        return [points[date] for date in dates]
+    except Exception as e:
+        logging.error("Error computing the rating history")
+        logging.exception(e)
+        if conn:
+            conn.close()
+        return [{} for _ in dates]
@@ -0,0 +1,576 @@
+# Session stores for the games of the web app
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, Optional
+
+from arena.game import Game
+from arena.llm import LLM
+from arena.tracing import span, traced
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # "memory" or "sqlite"
+SESSION_DB = os.getenv("SESSION_DB", "nim_sessions.db")
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", 1000))
+SESSION_TTL = float(os.getenv("SESSION_TTL", 3600))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", 0))  # 0 = no memory budget
+SESSION_LOCK_TIMEOUT = float(os.getenv("SESSION_LOCK_TIMEOUT", 30))
+SESSION_LOCK_LEASE = float(os.getenv("SESSION_LOCK_LEASE", 120))  # longer than an LLM call with retries
+
+# Rough footprint of one SDK client (HTTP pool, auth, config); getsizeof can't see it
+CLIENT_OVERHEAD = 64 * 1024
+
+
+def estimate_game_size(game: Game) -> int:
+    """
+    Return an estimate of the memory held by a Game, in bytes
+    """
+    size = sys.getsizeof(game) + sys.getsizeof(game.nim_game)
+    size += sys.getsizeof(game.nim_game.history) + 28 * len(game.nim_game.history)
+    for player in game.players.values():
+        size += sys.getsizeof(player)
+        for text in (player.evaluation, player.threats, player.opportunities, player.strategy):
+            size += sys.getsizeof(text)
+        if player.llm.client is not None:
+            size += CLIENT_OVERHEAD
+    return size
+
+
+_LLMS: Dict[str, LLM] = {}
+_LLMS_LOCK = threading.Lock()
+
+
+def shared_llm(model: str) -> LLM:
+    """
+    Return the process-wide LLM of this model, so games loaded from a store reuse its SDK client
+    """
+    with _LLMS_LOCK:
+        llm = _LLMS.get(model)
+        if llm is None:
+            llm = _LLMS[model] = LLM.create(model)
+        return llm
+
+
+def dumps_game(game: Game) -> str:
+    """
+    Serialize a Game to compact JSON
+    """
+    return json.dumps(game.to_dict(), separators=(",", ":"))
+
+
+def loads_game(state: str) -> Game:
+    """
+    Rebuild a Game serialized by dumps_game
+    """
+    return Game.from_dict(json.loads(state), llm_factory=shared_llm)
+
+
+class SessionLockTimeout(Exception):
+    """
+    Raised when a session stays locked by another request for longer than the timeout
+    """
+
+
+class SessionBackend(ABC):
+    """
+    The interface of the session stores. Requests that change a game hold lock(sid)
+    (or alock(sid) in async code) while they load, change and save it, so two requests
+    never change one game at once, while different sessions run in parallel.
+    Locks are not re-entrant.
+    """
+
+    # True if the lock must also be taken in the store, for other processes
+    shared_locks = False
+    lease = SESSION_LOCK_LEASE
+
+    def __init__(self):
+        """
+        Initialize the in-process locks: one per session currently locked or waited on
+        """
+        self.locks: Dict[str, list] = {}  # sid -> [lock, holders and waiters]
+        self.locks_mutex = threading.Lock()
+
+    @abstractmethod
+    def get(self, sid: str) -> Optional[Game]:
+        """
+        Return the game of this session, or None
+        """
+
+    @abstractmethod
+    def set(self, sid: str, game: Game) -> None:
+        """
+        Store the game of this session
+        """
+
+    @abstractmethod
+    def pop(self, sid: str) -> Optional[Game]:
+        """
+        Remove a session and return its game
+        """
+
+    @abstractmethod
+    def stats(self) -> Dict:
+        """
+        Return the counts of the store, for monitoring
+        """
+
+    def _enter(self, sid: str) -> threading.Lock:
+        """
+        Return the in-process lock of this session, counting the caller as a user of it
+        """
+        with self.locks_mutex:
+            entry = self.locks.get(sid)
+            if entry is None:
+                entry = self.locks[sid] = [threading.Lock(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def _leave(self, sid: str) -> None:
+        """
+        Drop the in-process lock of this session once nobody holds or waits on it
+        """
+        with self.locks_mutex:
+            entry = self.locks[sid]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.locks[sid]
+
+    def _acquire_shared(self, sid: str, owner: str, deadline: float) -> bool:
+        """
+        Take the lock of this session in the store, for other processes (no-op here)
+        """
+        return True
+
+    def _release_shared(self, sid: str, owner: str) -> None:
+        """
+        Release the lock taken by _acquire_shared
+        """
+
+    def _renew_shared(self, sid: str, owner: str) -> None:
+        """
+        Extend the lease of the lock taken by _acquire_shared (no-op here)
+        """
+
+    def _keep_shared(self, sid: str, owner: str) -> threading.Event:
+        """
+        Renew the lease of the lock in the store from a background thread until the returned
+        event is set: a request may hold a session for a whole game (/api/run with slow
+        models) without saving it, and the lease must not expire under it
+        """
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.lease / 3):
+                try:
+                    self._renew_shared(sid, owner)
+                except Exception as e:
+                    logging.error(f"Failed to renew the lock of session {sid}: {e}")
+
+        threading.Thread(target=renew, name="session-lease", daemon=True).start()
+        return stop
+
+    @contextmanager
+    def lock(self, sid: str, timeout: float = SESSION_LOCK_TIMEOUT) -> Iterator[None]:
+        """
+        Hold the lock of this session, waiting at most `timeout` seconds for it
+        """
+        deadline = time.monotonic() + timeout
+        owner = uuid.uuid4().hex
+        local = self._enter(sid)
+        try:
+            with span("session.lock"):
+                acquired = local.acquire(timeout=timeout)
+            if not acquired:
+                raise SessionLockTimeout("Session is busy with another request")
+            try:
+                if not self._acquire_shared(sid, owner, deadline):
+                    raise SessionLockTimeout("Session is busy with another request")
+                heartbeat = self._keep_shared(sid, owner) if self.shared_locks else None
+                try:
+                    yield
+                finally:
+                    if heartbeat is not None:
+                        heartbeat.set()
+                    self._release_shared(sid, owner)
+            finally:
+                local.release()
+        finally:
+            self._leave(sid)
+
+    async def _aacquire_shared(self, sid: str, owner: str, deadline: float) -> bool:
+        """
+        Take the lock in the store from a thread; if the caller is cancelled meanwhile, the
+        lock is released as soon as the thread has taken it
+        """
+        attempt = asyncio.ensure_future(asyncio.to_thread(self._acquire_shared, sid, owner, deadline))
+
+        def release_if_taken(done: asyncio.Future) -> None:
+            if not done.cancelled() and done.exception() is None and done.result():
+                self._release_shared(sid, owner)
+
+        try:
+            return await asyncio.shield(attempt)
+        except asyncio.CancelledError:
+            attempt.add_done_callback(release_if_taken)
+            raise
+
+    @asynccontextmanager
+    async def alock(self, sid: str, timeout: float = SESSION_LOCK_TIMEOUT) -> AsyncIterator[None]:
+        """
+        Async version of lock(): the same locks, so async requests and worker threads
+        exclude each other, but waiting never blocks the event loop
+        """
+        deadline = time.monotonic() + timeout
+        owner = uuid.uuid4().hex
+        local = self._enter(sid)
+        try:
+            # Attente par sondage, comme Limiter.aacquire: une coroutine annulée pendant
+            # l'attente (client déconnecté) ne laisse pas un thread prendre le verrou pour rien
+            with span("session.lock"):
+                while not local.acquire(blocking=False):
+                    if time.monotonic() >= deadline:
+                        raise SessionLockTimeout("Session is busy with another request")
+                    await asyncio.sleep(0.01)
+            try:
+                if self.shared_locks and not await self._aacquire_shared(sid, owner, deadline):
+                    raise SessionLockTimeout("Session is busy with another request")
+                heartbeat = self._keep_shared(sid, owner) if self.shared_locks else None
+                try:
+                    yield
+                finally:
+                    if heartbeat is not None:
+                        heartbeat.set()
+                        await asyncio.to_thread(self._release_shared, sid, owner)
+            finally:
+                local.release()
+        finally:
+            self._leave(sid)
+
+
+class SessionStore(SessionBackend):
+    """
+    A bounded, thread-safe map from session id to Game, in the memory of this process:
+    entries idle for longer than the TTL expire, and the least recently used are evicted
+    beyond the entry or byte limit
+    """
+
+    def __init__(
+        self,
+        max_entries: int = SESSION_MAX_ENTRIES,
+        ttl: float = SESSION_TTL,
+        max_bytes: int = SESSION_MAX_BYTES,
+    ):
+        """
+        Initialize the store; entries are kept in least-recently-used order
+        """
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, list]" = OrderedDict()  # sid -> [game, last_access, size]
+        self.mutex = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def get(self, sid: str) -> Optional[Game]:
+        """
+        Return the game of this session, refreshing its position and idle time
+        """
+        with self.mutex:
+            self._expire()
+            entry = self.entries.get(sid)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry[1] = time.monotonic()
+            self.entries.move_to_end(sid)
+            return entry[0]
+
+    def set(self, sid: str, game: Game) -> None:
+        """
+        Store the game of this session, evicting others if the store is over its limits
+        """
+        size = estimate_game_size(game)
+        with self.mutex:
+            old = self.entries.pop(sid, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self.entries[sid] = [game, time.monotonic(), size]
+            self.bytes += size
+            self._expire()
+            while len(self.entries) > 1 and (
+                len(self.entries) > self.max_entries
+                or (self.max_bytes and self.bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self.entries)))
+                self.evicted += 1
+
+    def pop(self, sid: str) -> Optional[Game]:
+        """
+        Remove a session and return its game
+        """
+        with self.mutex:
+            entry = self.entries.get(sid)
+            if entry is None:
+                return None
+            self._remove(sid)
+            return entry[0]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, sid: str) -> bool:
+        return sid in self.entries
+
+    def stats(self) -> Dict:
+        """
+        Return the counts of the store, for monitoring
+        """
+        with self.mutex:
+            self._expire()
+            return {
+                "backend": "memory",
+                "sessions": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+    def _remove(self, sid: str) -> None:
+        """
+        Drop an entry; the game and its SDK clients are freed once no request uses them.
+        The mutex must be held.
+        """
+        _, _, size = self.entries.pop(sid)
+        self.bytes -= size
+
+    def _expire(self) -> None:
+        """
+        Drop the sessions idle for longer than the TTL; they are at the front of the
+        LRU order, so this stops at the first live one. The mutex must be held.
+        """
+        deadline = time.monotonic() - self.ttl
+        while self.entries:
+            sid, entry = next(iter(self.entries.items()))
+            if entry[1] > deadline:
+                break
+            self._remove(sid)
+            self.expired += 1
+
+
+class SqliteSessionStore(SessionBackend):
+    """
+    Sessions serialized into a SQLite file, so every worker process on the host sees
+    the same games. A session lock is also a lease row in the DB: it is held across
+    processes, and expires if its holder dies.
+    """
+
+    shared_locks = True
+
+    def __init__(
+        self,
+        db_file: str = SESSION_DB,
+        max_entries: int = SESSION_MAX_ENTRIES,
+        ttl: float = SESSION_TTL,
+        lease: float = SESSION_LOCK_LEASE,
+    ):
+        """
+        Initialize the store; connections are opened per thread
+        """
+        super().__init__()
+        self.db_file = db_file
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lease = lease
+        self.local = threading.local()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.counter_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.lock_waits = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        """
+        Return the connection of this thread, creating the tables on first use
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    sid TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS session_locks (
+                    sid TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires REAL NOT NULL
+                )
+            """)
+            self.local.conn = conn
+        return conn
+
+    def _count(self, name: str) -> None:
+        with self.counter_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    @traced("db.session.get")
+    def get(self, sid: str) -> Optional[Game]:
+        """
+        Load the game of this session, or None if it is unknown or expired
+        """
+        try:
+            row = self._conn().execute(
+                "SELECT state FROM sessions WHERE sid = ? AND updated >= ?",
+                (sid, time.time() - self.ttl),
+            ).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            self._count("hits")
+            return loads_game(row[0])
+        except Exception as e:
+            logging.error(f"Failed to load session {sid}")
+            logging.exception(e)
+            return None
+
+    @traced("db.session.set")
+    def set(self, sid: str, game: Game) -> None:
+        """
+        Save the game of this session, renew the lease of a lock held on it,
+        and drop expired or excess sessions
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (sid, state, updated) VALUES (?, ?, ?)",
+            (sid, dumps_game(game), now),
+        )
+        # Seul le détenteur du verrou enregistre la partie: on prolonge son bail
+        conn.execute(
+            "UPDATE session_locks SET expires = ? WHERE sid = ?", (now + self.lease, sid)
+        )
+        self._count("writes")
+        if self.writes % 100 == 0:
+            self._prune(conn, now)
+
+    def pop(self, sid: str) -> Optional[Game]:
+        """
+        Remove a session and return its game
+        """
+        game = self.get(sid)
+        self._conn().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+        return game
+
+    def __len__(self) -> int:
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM sessions WHERE updated >= ?", (time.time() - self.ttl,)
+        ).fetchone()
+        return row[0]
+
+    def __contains__(self, sid: str) -> bool:
+        row = self._conn().execute(
+            "SELECT 1 FROM sessions WHERE sid = ? AND updated >= ?", (sid, time.time() - self.ttl)
+        ).fetchone()
+        return row is not None
+
+    def stats(self) -> Dict:
+        """
+        Return the counts of the store, for monitoring
+        """
+        return {
+            "backend": "sqlite",
+            "sessions": len(self),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "lock_waits": self.lock_waits,
+        }
+
+    @traced("db.session.lock")
+    def _acquire_shared(self, sid: str, owner: str, deadline: float) -> bool:
+        """
+        Take the lease row of this session, polling until the deadline if another process holds it
+        """
+        owner = f"{self.owner}:{owner}"
+        conn = self._conn()
+        while True:
+            now = time.time()
+            cursor = conn.execute("""
+                INSERT INTO session_locks (sid, owner, expires) VALUES (?, ?, ?)
+                ON CONFLICT(sid) DO UPDATE SET owner = excluded.owner, expires = excluded.expires
+                WHERE session_locks.expires < ?
+            """, (sid, owner, now + self.lease, now))
+            if cursor.rowcount == 1:
+                return True
+            if time.monotonic() > deadline:
+                return False
+            self._count("lock_waits")
+            time.sleep(0.05)
+
+    def _release_shared(self, sid: str, owner: str) -> None:
+        """
+        Delete the lease row, if it is still ours
+        """
+        self._conn().execute(
+            "DELETE FROM session_locks WHERE sid = ? AND owner = ?", (sid, f"{self.owner}:{owner}")
+        )
+
+    def _renew_shared(self, sid: str, owner: str) -> None:
+        """
+        Extend the lease row, if it is still ours
+        """
+        self._conn().execute(
+            "UPDATE session_locks SET expires = ? WHERE sid = ? AND owner = ?",
+            (time.time() + self.lease, sid, f"{self.owner}:{owner}"),
+        )
+
+    def _prune(self, conn: sqlite3.Connection, now: float) -> None:
+        """
+        Drop the sessions idle for longer than the TTL, then the oldest beyond max_entries
+        """
+        conn.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,))
+        conn.execute("DELETE FROM session_locks WHERE expires < ?", (now,))
+        conn.execute("""
+            DELETE FROM sessions WHERE sid IN (
+                SELECT sid FROM sessions ORDER BY updated DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+
+
+def create_session_store(backend: str = SESSION_BACKEND) -> SessionBackend:
+    """
+    Return the session store selected by SESSION_BACKEND
+    """
+    if backend == "sqlite":
+        return SqliteSessionStore()
+    if backend != "memory":
+        logging.warning(f"Unknown session backend {backend}, using memory")
+    return SessionStore()
@@ -0,0 +1,251 @@
+# Speculative replies: the LLM answers every move the human may play while the human is thinking
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from arena.admission import admit_background
+from arena.game import Game
+from arena.metrics import SPECULATIONS
+from arena.nim_game import BLUE, RED
+from arena.sessions import SessionBackend, shared_llm
+
+SPECULATE = os.getenv("SPECULATE", "1") != "0"
+SPECULATION_WORKERS = int(os.getenv("SPECULATION_WORKERS", 16))
+SPECULATION_WAIT = float(os.getenv("SPECULATION_WAIT", 3))  # attente max d'une réponse déjà envoyée
+SPECULATION_HEADROOM = int(os.getenv("SPECULATION_HEADROOM", 2))  # places laissées libres aux vrais coups
+SPECULATION_TTL = float(os.getenv("SPECULATION_TTL", 600))  # spéculations d'une session abandonnée
+
+Position = Tuple
+
+
+@dataclass
+class Speculation:
+    """
+    A copy of the game where the human played one of the legal moves, and the LLM's
+    reply to it being computed on the pool
+    """
+
+    game: Game
+    future: Optional[Future] = None
+    cancelled: threading.Event = field(default_factory=threading.Event)
+    created: float = field(default_factory=time.monotonic)
+
+
+def position(game: Game) -> Position:
+    """
+    Return what a reply depends on: the players, the variant and the moves so far
+    """
+    return (
+        game.players[RED].model, game.players[BLUE].model, game.variant, game.n,
+        tuple(game.nim_game.history),
+    )
+
+
+def _human_against_llm(game: Game) -> bool:
+    if not game.nim_game.is_active():
+        return False
+    to_move = game.nim_game.player_to_move
+    opponent = BLUE if to_move == RED else RED
+    return game.players[to_move].model == "Humain" and game.players[opponent].model != "Humain"
+
+
+class Speculator:
+    """
+    When a session reaches a human's turn against an LLM, plays a copy of the game for
+    each legal move of the human (3 or 4) and asks the LLM for its reply in the background.
+    Once the human has played, take() applies the matching reply, waiting a little for it
+    if the call is in flight (one still queued is dropped), and cancels the others: a queued call is dropped, a call already sent
+    finishes but its answer is thrown away (its tokens are billed all the same).
+
+    A speculative call only starts when no interactive call waits for a slot of
+    arena.admission and more than `headroom` slots are free; it is then skipped, not
+    queued, and not counted as a rejection. Once started it holds its slot until the
+    provider answers. The speculations live in the memory of this process, so they are
+    only made with a store that is not shared between workers.
+    """
+
+    def __init__(
+        self,
+        workers: int = SPECULATION_WORKERS,
+        wait: float = SPECULATION_WAIT,
+        ttl: float = SPECULATION_TTL,
+        headroom: int = SPECULATION_HEADROOM,
+    ):
+        """
+        Initialize the speculator and its pool
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="speculation")
+        self.wait = wait
+        self.headroom = headroom
+        self.ttl = ttl
+        # session -> (position where the human is to play, speculation per move of the human)
+        self.sessions: Dict[str, Tuple[Position, Dict[Position, Speculation]]] = {}
+        self.lock = threading.Lock()
+        self.counts = {"started": 0, "hit": 0, "waited": 0, "miss": 0, "failed": 0, "wasted": 0, "skipped": 0}
+
+    def _count(self, outcome: str, amount: int = 1) -> None:
+        with self.lock:
+            self.counts[outcome] += amount
+        SPECULATIONS.inc(amount, outcome=outcome)
+
+    def prepare(self, sid: str, game: Game) -> None:
+        """
+        Start the replies to every legal move of the human, if it is a human's turn against
+        an LLM and they are not already running; otherwise drop the session's speculations
+        """
+        if not _human_against_llm(game):
+            self.cancel(sid)
+            return
+        base = position(game)
+        with self.lock:
+            current = self.sessions.get(sid)
+            if current is not None and current[0] == base:
+                return
+
+        human = game.nim_game.player_to_move
+        speculations: Dict[Position, Speculation] = {}
+        state = game.to_dict()
+        for move in game.nim_game.valid_moves():
+            copy = Game.from_dict(state, llm_factory=shared_llm)
+            copy.players[human].make_human_move(copy.nim_game, move)
+            # Un coup gagnant de l'humain n'appelle pas de réponse
+            if copy.nim_game.is_active():
+                speculations[position(copy)] = Speculation(copy)
+        with self.lock:
+            self._expire()
+            current = self.sessions.get(sid)
+            self.sessions[sid] = (base, speculations)
+        if current is not None:
+            self._discard(current[1].values())
+        for speculation in speculations.values():
+            speculation.future = self.executor.submit(self._reply, speculation)
+        self._count("started", len(speculations))
+
+    def _reply(self, speculation: Speculation) -> bool:
+        """
+        Let the LLM play its move in the copy of the game; False if there was no free slot
+        or the speculation was cancelled meanwhile
+        """
+        if speculation.cancelled.is_set():
+            return False
+        game = speculation.game
+        llm = game.players[game.nim_game.player_to_move].llm
+        with admit_background(llm, headroom=self.headroom) as admitted:
+            if not admitted:
+                self._count("skipped")
+                return False
+            game.pick()
+        return True
+
+    def take(self, sid: str, game: Game) -> bool:
+        """
+        Apply the speculated reply to the move the human just played, and cancel the
+        replies to the other moves. Returns False (nothing applied) if there is none, or
+        if it failed; the move is then played as usual
+        """
+        with self.lock:
+            _, speculations = self.sessions.pop(sid, (None, {}))
+        speculation = speculations.pop(position(game), None)
+        self._discard(speculations.values())
+        if speculation is None:
+            self._count("miss")
+            return False
+
+        # Pas encore commencée (derrière les spéculations des autres sessions): on l'abandonne,
+        # le coup est joué normalement plutôt que d'attendre sa place dans le pool
+        if speculation.future.cancel():
+            self._count("miss")
+            return False
+        outcome = "hit" if speculation.future.done() else "waited"
+        try:
+            # La session est verrouillée pendant l'attente: elle reste courte
+            played = speculation.future.result(timeout=self.wait)
+        except Exception as e:
+            speculation.cancelled.set()
+            logging.error(f"Speculative reply failed or too slow: {e!r}")
+            played = False
+        if not played:
+            self._count("failed")
+            return False
+
+        reply = speculation.game
+        game.nim_game = reply.nim_game
+        game.usage = reply.usage
+        for color in (RED, BLUE):
+            game.players[color].load_thoughts(reply.players[color].to_dict())
+        self._count(outcome)
+        return True
+
+    def cancel(self, sid: str) -> None:
+        """
+        Drop the speculations of a session
+        """
+        with self.lock:
+            current = self.sessions.pop(sid, None)
+        if current is not None:
+            self._discard(current[1].values())
+
+    def _discard(self, speculations) -> None:
+        speculations = list(speculations)
+        for speculation in speculations:
+            speculation.cancelled.set()
+            if speculation.future is not None:
+                speculation.future.cancel()
+        if speculations:
+            self._count("wasted", len(speculations))
+
+    def _expire(self) -> None:
+        """
+        Drop the speculations of the sessions idle for longer than the TTL. The lock must be held.
+        """
+        deadline = time.monotonic() - self.ttl
+        for sid in [
+            sid for sid, (_, speculations) in self.sessions.items()
+            if all(speculation.created < deadline for speculation in speculations.values())
+        ]:
+            for speculation in self.sessions.pop(sid)[1].values():
+                speculation.cancelled.set()
+                if speculation.future is not None:
+                    speculation.future.cancel()
+
+    def stats(self) -> Dict:
+        """
+        Return the counts of speculations by outcome, for monitoring
+        """
+        with self.lock:
+            return {"enabled": True, "sessions": len(self.sessions), **self.counts}
+
+
+class NoSpeculator:
+    """
+    Stands in for the Speculator when SPECULATE=0 or the sessions are shared between
+    workers: nothing is computed ahead
+    """
+
+    def prepare(self, sid: str, game: Game) -> None:
+        pass
+
+    def take(self, sid: str, game: Game) -> bool:
+        return False
+
+    def cancel(self, sid: str) -> None:
+        pass
+
+    def stats(self) -> Dict:
+        return {"enabled": False}
+
+
+def create_speculator(store: SessionBackend):
+    """
+    Return the speculator selected by SPECULATE. With a store shared between workers the
+    human's move usually lands on another worker than the one that speculated, so nothing
+    is speculated
+    """
+    if not SPECULATE or store.shared_locks:
+        return NoSpeculator()
+    return Speculator()
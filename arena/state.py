@@ -0,0 +1,103 @@
+# Compact game state for clients that render the board themselves
+
+import threading
+import uuid
+import weakref
+from typing import Dict, Optional
+
+from arena.game import Game
+from arena.nim_game import BLUE, RED
+
+COLOR_NAMES = {RED: "red", BLUE: "blue"}
+
+PLAYER_FIELDS = ("model", "evaluation", "threats", "opportunities", "strategy", "move_remove")
+
+
+def compact_state(game: Game) -> Dict:
+    """
+    Return the raw state of a game: no HTML, the client derives the display from it
+    """
+    nim_game = game.nim_game
+    state = {
+        "variant": nim_game.variant,
+        "n": nim_game.n,
+        "n_start": game.n,
+        "history": list(nim_game.history),
+        "to_move": COLOR_NAMES[nim_game.player_to_move],
+        "winner": COLOR_NAMES.get(nim_game.winner),
+        "forfeited": nim_game.forfeited,
+        "valid_moves": nim_game.valid_moves() if nim_game.is_active() else [],
+    }
+    for color, name in COLOR_NAMES.items():
+        player = game.players[color]
+        state[name] = {field: getattr(player, field) for field in PLAYER_FIELDS}
+    return state
+
+
+class StateTracker:
+    """
+    Remembers the version at which each field of a game's state last changed, so a
+    client that sends the version it has receives only the fields changed since.
+    Versions are "<epoch>.<counter>"; the epoch changes with each tracker (a new process,
+    or a game loaded from a shared store), and a client from another epoch gets everything.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty tracker with a fresh epoch
+        """
+        self.epoch = uuid.uuid4().hex[:8]
+        self.counter = 0
+        self.values: Dict[str, object] = {}
+        self.changed_at: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def version(self) -> str:
+        return f"{self.epoch}.{self.counter}"
+
+    def update(self, state: Dict) -> None:
+        """
+        Record a new state, bumping the version if any field changed
+        """
+        with self.lock:
+            changed = [field for field, value in state.items() if self.values.get(field, self) != value]
+            if changed:
+                self.counter += 1
+                for field in changed:
+                    self.values[field] = state[field]
+                    self.changed_at[field] = self.counter
+
+    def delta(self, since: Optional[str]) -> Dict:
+        """
+        Return the fields changed after version `since`, or all of them ("full": true)
+        if the client has no version, or one this tracker doesn't know
+        """
+        with self.lock:
+            epoch, _, counter = (since or "").partition(".")
+            known = epoch == self.epoch and counter.isdigit() and int(counter) <= self.counter
+            payload = {"v": self.version(), "full": not known}
+            if known:
+                payload.update(
+                    (field, self.values[field])
+                    for field, at in self.changed_at.items()
+                    if at > int(counter)
+                )
+            else:
+                payload.update(self.values)
+            return payload
+
+
+_TRACKERS: "weakref.WeakKeyDictionary[Game, StateTracker]" = weakref.WeakKeyDictionary()
+_TRACKERS_LOCK = threading.Lock()
+
+
+def state_delta(game: Game, since: Optional[str] = None) -> Dict:
+    """
+    Return the compact state of a game as a delta against the client's version
+    """
+    with _TRACKERS_LOCK:
+        tracker = _TRACKERS.get(game)
+        if tracker is None:
+            tracker = _TRACKERS[game] = StateTracker()
+    tracker.update(compact_state(game))
+    return tracker.delta(since)
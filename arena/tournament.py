@@ -0,0 +1,480 @@
+# Headless tournaments: many games played concurrently, results recorded like UI games
+
+import argparse
+import itertools
+import logging
+import random
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, TextIO
+
+from arena.admission import AdmissionRejected, admit
+from arena.game import Game
+from arena.llm import LLM
+from arena.nim_game import BLUE, RED
+from arena.sessions import shared_llm
+from arena.writer import get_writer
+
+VARIANTS = ("normal", "a", "b")
+
+
+@dataclass(frozen=True)
+class Matchup:
+    """
+    One game to play: who plays red, who plays blue, and the variant. A game of a
+    resumable tournament also has its number and seed (see arena.checkpoint)
+    """
+
+    red: str
+    blue: str
+    variant: str = "normal"
+    seq: Optional[int] = field(default=None, compare=False)
+    seed: Optional[int] = field(default=None, compare=False)
+
+
+@dataclass
+class Outcome:
+    """
+    The result of a played matchup; winner is "red", "blue", or None if the game failed
+    """
+
+    matchup: Matchup
+    winner: Optional[str] = None
+    forfeited: bool = False
+    moves: int = 0
+    seconds: float = 0.0
+    error: str = ""
+
+    @property
+    def winner_model(self) -> Optional[str]:
+        if self.winner == "red":
+            return self.matchup.red
+        if self.winner == "blue":
+            return self.matchup.blue
+        return None
+
+
+def round_robin(models: List[str], variants: Iterable[str] = ("normal",), rounds: int = 1) -> List[Matchup]:
+    """
+    Every pair of models in every variant, once with each colour, repeated for each round.
+    Each round covers all the pairs before the next one starts, so a run stopped early
+    is still balanced
+    """
+    schedule = []
+    for _ in range(rounds):
+        for variant in variants:
+            for first, second in itertools.combinations(models, 2):
+                schedule.append(Matchup(first, second, variant))
+                schedule.append(Matchup(second, first, variant))
+    return schedule
+
+
+class TournamentStopped(Exception):
+    """
+    Raised in a worker when the tournament is stopped during a game
+    """
+
+
+@dataclass
+class Progress:
+    """
+    Counters of a running tournament, for the live report
+    """
+
+    total: Optional[int] = None
+    started: float = field(default_factory=time.monotonic)
+    done: int = 0
+    failed: int = 0
+    forfeits: int = 0
+    moves: int = 0
+
+    def line(self) -> str:
+        """
+        Return a one-line summary: games done, throughput and ETA
+        """
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        rate = self.done / elapsed
+        done = f"{self.done}/{self.total}" if self.total else str(self.done)
+        eta = "?"
+        if self.total and rate > 0:
+            remaining = int((self.total - self.done - self.failed) / rate)
+            eta = f"{remaining // 3600}h{remaining % 3600 // 60:02d}m{remaining % 60:02d}s"
+        return (
+            f"{done} games | {rate:.2f} games/s | {self.moves / elapsed:.1f} moves/s | ETA {eta}"
+            f" | forfeits {self.forfeits} | errors {self.failed}"
+        )
+
+
+class Tournament:
+    """
+    Plays matchups on a pool of worker threads. Every move goes through the admission
+    limits of arena.admission, and finished games are recorded through Game.record
+    """
+
+    def __init__(
+        self,
+        workers: int = 8,
+        record: bool = True,
+        llm_factory: Callable[[str], LLM] = shared_llm,
+        checkpoint=None,
+        budget=None,
+    ):
+        """
+        Initialize the tournament; llm_factory defaults to one LLM client per model, a
+        TournamentCheckpoint (if given) stores the progress of every game, and the games in
+        progress are counted against the Budget (if given) until they are recorded
+        """
+        self.workers = workers
+        self.record = record
+        self.llm_factory = llm_factory
+        self.checkpoint = checkpoint
+        self.budget = budget
+        self.stop_event = threading.Event()
+        self.progress = Progress()
+        self.lock = threading.Lock()
+
+    def stop(self) -> None:
+        """
+        Stop scheduling games; the games in progress are abandoned after their current move
+        """
+        self.stop_event.set()
+
+    def _pick(self, game: Game) -> None:
+        """
+        Play one move, waiting as long as needed for an admission slot
+        """
+        llm = game.players[game.nim_game.player_to_move].llm
+        while True:
+            if self.stop_event.is_set():
+                raise TournamentStopped()
+            try:
+                with admit(llm, timeout=1.0):
+                    game.pick()
+                return
+            except AdmissionRejected:
+                self.stop_event.wait(0.1)
+
+    def play(self, matchup: Matchup) -> Outcome:
+        """
+        Play one game to the end and record it
+        """
+        start = time.monotonic()
+        outcome = Outcome(matchup)
+        checkpoint = self.checkpoint if matchup.seq is not None else None
+        settled = False
+        try:
+            game = Game(matchup.red, matchup.blue, variant=matchup.variant, llm_factory=self.llm_factory)
+            while game.nim_game.is_active():
+                self._pick(game)
+                outcome.moves += 1
+                with self.lock:
+                    self.progress.moves += 1
+            recorded = not self.record or game.record(checkpoint.slot(matchup) if checkpoint else None)
+            # Enregistrée: ses coups comptent désormais, elle ne doit plus compter comme en cours
+            self._settle(matchup)
+            settled = True
+            if not recorded:
+                raise RuntimeError("The game could not be recorded")
+            outcome.winner = {RED: "red", BLUE: "blue"}.get(game.nim_game.winner)
+            outcome.forfeited = game.nim_game.forfeited
+        except TournamentStopped:
+            outcome.error = "stopped"
+            if checkpoint is not None:
+                checkpoint.release(matchup)
+        except Exception as e:
+            logging.error(f"Tournament game {matchup} failed")
+            logging.exception(e)
+            outcome.error = str(e) or type(e).__name__
+            if checkpoint is not None:
+                checkpoint.fail(matchup, outcome.error)
+        finally:
+            if not settled:
+                self._settle(matchup)
+        outcome.seconds = time.monotonic() - start
+        return outcome
+
+    def _settle(self, matchup: Matchup) -> None:
+        """
+        Stop counting the game of this matchup as in progress in the Budget
+        """
+        if self.budget is not None:
+            self.budget.settle((matchup.red, matchup.blue))
+
+    def _count(self, outcome: Outcome) -> None:
+        with self.lock:
+            if outcome.error == "stopped":
+                return
+            if outcome.winner is None:
+                self.progress.failed += 1
+            else:
+                self.progress.done += 1
+                self.progress.forfeits += outcome.forfeited
+
+    def run(
+        self,
+        matchups: Iterable[Matchup],
+        total: Optional[int] = None,
+        on_outcome: Optional[Callable[[Outcome], None]] = None,
+    ) -> List[Outcome]:
+        """
+        Play the matchups with at most `workers` games at once, and return their outcomes.
+        Matchups are drawn from the iterable only when a worker is free, so a scheduler
+        can choose the next games from the outcomes it received through on_outcome
+        """
+        self.progress = Progress(total=total if total is not None else _length(matchups))
+        outcomes = []
+        pending: Dict[Future, Matchup] = {}
+        source = iter(matchups)
+        exhausted = False
+        heartbeat = threading.Event()
+        if self.checkpoint is not None:
+            # Renouveler les baux des parties en cours, pour que les autres nœuds ne les reprennent pas
+            self.checkpoint.keep_alive(heartbeat)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tournament") as executor:
+                while True:
+                    try:
+                        while not exhausted and not self.stop_event.is_set() and len(pending) < self.workers:
+                            matchup = next(source, None)
+                            if matchup is None:
+                                exhausted = True
+                            else:
+                                if self.budget is not None:
+                                    self.budget.reserve((matchup.red, matchup.blue))
+                                pending[executor.submit(self.play, matchup)] = matchup
+                        if not pending:
+                            break
+                        done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                    except KeyboardInterrupt:
+                        # Ctrl-C: plus de nouvelles parties, celles en cours s'arrêtent après leur coup
+                        self.stop()
+                        continue
+                    for future in done:
+                        pending.pop(future)
+                        outcome = future.result()
+                        outcomes.append(outcome)
+                        self._count(outcome)
+                        if on_outcome is not None:
+                            on_outcome(outcome)
+        finally:
+            # Même sur une exception: sinon les baux des parties abandonnées seraient encore renouvelés
+            heartbeat.set()
+        if self.record:
+            # Les résultats sont écrits en arrière-plan: on attend qu'ils soient en base
+            get_writer().flush(timeout=30)
+        return outcomes
+
+
+def _length(matchups: Iterable[Matchup]) -> Optional[int]:
+    try:
+        return len(matchups)  # type: ignore[arg-type]
+    except TypeError:
+        return None
+
+
+def standings(outcomes: List[Outcome]) -> List[List]:
+    """
+    Return one row per model: games, wins, losses, forfeits and win rate, best first
+    """
+    rows: Dict[str, List] = {}
+    for outcome in outcomes:
+        winner = outcome.winner_model
+        if winner is None:
+            continue
+        for model, loser_forfeit in (
+            (outcome.matchup.red, outcome.forfeited and outcome.winner == "blue"),
+            (outcome.matchup.blue, outcome.forfeited and outcome.winner == "red"),
+        ):
+            row = rows.setdefault(model, [model, 0, 0, 0, 0])
+            row[1] += 1
+            row[2 if model == winner else 3] += 1
+            row[4] += loser_forfeit
+    table = [row + [row[2] / row[1]] for row in rows.values()]
+    table.sort(key=lambda row: row[5], reverse=True)
+    return table
+
+
+def report(tournament: Tournament, stream: TextIO, every: float, done: threading.Event) -> None:
+    """
+    Rewrite the progress line on the stream until done is set
+    """
+    while not done.wait(every):
+        stream.write("\r" + tournament.progress.line())
+        stream.flush()
+    stream.write("\r" + tournament.progress.line() + "\n")
+    stream.flush()
+
+
+def print_standings(outcomes: List[Outcome], stream: TextIO = sys.stdout) -> None:
+    stream.write(f"{'model':<32} {'games':>6} {'wins':>6} {'losses':>6} {'forfeits':>8} {'win %':>6}\n")
+    for model, games, wins, losses, forfeits, rate in standings(outcomes):
+        stream.write(f"{model:<32} {games:>6} {wins:>6} {losses:>6} {forfeits:>8} {rate * 100:>5.1f}%\n")
+
+
+def _models(names: Optional[List[str]]) -> List[str]:
+    """
+    Return the requested models, or every available model except the human player
+    """
+    available = [model for model in LLM.all_model_names() if model != "Humain"]
+    if not names:
+        return available
+    unknown = [name for name in names if name not in LLM.all_supported_model_names()]
+    if unknown:
+        raise SystemExit(f"Unknown models: {', '.join(unknown)}")
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play a round-robin tournament between LLMs without the UI")
+    parser.add_argument("--models", nargs="+", help="Models to pit against each other (default: all)")
+    parser.add_argument("--variants", nargs="+", default=["normal"], choices=VARIANTS)
+    parser.add_argument("--rounds", type=int, default=1, help="Times each pairing is played with each colour")
+    parser.add_argument(
+        "--schedule", default="round-robin", choices=["round-robin", "information", "swiss"],
+        help="round-robin, or adaptive pairings chosen from the ratings (see arena.pairing)",
+    )
+    parser.add_argument("--games", type=int, default=None, help="Game budget of an adaptive schedule")
+    parser.add_argument(
+        "--target-sd", type=float, default=None,
+        help="Stop an adaptive schedule once every rating's deviation is below this, in ELO points",
+    )
+    parser.add_argument("--workers", type=int, default=8, help="Games played at once")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the schedule (stored for resumes)")
+    parser.add_argument("--no-record", action="store_true", help="Don't store the results in the DB")
+    parser.add_argument("--report-every", type=float, default=1.0, help="Seconds between progress lines")
+    parser.add_argument("--resume", metavar="ID", help="Resume a stored tournament where it stopped")
+    parser.add_argument(
+        "--join", metavar="ID",
+        help="Work on a stored tournament alongside other processes or machines sharing the DB",
+    )
+    parser.add_argument("--list", action="store_true", help="List the stored tournaments and exit")
+    parser.add_argument(
+        "--budget", metavar="NAME=USD,...",
+        help="Spending limits per model or provider class (e.g. gpt-5=20,Claude=50); "
+        "no game of a model is started once its limit is spent",
+    )
+    parser.add_argument(
+        "--budget-since", metavar="DATE", default=None,
+        help="Count the spend of the games recorded since this date (default: start of the month)",
+    )
+    args = parser.parse_args()
+
+    from arena.checkpoint import TournamentCheckpoint, list_tournaments
+
+    if args.list:
+        for entry in list_tournaments():
+            config = entry["config"]
+            sys.stdout.write(
+                f"{entry['id']}  {entry['created'][:19]}  {entry['status']:<8} {entry['done']}/{entry['games']} games"
+                f"  {config['schedule']}  {' '.join(config['models'])}\n"
+            )
+        return
+
+    checkpoint = None
+    if args.resume or args.join:
+        # La configuration vient du tournoi enregistré; seuls --workers et --report-every changent
+        checkpoint = TournamentCheckpoint.load(args.resume or args.join)
+        config = checkpoint.config
+        seed = checkpoint.seed
+    else:
+        models = _models(args.models)
+        if len(models) < 2:
+            raise SystemExit("A tournament needs at least two models")
+        if args.schedule != "round-robin" and args.games is None and args.target_sd is None:
+            raise SystemExit("An adaptive schedule needs --games or --target-sd")
+        config = {
+            "models": models, "variants": args.variants, "schedule": args.schedule,
+            "rounds": args.rounds, "games": args.games, "target_sd": args.target_sd,
+        }
+        seed = args.seed if args.seed is not None else random.randrange(2**31)
+
+    scheduler = None
+    schedule: List[Matchup] = []
+    if config["schedule"] == "round-robin":
+        schedule = round_robin(config["models"], config["variants"], config["rounds"])
+        rng = random.Random(seed)
+        per_round = len(schedule) // max(config["rounds"], 1)
+        for start in range(0, len(schedule), per_round):
+            chunk = schedule[start:start + per_round]
+            rng.shuffle(chunk)
+            schedule[start:start + per_round] = chunk
+    adaptive = config["schedule"] != "round-robin"
+    if not args.no_record and checkpoint is None:
+        checkpoint = TournamentCheckpoint.create(config, schedule, seed, scheduling=adaptive)
+    if checkpoint is not None:
+        sys.stderr.write(f"Tournament {checkpoint.id} (resume with --resume {checkpoint.id}, add workers with --join {checkpoint.id})\n")
+
+    budget = None
+    if args.budget:
+        from datetime import datetime
+
+        from arena.costs import Budget, parse_budgets
+
+        if args.no_record:
+            raise SystemExit("A budget counts the recorded moves: it can't be used with --no-record")
+        since = datetime.fromisoformat(args.budget_since) if args.budget_since else None
+        budget = Budget(parse_budgets(args.budget), since=since)
+        if not budget.limits:
+            raise SystemExit(f"No budget found in: {args.budget}")
+
+    tournament = Tournament(workers=args.workers, record=not args.no_record, checkpoint=checkpoint, budget=budget)
+    if adaptive and not args.join:
+        from arena.pairing import AdaptiveScheduler
+
+        # Les parties terminées sont déjà en base, et donc dans l'historique du classement
+        stored = sum(checkpoint.counts().values()) if checkpoint is not None else 0
+        games = config["games"]
+        if games is not None:
+            games = max(games - stored, 0)
+        scheduler = AdaptiveScheduler(
+            config["models"], config["variants"], games=games, target_sd=config["target_sd"],
+            strategy=config["schedule"], seed=seed + stored,
+            exhausted=budget.exhausted_models if budget is not None else None,
+        )
+    total = config["games"] if adaptive else len(schedule)
+    if checkpoint is None:
+        matchups = scheduler if scheduler is not None else schedule
+        on_outcome = scheduler.observe if scheduler is not None else None
+    else:
+        # Chaque processus prend ses parties dans la file partagée; celui qui planifie
+        # l'alimente et voit les résultats de tous les nœuds
+        total = max((total or 0) - checkpoint.counts().get("done", 0), 0) or None
+        matchups = checkpoint.work(
+            producer=iter(scheduler) if scheduler is not None else None,
+            lookahead=2 * args.workers,
+            observe=scheduler.observe if scheduler is not None else None,
+            exhausted=budget.exhausted_models if budget is not None else None,
+        )
+        on_outcome = None
+    run = lambda: tournament.run(matchups, total=total, on_outcome=on_outcome)
+
+    done = threading.Event()
+    reporter = threading.Thread(target=report, args=(tournament, sys.stderr, args.report_every, done), daemon=True)
+    reporter.start()
+    try:
+        outcomes = run()
+    finally:
+        done.set()
+        reporter.join()
+    if checkpoint is not None:
+        checkpoint.finish()
+    if tournament.stop_event.is_set():
+        sys.stderr.write("Stopped early: the games in progress were not recorded\n")
+    print_standings(outcomes)
+    if scheduler is not None:
+        sys.stdout.write(f"\n{'model':<32} {'rating':>7} {'± sd':>6}\n")
+        for model, rating, deviation in scheduler.ratings():
+            sys.stdout.write(f"{model:<32} {rating:>7.0f} {deviation:>6.0f}\n")
+    if budget is not None:
+        sys.stdout.write(f"\nSpend since {budget.since:%Y-%m-%d %H:%M}\n")
+        spent = budget.spent()
+        for name, limit in budget.limits.items():
+            flag = "  (exhausted)" if spent[name] >= limit else ""
+            sys.stdout.write(f"{name:<32} {spent[name]:>9.4f} / {limit:.2f} USD{flag}\n")
+
+
+if __name__ == "__main__":
+    main()
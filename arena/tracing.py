@@ -0,0 +1,263 @@
+# Per-request tracing: where the time of a request went (prompt, LLM, parse, DB, rendering)
+
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Dict, Iterator, List, Optional
+
+# Fraction des requêtes tracées (0 = désactivé); un en-tête X-Trace: 1 force la trace
+TRACE_SAMPLE = float(os.getenv("TRACE_SAMPLE", 0))
+TRACE_KEEP = int(os.getenv("TRACE_KEEP", 200))  # traces gardées pour /api/traces
+TRACE_LOG = os.getenv("TRACE_LOG", "1") != "0"  # une ligne de log par trace
+# Export optionnel: un fichier JSON lines, ou un collecteur Zipkin (zipkin:http://localhost:9411/api/v2/spans)
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Span:
+    """
+    A timed phase of a request; start and duration are in seconds, start relative to the trace
+    """
+
+    id: str
+    name: str
+    parent: Optional[str]
+    start: float
+    duration: float = 0.0
+    attributes: Dict = field(default_factory=dict)
+
+
+class Trace:
+    """
+    The spans of one request. Spans can be added from other threads or tasks of the
+    request (the trace travels in a context variable, copied by asyncio.to_thread)
+    """
+
+    def __init__(self, name: str, attributes: Optional[Dict] = None):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = attributes or {}
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.duration = 0.0
+        self.spans: List[Span] = []
+
+    def breakdown(self) -> Dict[str, float]:
+        """
+        Return the total milliseconds spent in each kind of span
+        """
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration * 1000
+        return {name: round(total, 3) for name, total in sorted(totals.items(), key=lambda item: -item[1])}
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "attributes": self.attributes,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3),
+            "breakdown_ms": self.breakdown(),
+            "spans": [
+                {
+                    "id": span.id,
+                    "name": span.name,
+                    "parent": span.parent,
+                    "start_ms": round(span.start * 1000, 3),
+                    "duration_ms": round(span.duration * 1000, 3),
+                    "attributes": span.attributes,
+                }
+                for span in self.spans
+            ],
+        }
+
+    def to_zipkin(self) -> List[Dict]:
+        """
+        Return the trace in the Zipkin v2 JSON format, the request being the root span
+        """
+        start_us = int(self.started_at * 1e6)
+        local = {"serviceName": "nim-llm-game"}
+        root = {
+            "traceId": self.id, "id": self.id[:16], "name": self.name, "timestamp": start_us,
+            "duration": max(int(self.duration * 1e6), 1), "localEndpoint": local,
+            "tags": {key: str(value) for key, value in self.attributes.items()},
+        }
+        spans = [root]
+        for span in self.spans:
+            spans.append({
+                "traceId": self.id, "id": span.id, "parentId": span.parent or root["id"], "name": span.name,
+                "timestamp": start_us + int(span.start * 1e6), "duration": max(int(span.duration * 1e6), 1),
+                "localEndpoint": local, "tags": {key: str(value) for key, value in span.attributes.items()},
+            })
+        return spans
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_parent: ContextVar[Optional[str]] = ContextVar("trace_parent", default=None)
+
+_recent: deque = deque(maxlen=TRACE_KEEP)
+_exporter: Optional["Exporter"] = None
+_exporter_lock = threading.Lock()
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Time the block as a span of the current trace; does almost nothing outside a trace
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+    current = Span(uuid.uuid4().hex[:16], name, _parent.get(), time.perf_counter() - trace.origin, attributes=attributes)
+    token = _parent.set(current.id)
+    try:
+        yield current
+    finally:
+        _parent.reset(token)
+        current.duration = time.perf_counter() - trace.origin - current.start
+        trace.spans.append(current)
+
+
+def traced(name: str):
+    """
+    Decorate a function (sync or async) so that every call is a span of the current trace
+    """
+
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _trace.get() is None:
+                    return await func(*args, **kwargs)
+                with span(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _trace.get() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def sampled(forced: bool = False) -> bool:
+    return forced or (TRACE_SAMPLE > 0 and random.random() < TRACE_SAMPLE)
+
+
+def begin_trace(name: str, forced: bool = False, **attributes):
+    """
+    Start a trace for the current request if it is sampled; returns a token for end_trace
+    (None if the request is not traced)
+    """
+    if not sampled(forced):
+        return None
+    trace = Trace(name, attributes)
+    return trace, _trace.set(trace)
+
+
+def end_trace(token, name: Optional[str] = None, **attributes) -> Optional[Trace]:
+    """
+    Finish the trace started by begin_trace (renamed if name is given, e.g. once the route
+    is known): keep it for /api/traces, log and export it
+    """
+    if token is None:
+        return None
+    trace, context_token = token
+    _trace.reset(context_token)
+    if name:
+        trace.name = name
+    trace.duration = time.perf_counter() - trace.origin
+    trace.attributes.update(attributes)
+    _recent.append(trace)
+    if TRACE_LOG:
+        phases = ", ".join(f"{phase} {total:.1f}" for phase, total in trace.breakdown().items())
+        logger.info(f"trace {trace.id[:12]} {trace.name} {trace.duration * 1000:.1f} ms: {phases}")
+    if TRACE_EXPORT:
+        _get_exporter().submit(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+def recent_traces(limit: int = 50, min_ms: float = 0.0) -> List[Dict]:
+    """
+    Return the latest traces, newest first, optionally only those slower than min_ms
+    """
+    traces = [trace for trace in list(_recent) if trace.duration * 1000 >= min_ms]
+    return [trace.to_dict() for trace in reversed(traces[-limit:])]
+
+
+class Exporter:
+    """
+    Sends finished traces to TRACE_EXPORT from a background thread, so that a slow or
+    missing collector never delays a request; traces are dropped when the queue is full
+    """
+
+    def __init__(self, target: str, max_queue: int = 1000):
+        self.target = target
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        threading.Thread(target=self._loop, name="trace-exporter", daemon=True).start()
+
+    def submit(self, trace: Trace) -> None:
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _send(self, traces: List[Trace]) -> None:
+        if self.target.startswith("zipkin:"):
+            body = json.dumps([span for trace in traces for span in trace.to_zipkin()]).encode()
+            request = urllib.request.Request(
+                self.target[len("zipkin:"):], data=body, headers={"Content-Type": "application/json"}
+            )
+            urllib.request.urlopen(request, timeout=5).close()
+        else:
+            with open(self.target, "a", encoding="utf-8") as f:
+                for trace in traces:
+                    f.write(json.dumps(trace.to_dict()) + "\n")
+
+    def _loop(self) -> None:
+        while True:
+            traces = [self.queue.get()]
+            while len(traces) < 100:
+                try:
+                    traces.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._send(traces)
+            except Exception as e:
+                logger.error(f"Failed to export {len(traces)} traces to {self.target}: {e}")
+
+
+def _get_exporter() -> Exporter:
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = Exporter(TRACE_EXPORT)
+        return _exporter
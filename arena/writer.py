@@ -0,0 +1,192 @@
+# Background writer for game results
+
+import atexit
+import logging
+import os
+import queue
+import threading
+from typing import Dict, List, Optional
+
+from arena.record import Result, record_games
+
+# Taille maximale de la file et du lot, configurables par variables d'environnement
+WRITER_QUEUE_SIZE = int(os.getenv("WRITER_QUEUE_SIZE", 1000))
+WRITER_BATCH_SIZE = int(os.getenv("WRITER_BATCH_SIZE", 100))
+WRITER_FLUSH_INTERVAL = float(os.getenv("WRITER_FLUSH_INTERVAL", 0.5))
+
+_STOP = object()
+
+
+class GameWriter:
+    """
+    A write-behind queue: results are handed to a background thread that groups them
+    into batched transactions, so callers never wait on SQLite
+    """
+
+    def __init__(
+        self,
+        max_queue: int = WRITER_QUEUE_SIZE,
+        batch_size: int = WRITER_BATCH_SIZE,
+        flush_interval: float = WRITER_FLUSH_INTERVAL,
+    ):
+        """
+        Initialize the queue and counters; the thread is started by start()
+        """
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.overflow = 0
+        self.last_error = ""
+
+    def start(self) -> "GameWriter":
+        """
+        Start the background thread and make sure pending results are flushed on exit
+        """
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._loop, name="game-writer", daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+        return self
+
+    def submit(self, result: Result) -> bool:
+        """
+        Queue a result for writing. If the queue is full, write it synchronously instead
+        so that nothing is lost; returns False only if that synchronous write failed
+        """
+        if self.thread is None or not self.thread.is_alive():
+            return self._write([result])
+        try:
+            self.queue.put_nowait(result)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.overflow += 1
+            logging.warning("Game writer queue is full, recording synchronously")
+            return self._write([result])
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every queued result has been written (or the timeout expires)
+        """
+        if self.thread is None or not self.thread.is_alive():
+            return self.queue.empty()
+        done = threading.Event()
+
+        def wait():
+            self.queue.join()
+            done.set()
+
+        threading.Thread(target=wait, daemon=True).start()
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        Flush pending results and stop the background thread
+        """
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+    def stats(self) -> Dict:
+        """
+        Return the queue depth and write counters, for monitoring
+        """
+        with self.lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "written": self.written,
+                "failed": self.failed,
+                "batches": self.batches,
+                "overflow": self.overflow,
+                "last_error": self.last_error,
+                "running": self.thread is not None and self.thread.is_alive(),
+            }
+
+    def _write(self, batch: List[Result]) -> bool:
+        """
+        Write a batch in a single transaction and update the counters
+        """
+        ok = record_games(batch)
+        with self.lock:
+            if ok:
+                self.written += len(batch)
+                self.batches += 1
+            else:
+                self.failed += len(batch)
+                self.last_error = f"Failed to record a batch of {len(batch)} games"
+        if not ok:
+            logging.error(f"Game writer lost a batch of {len(batch)} games")
+        return ok
+
+    def _loop(self) -> None:
+        """
+        Wait for results, then drain whatever else is pending into the same batch
+        """
+        stopping = False
+        while not stopping:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            taken = 1
+            if item is _STOP:
+                stopping = True
+            else:
+                batch.append(item)
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                taken += 1
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            try:
+                if batch:
+                    self._write(batch)
+            except Exception as e:
+                logging.exception(e)
+                with self.lock:
+                    self.failed += len(batch)
+                    self.last_error = str(e)
+            finally:
+                for _ in range(taken):
+                    self.queue.task_done()
+
+
+_writer: Optional[GameWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> GameWriter:
+    """
+    Return the process-wide writer, starting it on first use
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = GameWriter().start()
+        return _writer
+
+
+def submit_game(result: Result) -> bool:
+    """
+    Queue a result on the process-wide writer
+    """
+    return get_writer().submit(result)
+
+
+def writer_stats() -> Dict:
+    """
+    Return the stats of the process-wide writer (empty if it was never started)
+    """
+    return _writer.stats() if _writer is not None else {}
@@ -0,0 +1,416 @@
+"""
+ASGI entry-point for the Nim LLM game.
+
+Same routes as app.py, but LLM calls are awaited instead of blocking a worker
+thread, so a single process can hold thousands of games waiting on a provider.
+Run with `python asgi.py` or `uvicorn asgi:app`.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+import uuid
+from contextlib import AsyncExitStack, asynccontextmanager
+from email.utils import format_datetime
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+
+import app as web
+from arena import metrics
+from arena.admission import AdmissionRejected, aadmit
+from arena.game import Game
+from arena.jobs import JobLimitError
+from arena.player import HumanTurnException
+from arena.record import RatingEngine
+from arena.sessions import SessionLockTimeout
+from arena.tracing import begin_trace, end_trace, span
+
+
+def _session_id(request: Request) -> str:
+    sid = request.session.get("sid")
+    if not sid:
+        sid = uuid.uuid4().hex
+        request.session["sid"] = sid
+    return sid
+
+
+@asynccontextmanager
+async def _session_game(request: Request, variant: str = "normal"):
+    # Comme dans app.py: la session est verrouillée pendant qu'on charge, modifie et
+    # enregistre sa partie; l'attente du verrou, la lecture et l'écriture (SQLite avec
+    # SESSION_BACKEND=sqlite) se font hors de la boucle
+    sid = _session_id(request)
+    async with web._GAMES.alock(sid):
+        with span("session.load"):
+            game = await asyncio.to_thread(web._GAMES.get, sid)
+        if not game:
+            game = web._create_game(None, None, variant)
+        try:
+            yield game
+        finally:
+            with span("session.save"):
+                await asyncio.to_thread(web._save_game, sid, game)
+
+
+async def _new_game(request: Request, red_model: str | None, blue_model: str | None, variant: str) -> Game:
+    sid = _session_id(request)
+    async with web._GAMES.alock(sid):
+        game = web._create_game(red_model, blue_model, variant)
+        await asyncio.to_thread(web._save_game, sid, game)
+    return game
+
+
+class _LockedStream(StreamingResponse):
+    """
+    A streaming response that releases the session once sent, even if the client
+    disconnected before the stream started
+    """
+
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.release()
+
+
+async def session_busy(request: Request, exc: SessionLockTimeout):
+    return JSONResponse({"error": str(exc)}, status_code=409)
+
+
+async def llm_busy(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        {"error": str(exc), "retry_after": exc.retry_after},
+        status_code=exc.status,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+async def _apick(game: Game) -> None:
+    # Comme web._pick: on attend une place libre pour le modèle sans bloquer la boucle
+    async with aadmit(game.players[game.nim_game.player_to_move].llm):
+        await game.apick()
+
+
+class _RequestMetrics:
+    """
+    ASGI middleware recording the latency of every HTTP request under its route pattern,
+    and tracing the sampled requests (see arena/tracing.py)
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+        forced = (b"x-trace", b"1") in scope.get("headers", [])
+        trace = begin_trace(f"{scope['method']} {scope['path']}", forced=forced)
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trace is not None:
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", trace[0].id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            # Le routeur de Starlette indique la route trouvée dans le scope
+            route = scope.get("route")
+            path = getattr(route, "path", None)
+            if isinstance(route, Mount):
+                path += "/{path}"
+            metrics.observe_request(scope["method"], path, status, time.perf_counter() - start)
+            end_trace(trace, name=f"{scope['method']} {path or scope['path']}", status=status)
+
+
+async def _json_body(request: Request) -> dict:
+    try:
+        payload = await request.json()
+    except ValueError:
+        return {}
+    return payload if isinstance(payload, dict) else {}
+
+
+async def index(request: Request):
+    # Le gabarit utilise url_for de Flask: on le rend dans un contexte Flask
+    with web.app.test_request_context():
+        return HTMLResponse(web.index())
+
+
+async def api_init(request: Request):
+    payload = await _json_body(request)
+    game = await _new_game(
+        request, payload.get("red_model"), payload.get("blue_model"), payload.get("variant", "normal")
+    )
+    return JSONResponse(web._state_reply(game, request.query_params))
+
+
+async def api_move(request: Request):
+    async with _session_game(request) as game:
+        try:
+            if game.nim_game.is_active():
+                await _apick(game)
+            if not game.nim_game.is_active():
+                game.record()
+        except HumanTurnException:
+            pass
+    return JSONResponse(web._state_reply(game, request.query_params))
+
+
+async def api_run(request: Request):
+    stopped_for_human = False
+    async with _session_game(request) as game:
+        game.reset()
+        while game.nim_game.is_active():
+            try:
+                await _apick(game)
+            except HumanTurnException:
+                stopped_for_human = True
+                break
+
+        if not game.nim_game.is_active():
+            game.record()
+    return JSONResponse(web._state_reply(game, request.query_params, stopped_for_human=stopped_for_human))
+
+
+async def api_run_stream(request: Request):
+    sid = _session_id(request)
+    args = dict(request.query_params)
+    # La session reste verrouillée pendant toute la partie, jusqu'à la fin de la réponse
+    session_game = AsyncExitStack()
+    game = await session_game.enter_async_context(_session_game(request))
+    if args.get("reset") or not game.nim_game.is_active():
+        game.reset()
+    picks = []
+
+    async def events():
+        payload = web._state_reply(game, args)
+        yield web._sse("state", payload)
+        pick = None
+        try:
+            while game.nim_game.is_active():
+                pick = asyncio.ensure_future(_apick(game))
+                picks.append(pick)
+                while not pick.done():
+                    await asyncio.wait({pick}, timeout=web.SSE_HEARTBEAT)
+                    if not pick.done():
+                        yield ": heartbeat\n\n"
+                pick.result()
+                if not game.nim_game.is_active():
+                    game.record()
+                await asyncio.to_thread(web._GAMES.set, sid, game)
+                payload = web._state_reply(game, args, since=payload.get("v"))
+                yield web._sse("state", payload)
+        except HumanTurnException:
+            payload = web._state_reply(game, args, since=payload.get("v"), stopped_for_human=True)
+            yield web._sse("state", payload)
+        except AdmissionRejected as e:
+            yield web._sse("busy", {"error": str(e), "retry_after": e.retry_after})
+        finally:
+            # Client déconnecté: on annule l'appel au LLM en cours
+            if pick is not None and not pick.done():
+                pick.cancel()
+        yield web._sse("done", {"game_over": not game.nim_game.is_active()})
+
+    async def release():
+        # Annuler l'appel au LLM en cours avant de rendre la partie aux autres requêtes
+        for pick in picks:
+            pick.cancel()
+        await asyncio.gather(*picks, return_exceptions=True)
+        # Un coup terminé avant l'annulation a pu finir la partie
+        if not game.nim_game.is_active():
+            game.record()
+        await session_game.aclose()
+
+    return _LockedStream(
+        events(),
+        release,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def api_job_start(request: Request):
+    payload = await _json_body(request)
+    async with _session_game(request) as game:
+        if payload.get("reset") or not game.nim_game.is_active():
+            game.reset()
+    try:
+        client = request.client.host if request.client else _session_id(request)
+        job = await asyncio.to_thread(web._JOBS.submit, client, _session_id(request))
+    except JobLimitError as e:
+        return JSONResponse({"error": str(e)}, status_code=429)
+    return JSONResponse(job.to_dict(), status_code=202)
+
+
+async def api_job(request: Request):
+    job = web._JOBS.get(request.path_params["job_id"], _session_id(request))
+    if job is None:
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+    after = request.query_params.get("after")
+    if after is not None and after.lstrip("-").isdigit():
+        try:
+            timeout = float(request.query_params.get("timeout", 25))
+        except ValueError:
+            timeout = 25.0
+        timeout = min(max(timeout, 0.0), 60.0)
+        await web._JOBS.await_change(job, int(after), timeout)
+    return JSONResponse(job.to_dict())
+
+
+async def api_job_cancel(request: Request):
+    job = web._JOBS.cancel(request.path_params["job_id"], _session_id(request))
+    if job is None:
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+    return JSONResponse(job.to_dict())
+
+
+async def api_job_events(request: Request):
+    job = web._JOBS.get(request.path_params["job_id"], _session_id(request))
+    if job is None:
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+
+    async def events():
+        version = -1
+        while True:
+            if not await web._JOBS.await_change(job, version, web.SSE_HEARTBEAT):
+                yield ": heartbeat\n\n"
+                continue
+            payload = job.to_dict()
+            version = payload["version"]
+            yield web._sse("state", payload["state"])
+            if not job.is_active():
+                yield web._sse("done", payload)
+                return
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def api_state(request: Request):
+    game = await asyncio.to_thread(web._GAMES.get, _session_id(request))
+    if not game:
+        async with _session_game(request) as game:
+            pass
+    return JSONResponse(web._state_reply(game, request.query_params))
+
+
+async def api_human_move(request: Request):
+    payload = await _json_body(request)
+    async with _session_game(request) as game:
+        if web._apply_human_move(game, int(payload.get("move", 0))):
+            # Attendre une réponse encore en cours se fait hors de la boucle
+            await asyncio.to_thread(web._speculated_reply, _session_id(request), game)
+    return JSONResponse(web._state_reply(game, request.query_params))
+
+
+async def api_reset(request: Request):
+    return await api_init(request)
+
+
+async def api_model(request: Request):
+    payload = await _json_body(request)
+    async with _session_game(request) as game:
+        # Le changement de modèle crée un client SDK: on le fait hors de la boucle
+        await asyncio.to_thread(web._apply_model, game, payload.get("player"), payload.get("model"))
+    return JSONResponse(web._state_reply(game, request.query_params))
+
+
+async def api_variant(request: Request):
+    payload = await _json_body(request)
+    variant = payload.get("variant", "normal")
+    async with _session_game(request, variant) as game:
+        web._apply_variant(game, variant)
+    return JSONResponse(web._state_reply(game, request.query_params))
+
+
+async def api_leaderboard(request: Request):
+    engine_name = request.query_params.get("engine", "elo")
+    if engine_name not in RatingEngine.engine_map():
+        engine_name = "elo"
+    entry = await asyncio.to_thread(web._cached_leaderboard, engine_name)
+
+    etag = f'"{entry["etag"]}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": format_datetime(entry["last_modified"], usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(entry["body"], media_type="application/json", headers=headers)
+
+
+async def api_rating_history(request: Request):
+    payload = await asyncio.to_thread(web._rating_history_payload, request.query_params)
+    return JSONResponse(payload)
+
+
+async def api_status(request: Request):
+    return JSONResponse(web._status_payload())
+
+
+async def api_traces(request: Request):
+    return JSONResponse(web._traces_payload(request.query_params))
+
+
+async def api_metrics(request: Request):
+    return Response(metrics.render_metrics(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+app = Starlette(
+    routes=[
+        Route("/", index),
+        Route("/api/init", api_init, methods=["POST"]),
+        Route("/api/move", api_move, methods=["POST"]),
+        Route("/api/run", api_run, methods=["POST"]),
+        Route("/api/run/stream", api_run_stream, methods=["GET"]),
+        Route("/api/jobs", api_job_start, methods=["POST"]),
+        Route("/api/jobs/{job_id}", api_job, methods=["GET"]),
+        Route("/api/jobs/{job_id}", api_job_cancel, methods=["DELETE"]),
+        Route("/api/jobs/{job_id}/events", api_job_events, methods=["GET"]),
+        Route("/api/state", api_state, methods=["GET"]),
+        Route("/api/human-move", api_human_move, methods=["POST"]),
+        Route("/api/reset", api_reset, methods=["POST"]),
+        Route("/api/model", api_model, methods=["POST"]),
+        Route("/api/variant", api_variant, methods=["POST"]),
+        Route("/api/leaderboard", api_leaderboard, methods=["GET"]),
+        Route("/api/ratings/history", api_rating_history, methods=["GET"]),
+        Route("/api/status", api_status, methods=["GET"]),
+        Route("/api/traces", api_traces, methods=["GET"]),
+        Route("/metrics", api_metrics, methods=["GET"]),
+        Mount("/static", StaticFiles(directory="static"), name="static"),
+    ],
+    middleware=[
+        Middleware(_RequestMetrics),
+        Middleware(SessionMiddleware, secret_key=web.app.secret_key),
+    ],
+    exception_handlers={SessionLockTimeout: session_busy, AdmissionRejected: llm_busy},
+)
+
+
+if __name__ == "__main__":
+    port = int(os.getenv("PORT", 7860))
+    server_name = os.getenv("SERVER_NAME", "127.0.0.1")
+    uvicorn.run(app, host=server_name, port=port)
@@ -0,0 +1,84 @@
+"""
+Benchmark the matchstick board rendering: time and HTML size per pile size, for the
+previous implementation (SVG read and inlined for every stick) and the current one
+(shared <symbol>, memoized), cold and cached.
+
+    python benchmarks/matchstick_render.py --sizes 21 100 1000 5000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # le chemin du SVG est relatif à la racine du dépôt
+
+from arena.matchstick_view import MATCHSTICKS_SVG_PATH, display_matchsticks, load_svg, matchstick_defs
+
+
+def inline_matchsticks(n=5, height=80):
+    """
+    The previous rendering: read the SVG from disk and inline it once per stick
+    """
+    match_svg_inline = load_svg(MATCHSTICKS_SVG_PATH)
+    lines = [n] if n <= 10 else [10, n - 10]
+    html = "<div style='display: flex; flex-direction: column; gap: 10px;'>"
+    for line_count in lines:
+        html += "<div style='display: flex; align-items: center;'>"
+        for i in range(line_count):
+            gap = height / 7 if (i + 1) % 5 == 0 else 0
+            html += f"""
+            <div style="
+                height: {height}px;
+                margin-right: {gap}px;
+                display: flex;
+                align-items: center;
+            ">
+                <div style="height: 100%; width: auto;">
+                    {match_svg_inline}
+                </div>
+            </div>
+            """
+        html += "</div>"
+    html += "</div>"
+    return html
+
+
+def cold_render(n):
+    """
+    Render with empty caches, as on the first request of a process
+    """
+    matchstick_defs.cache_clear()
+    display_matchsticks.cache_clear()
+    return display_matchsticks(n)
+
+
+def measure(func, n, number):
+    """
+    Return the mean time of one call in microseconds
+    """
+    return timeit.timeit(lambda: func(n), number=number) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[21, 100, 1000, 5000])
+    parser.add_argument("--number", type=int, default=50, help="Calls per measurement")
+    args = parser.parse_args()
+
+    print(f"{'n':>6} | {'inline µs':>11} | {'inline bytes':>12} | {'cold µs':>9} | {'cached µs':>9} | {'bytes':>8}")
+    for n in args.sizes:
+        number = max(1, args.number * 21 // max(n, 21))
+        inline_time = measure(inline_matchsticks, n, number)
+        cold_time = measure(cold_render, n, number)
+        display_matchsticks(n)
+        cached_time = measure(display_matchsticks, n, args.number * 100)
+        print(
+            f"{n:>6} | {inline_time:11.1f} | {len(inline_matchsticks(n)):12,} | {cold_time:9.1f}"
+            f" | {cached_time:9.3f} | {len(display_matchsticks(n)):8,}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+Benchmark suite for the hot paths: the game engine, ELO replay, SQLite storage, board
+rendering, the state payload and /api/leaderboard against a seeded DB.
+
+Every case is timed with timeit (the number of calls per sample is calibrated, then
+--repeat samples are taken) and the results are written as JSON with the commit they
+were measured on, so that two runs can be compared:
+
+    python benchmarks/suite.py --output baseline.json
+    python benchmarks/suite.py --output after.json --compare baseline.json
+    python benchmarks/suite.py --filter elo --full      # ELO replay up to 10^6 games
+
+The storage cases use a temporary DB (DB_FILE), never nim_games.db.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # le chemin du SVG est relatif à la racine du dépôt
+
+# La base temporaire doit être choisie avant le premier import d'arena.record
+WORKDIR = tempfile.mkdtemp(prefix="nim-bench-")
+os.environ["DB_FILE"] = os.path.join(WORKDIR, "games.db")
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+from arena import record  # noqa: E402
+from arena.llm import LLM  # noqa: E402
+from arena.matchstick_view import display_matchsticks, matchstick_defs  # noqa: E402
+from arena.nim_game import NimGame  # noqa: E402
+from arena.record import Move, Result  # noqa: E402
+
+SEED = 1234
+
+# name -> (function(param) returning the callable to time, params, unit of one call)
+BENCHMARKS: Dict[str, tuple] = {}
+
+
+def benchmark(name: str, params=(None,), full_params=(), unit: str = "call"):
+    """
+    Register a benchmark: the decorated function does the setup for one parameter and
+    returns the callable to time. full_params are only run with --full
+    """
+
+    def register(setup):
+        BENCHMARKS[name] = (setup, tuple(params), tuple(full_params), unit)
+        return setup
+
+    return register
+
+
+def _models() -> List[str]:
+    return [model for model in LLM.all_supported_model_names() if model != "Humain"][:8]
+
+
+def synthetic_results(count: int, seed: int = SEED, with_moves: bool = False) -> List[Result]:
+    """
+    Return reproducible game results between the supported models, one minute apart
+    """
+    rng = random.Random(seed)
+    models = _models()
+    strength = {model: rng.gauss(0, 1) for model in models}
+    start = datetime(2025, 1, 1)
+    results = []
+    for i in range(count):
+        red, blue = rng.sample(models, 2)
+        red_won = rng.random() < 1 / (1 + 10 ** (strength[blue] - strength[red]))
+        moves = []
+        if with_moves:
+            sticks = 21
+            ply = 0
+            while sticks > 0:
+                taken = min(rng.choice((1, 2)), sticks)
+                color = "red" if ply % 2 == 0 else "blue"
+                moves.append(Move(ply, color, red if color == "red" else blue, sticks, taken, 430, 30, 0.0001))
+                sticks -= taken
+                ply += 1
+        results.append(Result(red, blue, rng.choice(("normal", "a", "b")), red_won, not red_won,
+                              start + timedelta(minutes=i), moves))
+    return results
+
+
+def fresh_db(name: str) -> None:
+    """
+    Point arena.record at a new, empty DB file
+    """
+    record.DB_FILE = os.path.join(WORKDIR, f"{name}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(record.DB_FILE + suffix):
+            os.remove(record.DB_FILE + suffix)
+
+
+def seeded_db(count: int) -> None:
+    """
+    Point arena.record at a DB holding `count` games (created once per size)
+    """
+    path = os.path.join(WORKDIR, f"seeded-{count}.db")
+    record.DB_FILE = path
+    if not os.path.exists(path):
+        results = synthetic_results(count)
+        for start in range(0, count, 10_000):
+            record.record_games(results[start:start + 10_000])
+
+
+# Moteur de jeu
+
+@benchmark("engine.random_game", params=("normal", "a", "b"), unit="game")
+def bench_random_game(variant):
+    rng = random.Random(SEED)
+
+    def play():
+        game = NimGame(variant=variant)
+        while game.is_active():
+            game.pick(rng.choice(game.valid_moves()))
+
+    return play
+
+
+@benchmark("engine.valid_moves", params=("normal", "a", "b"))
+def bench_valid_moves(variant):
+    game = NimGame(variant=variant)
+    game.pick(1)
+    return game.valid_moves
+
+
+# Classement
+
+@benchmark("elo.replay", params=(1_000, 10_000, 100_000), full_params=(1_000_000,), unit="replay")
+def bench_elo_replay(count):
+    results = synthetic_results(count)
+    return lambda: record.calculate_elo_ratings(results)
+
+
+# Stockage
+
+@benchmark("storage.record_game", unit="game")
+def bench_record_game(_):
+    fresh_db("record-one")
+    results = synthetic_results(200, with_moves=True)
+    it = iter(results * 10_000)
+    return lambda: record.record_game(next(it))
+
+
+@benchmark("storage.record_games_batch100", unit="batch of 100")
+def bench_record_games(_):
+    fresh_db("record-batch")
+    results = synthetic_results(100, with_moves=True)
+    return lambda: record.record_games(results)
+
+
+@benchmark("storage.get_games", params=(1_000, 10_000, 100_000), unit="read")
+def bench_get_games(count):
+    seeded_db(count)
+    return record.get_games
+
+
+# Rendu
+
+@benchmark("render.display_matchsticks_cold", params=(21, 100))
+def bench_render_cold(n):
+    def render():
+        matchstick_defs.cache_clear()
+        display_matchsticks.cache_clear()
+        display_matchsticks(n)
+
+    return render
+
+
+@benchmark("render.display_matchsticks_cached", params=(21, 100))
+def bench_render_cached(n):
+    display_matchsticks(n)
+    return lambda: display_matchsticks(n)
+
+
+# Serveur HTTP
+
+def _app():
+    import app
+
+    return app
+
+
+@benchmark("http.state_payload", params=("start", "midgame", "over"))
+def bench_state_payload(stage):
+    web = _app()
+    game = web.Game("Humain", "Humain", variant="normal")
+    plies = {"start": 0, "midgame": 10, "over": 21}[stage]
+    for _ in range(plies):
+        if not game.nim_game.is_active():
+            break
+        game.nim_game.pick(1)
+    return lambda: web._state_payload(game)
+
+
+@benchmark("http.leaderboard_cold", params=(1_000, 10_000), unit="request")
+def bench_leaderboard_cold(count):
+    web = _app()
+    seeded_db(count)
+    client = web.app.test_client()
+
+    def request():
+        web._invalidate_leaderboard()
+        response = client.get("/api/leaderboard")
+        assert response.status_code == 200, response.status_code
+
+    return request
+
+
+@benchmark("http.leaderboard_cached", params=(1_000, 10_000), unit="request")
+def bench_leaderboard_cached(count):
+    web = _app()
+    seeded_db(count)
+    web._invalidate_leaderboard()
+    client = web.app.test_client()
+    client.get("/api/leaderboard")
+    return lambda: client.get("/api/leaderboard")
+
+
+def measure(func: Callable[[], object], repeat: int, min_time: float) -> Dict:
+    """
+    Calibrate the number of calls per sample to last at least min_time, then time
+    `repeat` samples; returns seconds per call
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.2))
+    samples = [elapsed / number] + [timer.timeit(number) / number for _ in range(repeat - 1)]
+    return {
+        "number": number,
+        "repeat": repeat,
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def git_info() -> Dict:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, timeout=10).stdout.strip()
+        except Exception:
+            return ""
+
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def fmt_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("µs", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds / 1e-9:.3g} ns"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=None, help="JSON file for the results (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier results to compare against")
+    parser.add_argument("--filter", nargs="+", default=None, help="Only run the benchmarks whose name contains one of these")
+    parser.add_argument("--full", action="store_true", help="Also run the largest sizes (ELO replay of 10^6 games)")
+    parser.add_argument("--repeat", type=int, default=5, help="Samples per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per sample")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks and exit")
+    args = parser.parse_args()
+
+    cases = []
+    for name, (setup, params, full_params, unit) in BENCHMARKS.items():
+        if args.filter and not any(word in name for word in args.filter):
+            continue
+        for param in params + (full_params if args.full else ()):
+            cases.append((name, setup, param, unit))
+    if args.list:
+        for name, _, param, unit in cases:
+            print(f"{name}[{param}]" if param is not None else name)
+        return
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    info = git_info()
+    report = {
+        **info,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": {},
+    }
+    print(f"{'benchmark':<48} {'median':>10} {'± stdev':>10} {'units/s':>12}" + (f" {'vs base':>8}" if baseline else ""))
+    for name, setup, param, unit in cases:
+        key = f"{name}[{param}]" if param is not None else name
+        started = time.perf_counter()
+        func = setup(param)
+        setup_seconds = time.perf_counter() - started
+        result = measure(func, args.repeat, args.min_time)
+        result.update(unit=unit, setup_seconds=setup_seconds)
+        report["results"][key] = result
+        line = (
+            f"{key:<48} {fmt_time(result['median']):>10} {fmt_time(result['stdev']):>10}"
+            f" {1 / result['median']:>12.4g}"
+        )
+        if baseline:
+            before = baseline.get(key)
+            line += f" {result['median'] / before['median']:>7.2f}x" if before else f" {'new':>8}"
+        print(line, flush=True)
+
+    output = args.output
+    if output is None:
+        os.makedirs(os.path.join(ROOT, "benchmarks", "results"), exist_ok=True)
+        output = os.path.join(ROOT, "benchmarks", "results", f"{(info['commit'] or 'unknown')[:12]}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}" + (" (uncommitted changes)" if info["dirty"] else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Compare concurrency versus memory of the threaded Flask server (app.py) and the
+ASGI server (asgi.py).
+
+Each server is started with stub LLMs that answer after a fixed delay. For every
+concurrency level, that many browser sessions call /api/init and then /api/move
+at the same time, so every request spends its time waiting on the "provider".
+The peak RSS and thread count of the server process are sampled from /proc (Linux).
+
+    python loadtest/async_vs_threaded.py --levels 50 200 1000 --latency 2
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    "threaded": [sys.executable, "app.py"],
+    "async": [sys.executable, "asgi.py"],
+}
+
+
+def proc_status(pid: int) -> dict:
+    """
+    Return the resident memory (MB) and thread count of a process
+    """
+    values = {}
+    with open(f"/proc/{pid}/status", "r", encoding="utf-8") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            values[key] = value.strip()
+    return {
+        "rss_mb": int(values["VmRSS"].split()[0]) / 1024,
+        "threads": int(values["Threads"]),
+    }
+
+
+async def session(client: httpx.AsyncClient) -> bool:
+    """
+    One browser session: create a stub-vs-stub game, then ask for one move.
+    The client is shared (creating one per session costs more than the request),
+    so the session cookie is passed explicitly.
+    """
+    init = await client.post("/api/init", json={"red_model": "stub", "blue_model": "stub"})
+    cookie = "; ".join(f"{name}={value}" for name, value in init.cookies.items())
+    move = await client.post("/api/move", headers={"Cookie": cookie})
+    return init.status_code == 200 and move.status_code == 200
+
+
+async def run_level(base_url: str, pid: int, concurrency: int, timeout: float) -> dict:
+    """
+    Run `concurrency` sessions at once while sampling the server's memory
+    """
+    peak = proc_status(pid)
+    done = asyncio.Event()
+
+    async def sample():
+        while not done.is_set():
+            status = proc_status(pid)
+            peak["rss_mb"] = max(peak["rss_mb"], status["rss_mb"])
+            peak["threads"] = max(peak["threads"], status["threads"])
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.create_task(sample())
+    # Without keep-alive, the pool does not rescan hundreds of idle connections per request
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=0)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(session(client) for _ in range(concurrency)), return_exceptions=True
+        )
+        elapsed = time.perf_counter() - start
+    done.set()
+    await sampler
+    ok = sum(1 for result in results if result is True)
+    return {
+        "concurrency": concurrency,
+        "ok": ok,
+        "errors": concurrency - ok,
+        "seconds": elapsed,
+        "peak_rss_mb": peak["rss_mb"],
+        "peak_threads": peak["threads"],
+    }
+
+
+def wait_until_up(base_url: str, deadline: float = 30) -> None:
+    """
+    Poll the server until it answers
+    """
+    end = time.monotonic() + deadline
+    while time.monotonic() < end:
+        try:
+            httpx.get(base_url + "/api/status", timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--latency", type=float, default=2.0, help="Stub LLM latency in seconds")
+    parser.add_argument("--servers", nargs="+", default=list(SERVERS), choices=list(SERVERS))
+    parser.add_argument("--port", type=int, default=7870)
+    args = parser.parse_args()
+
+    env = dict(
+        os.environ,
+        ENABLE_STUB_LLM="1",
+        STUB_LLM_LATENCY=str(args.latency),
+        PORT=str(args.port),
+        SESSION_MAX_ENTRIES=str(max(args.levels) * 2),
+        DB_FILE=os.path.join(tempfile.gettempdir(), "nim_loadtest.db"),
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    for name in args.servers:
+        server = subprocess.Popen(
+            SERVERS[name], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_until_up(base_url)
+            idle = proc_status(server.pid)
+            for level in args.levels:
+                result = asyncio.run(run_level(base_url, server.pid, level, timeout=args.latency * 10 + 30))
+                print(
+                    f"{name:>8} | {level:>5} sessions | {result['ok']:>5} ok | {result['errors']:>4} errors"
+                    f" | {result['seconds']:6.2f}s | peak RSS {result['peak_rss_mb']:7.1f} MB"
+                    f" (idle {idle['rss_mb']:.1f}) | peak threads {result['peak_threads']}"
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
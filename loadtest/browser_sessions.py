@@ -0,0 +1,279 @@
+"""
+End-to-end load test of the web app with stub LLMs, for sizing instances and catching
+regressions.
+
+Virtual users run browser journeys for --duration seconds: each journey opens a new
+cookie session (/api/init), asks for one move (/api/move), plays the game to the end
+(/api/run) and opens the leaderboard (/api/leaderboard), with --think seconds between
+clicks. The server is started with stub LLMs answering after --latency seconds, or an
+already running server is targeted with --url.
+
+Reported: journeys and requests per second, p50/p95/p99 latency and error rate per
+route, and the server's memory and session count over time with the memory growth per
+minute (an unbounded session store shows up as a steady slope).
+
+    python loadtest/browser_sessions.py --users 50 --duration 60 --latency 0.2
+    python loadtest/browser_sessions.py --server async --users 200 --output run.json
+    python loadtest/browser_sessions.py --url http://127.0.0.1:7860 --pid 12345
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Dict, List, Optional
+
+import httpx
+
+from async_vs_threaded import SERVERS, proc_status, wait_until_up
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROUTES = ("init", "move", "run", "leaderboard")
+VARIANTS = ("normal", "a", "b")
+
+
+class Stats:
+    """
+    Latencies and status codes per route, and the journeys completed
+    """
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.journeys = 0
+        self.failed_journeys = 0
+
+    def add(self, route: str, seconds: float, status: str) -> None:
+        self.latencies[route].append(seconds)
+        self.statuses[route][status] += 1
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Return the q-th percentile (nearest rank) of the values
+    """
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(int(round(q / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+async def request(client: httpx.AsyncClient, stats: Stats, route: str, method: str, url: str, **kwargs):
+    """
+    Send one request and record its latency; 429/503 from admission control count as
+    rejected, other non-2xx and exceptions as errors
+    """
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+    except httpx.HTTPError as e:
+        stats.add(route, time.perf_counter() - start, type(e).__name__)
+        return None
+    status = response.status_code
+    label = "ok" if status < 400 else "rejected" if status in (429, 503) else str(status)
+    stats.add(route, time.perf_counter() - start, label)
+    return response if status < 400 else None
+
+
+async def journey(client: httpx.AsyncClient, stats: Stats, models: List[str], think: float) -> bool:
+    """
+    One browser session: init, one move, run to the end, leaderboard
+    """
+    red, blue = random.choice(models), random.choice(models)
+    init = await request(
+        client, stats, "init", "POST", "/api/init",
+        json={"red_model": red, "blue_model": blue, "variant": random.choice(VARIANTS)},
+    )
+    if init is None:
+        return False
+    cookie = "; ".join(f"{name}={value}" for name, value in init.cookies.items())
+    headers = {"Cookie": cookie}
+    ok = True
+    for route, method, url in (
+        ("move", "POST", "/api/move"),
+        ("run", "POST", "/api/run"),
+        ("leaderboard", "GET", "/api/leaderboard"),
+    ):
+        await asyncio.sleep(think * random.uniform(0.5, 1.5))
+        ok = await request(client, stats, route, method, url, headers=headers) is not None and ok
+    return ok
+
+
+async def user(client: httpx.AsyncClient, stats: Stats, models: List[str], think: float, delay: float, end: float):
+    """
+    A virtual user: journeys back to back until the end of the test
+    """
+    await asyncio.sleep(delay)
+    while time.monotonic() < end:
+        if await journey(client, stats, models, think):
+            stats.journeys += 1
+        else:
+            stats.failed_journeys += 1
+
+
+async def sampler(client: httpx.AsyncClient, pid: Optional[int], every: float, started: float, timeline: List[Dict]):
+    """
+    Sample the server's memory, threads and session count until cancelled
+    """
+    while True:
+        point = {"t": round(time.monotonic() - started, 1)}
+        if pid is not None:
+            try:
+                point.update(proc_status(pid))
+            except OSError:
+                pass
+        try:
+            status = (await client.get("/api/status")).json()
+            point["sessions"] = status.get("sessions", {}).get("sessions")
+        except (httpx.HTTPError, ValueError):
+            pass
+        timeline.append(point)
+        await asyncio.sleep(every)
+
+
+def growth_per_minute(timeline: List[Dict], key: str) -> Optional[float]:
+    """
+    Return the least-squares slope of a sampled value per minute, over the second half
+    of the run (the first half includes warm-up: imports, caches, pools)
+    """
+    points = [(point["t"], point[key]) for point in timeline if point.get(key) is not None]
+    points = points[len(points) // 2:]
+    if len(points) < 2:
+        return None
+    mean_t = sum(t for t, _ in points) / len(points)
+    mean_v = sum(v for _, v in points) / len(points)
+    var = sum((t - mean_t) ** 2 for t, _ in points)
+    if not var:
+        return None
+    return 60 * sum((t - mean_t) * (v - mean_v) for t, v in points) / var
+
+
+async def load(args, base_url: str, pid: Optional[int]) -> Dict:
+    stats = Stats()
+    timeline: List[Dict] = []
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=0)
+    timeout = args.latency * 100 + 30
+    # Le client est partagé: sa boîte à cookies ne doit rien garder, sinon les utilisateurs
+    # virtuels s'échangent leurs sessions. Chaque parcours passe son propre cookie
+    jar = CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits, cookies=jar) as client:
+        started = time.monotonic()
+        end = started + args.duration
+        sampling = asyncio.create_task(sampler(client, pid, args.sample_every, started, timeline))
+        await asyncio.gather(*(
+            user(client, stats, args.models, args.think, args.ramp * i / args.users, end)
+            for i in range(args.users)
+        ))
+        elapsed = time.monotonic() - started
+        sampling.cancel()
+        # Un dernier point, après la fin de la charge
+        timeline.append({"t": round(elapsed, 1), **(proc_status(pid) if pid is not None else {})})
+
+    routes = {}
+    for route in ROUTES:
+        latencies = stats.latencies[route]
+        statuses = stats.statuses[route]
+        count = sum(statuses.values())
+        routes[route] = {
+            "requests": count,
+            "per_second": count / elapsed,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else float("nan"),
+            "rejected": statuses["rejected"],
+            "errors": count - statuses["ok"] - statuses["rejected"],
+            "statuses": dict(statuses),
+        }
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "seconds": elapsed,
+        "journeys": stats.journeys,
+        "failed_journeys": stats.failed_journeys,
+        "journeys_per_second": stats.journeys / elapsed,
+        "routes": routes,
+        "timeline": timeline,
+        "rss_mb_per_minute": growth_per_minute(timeline, "rss_mb"),
+        "sessions_per_minute": growth_per_minute(timeline, "sessions"),
+    }
+
+
+def print_report(report: Dict) -> None:
+    print(
+        f"\n{report['journeys']} journeys ({report['failed_journeys']} failed) in {report['seconds']:.1f}s"
+        f" = {report['journeys_per_second']:.2f} journeys/s"
+    )
+    print(f"\n{'route':<12} {'req':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'rejected':>9} {'errors':>7}")
+    for route, row in report["routes"].items():
+        print(
+            f"{route:<12} {row['requests']:>7} {row['per_second']:>8.2f} {row['p50'] * 1000:>8.1f}"
+            f" {row['p95'] * 1000:>8.1f} {row['p99'] * 1000:>8.1f} {row['max'] * 1000:>8.1f}"
+            f" {row['rejected']:>9} {row['errors']:>7}"
+        )
+    print(f"\n{'t (s)':>7} {'RSS MB':>8} {'threads':>8} {'sessions':>9}")
+    for point in report["timeline"]:
+        rss = f"{point['rss_mb']:.1f}" if "rss_mb" in point else "-"
+        print(f"{point['t']:>7} {rss:>8} {point.get('threads', '-'):>8} {point.get('sessions', '-') or '-':>9}")
+    for key, label in (("rss_mb_per_minute", "MB"), ("sessions_per_minute", "sessions")):
+        if report[key] is not None:
+            print(f"growth: {report[key]:+.1f} {label}/min (second half of the run)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of load")
+    parser.add_argument("--ramp", type=float, default=5, help="Seconds over which the users start")
+    parser.add_argument("--think", type=float, default=0.5, help="Mean seconds between two clicks")
+    parser.add_argument("--latency", type=float, default=0.2, help="Stub LLM latency in seconds")
+    parser.add_argument("--models", nargs="+", default=["stub", "stub-slow"], help="Models the journeys pick from")
+    parser.add_argument("--server", default="threaded", choices=list(SERVERS), help="Server to start")
+    parser.add_argument("--port", type=int, default=7871)
+    parser.add_argument("--url", default=None, help="Target a running server instead of starting one")
+    parser.add_argument("--pid", type=int, default=None, help="Process to sample the memory of, with --url")
+    parser.add_argument("--sample-every", type=float, default=5, help="Seconds between memory samples")
+    parser.add_argument("--output", default=None, help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        base_url, pid = args.url.rstrip("/"), args.pid
+    else:
+        env = dict(
+            os.environ,
+            ENABLE_STUB_LLM="1",
+            STUB_LLM_LATENCY=str(args.latency),
+            PORT=str(args.port),
+            DB_FILE=os.path.join(tempfile.mkdtemp(prefix="nim-load-"), "games.db"),
+        )
+        base_url = f"http://127.0.0.1:{args.port}"
+        server = subprocess.Popen(
+            SERVERS[args.server], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        pid = server.pid
+    try:
+        wait_until_up(base_url)
+        report = asyncio.run(load(args, base_url, pid))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    errors = sum(row["errors"] for row in report["routes"].values())
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Concurrency stress test of the per-session locks of app.py.
+
+Several threads send /api/move, /api/run and /api/human-move requests for the same
+sessions at once, through the Flask test client and with stub LLMs, then check that:
+
+- no game was forfeited: a stub always plays a legal move for the state it saw, so a
+  forfeit means two requests moved from the same state (in variant b, the same move
+  twice in a row is illegal)
+- the history of every game replays legally
+- every finished game was recorded exactly once
+
+    python loadtest/session_stress.py --sessions 20 --threads 4 --requests 25
+    python loadtest/session_stress.py --no-lock   # shows the races the locks prevent
+    SESSION_BACKEND=sqlite python loadtest/session_stress.py
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+
+def replay_is_legal(state: dict) -> bool:
+    """
+    Replay the history of a compact state and check every move and the final pile
+    """
+    from arena.nim_game import NimGame
+
+    nim_game = NimGame(variant=state["variant"], n=state["n_start"])
+    for move in state["history"]:
+        if move not in nim_game.valid_moves():
+            return False
+        nim_game.pick(move)
+    return nim_game.n == state["n"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=4, help="Concurrent clients per session")
+    parser.add_argument("--requests", type=int, default=25, help="Requests per client")
+    parser.add_argument("--latency", type=float, default=0.005, help="Stub LLM latency in seconds")
+    parser.add_argument("--no-lock", action="store_true", help="Disable the session locks")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.update(
+        ENABLE_STUB_LLM="1",
+        STUB_LLM_LATENCY=str(args.latency),
+        DB_FILE=os.path.join(tmp, "stress.db"),
+        SESSION_DB=os.path.join(tmp, "sessions.db"),
+        SESSION_MAX_ENTRIES=str(args.sessions * 2),
+    )
+    import app as web
+    from arena.game import Game
+
+    if args.no_lock:
+        @contextmanager
+        def no_lock(sid, timeout=None):
+            yield
+
+        web._GAMES.lock = no_lock
+
+    # Compter les enregistrements par partie jouée (un NimGame par partie)
+    recorded = Counter()
+    games_seen = []
+    record = Game.record
+
+    def counting_record(self):
+        before = self.recorded
+        record(self)
+        if self.recorded and not before:
+            recorded[id(self.nim_game)] += 1
+            games_seen.append(self.nim_game)
+
+    Game.record = counting_record
+
+    random.seed(args.seed)
+    cookies = []
+    for _ in range(args.sessions):
+        client = web.app.test_client()
+        # Rouge est un LLM factice, Bleu est humain une fois sur deux
+        blue = random.choice(["stub", "Humain"])
+        client.post("/api/init", json={"red_model": "stub", "blue_model": blue, "variant": "b"})
+        cookies.append(client.get_cookie("session").value)
+
+    forfeits = []
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def worker(cookie: str, seed: int):
+        rng = random.Random(seed)
+        client = web.app.test_client()
+        client.set_cookie("session", cookie)
+        for _ in range(args.requests):
+            route = rng.choices(["/api/move", "/api/run", "/api/human-move"], weights=[6, 1, 3])[0]
+            response = client.post(f"{route}?protocol=2", json={"move": rng.choice([1, 2, 3])})
+            with lock:
+                statuses[response.status_code] += 1
+                if response.status_code == 200 and response.json.get("forfeited"):
+                    forfeits.append(route)
+
+    threads = [
+        threading.Thread(target=worker, args=(cookie, args.seed * 1000 + i * args.threads + k))
+        for i, cookie in enumerate(cookies)
+        for k in range(args.threads)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    illegal = 0
+    for cookie in cookies:
+        client = web.app.test_client()
+        client.set_cookie("session", cookie)
+        if not replay_is_legal(client.get("/api/state?protocol=2").json):
+            illegal += 1
+    duplicates = sum(count - 1 for count in recorded.values() if count > 1)
+
+    total = sum(statuses.values())
+    print(f"locks: {'off' if args.no_lock else 'on'}")
+    print(f"{total} requests in {elapsed:.2f}s ({total / elapsed:.0f} req/s), status codes {dict(statuses)}")
+    print(f"games recorded: {len(recorded)}, recorded twice: {duplicates}")
+    print(f"responses with a forfeited game: {len(forfeits)}, sessions with an illegal history: {illegal}")
+    ok = not forfeits and not illegal and not duplicates and set(statuses) == {200}
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Multi-node tournament check on one machine: several processes work on the same
+tournament through the shared work queue of arena.checkpoint, with stub LLMs. One of
+them is killed mid-run; its games must be taken over once their leases expire, and
+every scheduled game must end up in the games table exactly once.
+
+    python loadtest/tournament_nodes.py --nodes 3 --rounds 10
+    python loadtest/tournament_nodes.py --schedule information --games 60
+"""
+import argparse
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def tournament_id(env: dict) -> str:
+    listing = subprocess.run(
+        [sys.executable, "-m", "arena.tournament", "--list"], cwd=ROOT, env=env, capture_output=True, text=True
+    ).stdout
+    lines = [line for line in listing.splitlines() if line and not line.startswith(("{", "Allowed"))]
+    return lines[0].split()[0]
+
+
+def wait_for_lease(db: str, tid: str, pid: int, timeout: float = 30) -> None:
+    """
+    Wait until the process holds the lease of a game in progress
+    """
+    deadline = time.monotonic() + timeout
+    conn = sqlite3.connect(db)
+    while time.monotonic() < deadline:
+        held = conn.execute(
+            "SELECT COUNT(*) FROM tournament_games WHERE tournament_id = ? AND status = 'running' AND owner LIKE ?",
+            (tid, f"%:{pid}:%"),
+        ).fetchone()[0]
+        if held:
+            break
+        time.sleep(0.05)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=3, help="Worker processes, the first one included")
+    parser.add_argument("--workers", type=int, default=2, help="Games at once per process")
+    parser.add_argument("--schedule", default="round-robin", choices=["round-robin", "information", "swiss"])
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--games", type=int, default=60, help="Budget of an adaptive schedule")
+    parser.add_argument("--latency", type=float, default=0.02, help="Stub LLM latency in seconds")
+    parser.add_argument("--lease", type=float, default=3, help="Lease duration in seconds")
+    args = parser.parse_args()
+
+    db = os.path.join(tempfile.mkdtemp(), "games.db")
+    env = dict(
+        os.environ, ENABLE_STUB_LLM="1", STUB_LLM_LATENCY=str(args.latency), DB_FILE=db,
+        TOURNAMENT_LEASE=str(args.lease), TOURNAMENT_POLL="0.2",
+    )
+    quiet = dict(stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=ROOT, env=env)
+    command = [sys.executable, "-m", "arena.tournament", "--models", "stub", "stub-slow", "--variants", "normal", "b",
+               "--workers", str(args.workers), "--schedule", args.schedule]
+    command += ["--rounds", str(args.rounds)] if args.schedule == "round-robin" else ["--games", str(args.games)]
+
+    start = time.perf_counter()
+    first = subprocess.Popen(command, **quiet)
+    while not os.path.exists(db):
+        time.sleep(0.1)
+    time.sleep(1)
+    tid = tournament_id(env)
+    joiners = [
+        subprocess.Popen([sys.executable, "-m", "arena.tournament", "--join", tid, "--workers", str(args.workers)], **quiet)
+        for _ in range(args.nodes - 1)
+    ]
+    # Un nœud meurt en pleine partie: ses baux doivent expirer et ses parties être reprises
+    victim = joiners[0] if joiners else None
+    if victim is not None:
+        wait_for_lease(db, tid, victim.pid)
+        victim.send_signal(signal.SIGKILL)
+    for process in [first] + joiners[1:]:
+        process.wait()
+    elapsed = time.perf_counter() - start
+
+    conn = sqlite3.connect(db)
+    statuses = dict(conn.execute(
+        "SELECT status, COUNT(*) FROM tournament_games WHERE tournament_id = ? GROUP BY status", (tid,)
+    ).fetchall())
+    scheduled = sum(statuses.values())
+    games = conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+    distinct = conn.execute(
+        "SELECT COUNT(DISTINCT game_id) FROM tournament_games WHERE tournament_id = ? AND game_id IS NOT NULL", (tid,)
+    ).fetchone()[0]
+    retried = conn.execute(
+        "SELECT COUNT(*) FROM tournament_games WHERE tournament_id = ? AND attempts > 1", (tid,)
+    ).fetchone()[0]
+    expected = args.rounds * 2 * 2 if args.schedule == "round-robin" else args.games
+
+    print(f"{args.nodes} processes, one killed, {elapsed:.1f}s")
+    print(f"scheduled {scheduled} (expected {expected}), statuses {statuses}")
+    print(f"games recorded {games}, distinct recorded slots {distinct}, games claimed more than once {retried}")
+    ok = (victim is None or retried > 0) and scheduled == expected and statuses == {"done": expected} and games == expected == distinct
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
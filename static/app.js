@@ -15,6 +15,14 @@ const resultsBody = document.getElementById("results-body");
 // Variable pour stocker le dernier état
 let lastState = null;
 
+// État brut reçu du serveur (protocole 2) et sa version: le serveur n'envoie
+// que les champs modifiés depuis cette version
+let rawState = {};
+let stateVersion = "";
+
+// ETag du dernier classement reçu, pour obtenir un 304 s'il n'a pas changé
+let leaderboardEtag = null;
+
 const tabButtons = document.querySelectorAll(".tab-button");
 const tabPanels = document.querySelectorAll(".tab-panel");
 
@@ -28,8 +36,13 @@ const showLoading = (player = null) => {
   }
 };
 
+const withProtocol = (path) => {
+  const sep = path.includes("?") ? "&" : "?";
+  return `${path}${sep}protocol=2&since=${encodeURIComponent(stateVersion)}`;
+};
+
 const apiPost = async (path, payload) => {
-  const res = await fetch(path, {
+  const res = await fetch(withProtocol(path), {
     method: "POST",
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify(payload || {}),
@@ -50,8 +63,87 @@ const setHumanButtons = (validMoves) => {
   });
 };
 
-const applyState = (state) => {
-  // Sauvegarder l'état actuel
+const PLAYER_NAMES = { red: "Rouge", blue: "Bleu" };
+const otherColor = (color) => (color === "red" ? "blue" : "red");
+
+const escapeHtml = (text) =>
+  String(text ?? "").replace(/[&<>"']/g, (c) => ({ "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;" }[c]));
+
+// Plateau: même balisage que matchstick_view.display_matchsticks, mémorisé par taille.
+// Les dimensions viennent des <symbol> envoyés par le serveur (matchstick_defs)
+const boardCache = {};
+const viewBoxOf = (id) => {
+  const [, , width, height] = (document.getElementById(id)?.getAttribute("viewBox") ?? "").split(/[\s,]+/);
+  return `0 0 ${width} ${height}`;
+};
+const renderBoard = (n) => {
+  if (!(n in boardCache)) {
+    const lines = n <= 10 ? [n] : [10, n - 10];
+    const five = `<svg class="nim-five" viewBox="${viewBoxOf("nim-five")}"><use href="#nim-five"></use></svg>`;
+    const stick = `<svg class="nim-stick" viewBox="${viewBoxOf("nim-matchstick")}"><use href="#nim-matchstick"></use></svg>`;
+    const rows = lines.map(
+      (count) => `<div class='nim-row'>${five.repeat(Math.floor(count / 5))}${stick.repeat(count % 5)}</div>`
+    );
+    boardCache[n] = `<div class='nim-board'>${rows.join("")}</div>`;
+  }
+  return boardCache[n];
+};
+
+const renderMessage = (raw) => {
+  if (raw.winner && !raw.forfeited) {
+    return `Le joueur <strong>${PLAYER_NAMES[raw.winner]}</strong> a gagné!`;
+  }
+  if (raw.forfeited) {
+    return `Le joueur <strong>${PLAYER_NAMES[otherColor(raw.to_move)]}</strong> a gagné car <strong>${PLAYER_NAMES[raw.to_move]}</strong> a fait un coup invalide.`;
+  }
+  return `Il reste <strong>${raw.n}</strong> bâtonnets. C'est au joueur <strong>${PLAYER_NAMES[raw.to_move]}</strong> de jouer.`;
+};
+
+const renderThoughts = (player) =>
+  '<div style="text-align: left;font-size:14px"><br/>' +
+  `<b>Évaluation:</b><br/>${escapeHtml(player.evaluation)}<br/><br/>` +
+  `<b>Menaces:</b><br/>${escapeHtml(player.threats)}<br/><br/>` +
+  `<b>Opportunités:</b><br/>${escapeHtml(player.opportunities)}<br/><br/>` +
+  `<b>Stratégie:</b><br/>${escapeHtml(player.strategy)}<br/><br/>` +
+  `<b>Nombre de bâtonnets retirés:</b><br/>${escapeHtml(player.move_remove)}<br/>` +
+  "</div>";
+
+// Fusionne un état brut (complet ou partiel) et le convertit en état d'affichage
+const mergeState = (delta) => {
+  if (!delta || !delta.v) {
+    return null;
+  }
+  const { v, full, stopped_for_human: stoppedForHuman, ...fields } = delta;
+  rawState = full ? fields : { ...rawState, ...fields };
+  stateVersion = v;
+
+  const raw = rawState;
+  const active = !raw.winner && !raw.forfeited;
+  const showHuman = active && raw[raw.to_move].model === "Humain";
+  let message = renderMessage(raw);
+  if (stoppedForHuman) {
+    message += "<br/><strong>Auto-run stopped: human player detected. Use single move.</strong>";
+  }
+  return {
+    board_html: renderBoard(raw.n),
+    message_html: `<div class="status">${message}</div>`,
+    red_thoughts: renderThoughts(raw.red),
+    blue_thoughts: renderThoughts(raw.blue),
+    show_human: showHuman,
+    valid_moves: showHuman ? raw.valid_moves : [],
+    can_move: active && !showHuman,
+    can_run: active && !showHuman,
+    dropdowns_enabled: raw.history.length === 0,
+    game_over: !active,
+    red_model: raw.red.model,
+    blue_model: raw.blue.model,
+    variant: raw.variant,
+    current_player: raw.to_move,
+  };
+};
+
+const renderState = (state) => {
+  // Sauvegarder l'état d'affichage actuel
   lastState = state;
   
   boardEl.innerHTML = state.board_html;
@@ -75,6 +167,13 @@ const applyState = (state) => {
   variantSelect.disabled = !dropdownsEnabled;
 };
 
+const applyState = (delta) => {
+  const state = mergeState(delta);
+  if (state) {
+    renderState(state);
+  }
+};
+
 const renderTable = (tbody, rows) => {
   tbody.innerHTML = "";
   rows.forEach((row) => {
@@ -98,7 +197,14 @@ const initGame = async () => {
 };
 
 const loadLeaderboard = async () => {
-  const data = await apiGet("/api/leaderboard");
+  const headers = leaderboardEtag ? { "If-None-Match": leaderboardEtag } : {};
+  const res = await fetch("/api/leaderboard", { headers, cache: "no-store" });
+  if (res.status === 304) {
+    // Aucune nouvelle partie: les tableaux affichés sont déjà à jour
+    return;
+  }
+  leaderboardEtag = res.headers.get("ETag");
+  const data = await res.json();
   renderTable(ratingsBody, data.ratings || []);
   renderTable(resultsBody, data.results || []);
 };
@@ -113,6 +219,15 @@ moveBtn.addEventListener("click", async () => {
   }
   
   const state = await apiPost("/api/move");
+  if (state.error) {
+    // Serveur ou modèle saturé: on restaure l'état et on indique quand réessayer
+    if (lastState) {
+      renderState(lastState);
+    }
+    const retry = state.retry_after ? ` Réessayez dans ${state.retry_after} s.` : "";
+    messageEl.innerHTML = `<div class="status">${escapeHtml(state.error)}${retry}</div>`;
+    return;
+  }
   applyState(state);
 });
 
@@ -121,12 +236,9 @@ runBtn.addEventListener("click", async () => {
   moveBtn.disabled = true;
   resetBtn.disabled = true;
   
-  // Récupérer l'état actuel (ne pas réinitialiser)
-  let state = lastState;
-  
   // Si pas d'état (première partie), initialiser
-  if (!state) {
-    state = await apiPost("/api/init", {
+  if (!lastState) {
+    const state = await apiPost("/api/init", {
       red_model: redModel.value,
       blue_model: blueModel.value,
       variant: variantSelect.value,
@@ -134,28 +246,54 @@ runBtn.addEventListener("click", async () => {
     applyState(state);
   }
   
-  // Jouer tour par tour avec mise à jour visuelle
-  while (!state.game_over) {
-    // Forcer les boutons à rester désactivés pendant le jeu automatique
-    runBtn.disabled = true;
-    moveBtn.disabled = true;
-    resetBtn.disabled = true;
-    
-    // Afficher qui réfléchit
-    showLoading(state.current_player);
-    
-    await new Promise(resolve => setTimeout(resolve, 500)); // Pause de 500ms entre chaque coup
-    state = await apiPost("/api/move");
-    applyState(state);
-    
-    // Si c'est un joueur humain, on arrête
-    if (state.show_human) {
-      break;
+  // La partie est jouée en arrière-plan: on reçoit l'id du job, puis l'état après chaque coup
+  const job = await apiPost("/api/jobs");
+  if (!job.job_id) {
+    // Limite de parties atteinte: on restaure l'état et on affiche la raison
+    if (lastState) {
+      renderState(lastState);
     }
+    resetBtn.disabled = false;
+    messageEl.innerHTML = `<div class="status">${job.error || "Erreur"}</div>`;
+    return;
   }
+  const source = new EventSource(`/api/jobs/${job.job_id}/events`);
+  
+  const finish = () => {
+    source.close();
+    // Réactiver le bouton reset à la fin
+    resetBtn.disabled = false;
+  };
+  
+  source.addEventListener("state", (event) => {
+    applyState(JSON.parse(event.data));
+    const state = lastState;
+    
+    if (!state.game_over && !state.show_human) {
+      // Forcer les boutons à rester désactivés pendant le jeu automatique
+      runBtn.disabled = true;
+      moveBtn.disabled = true;
+      resetBtn.disabled = true;
+      
+      // Afficher qui réfléchit
+      showLoading(state.current_player);
+    }
+  });
   
-  // Réactiver le bouton reset à la fin
-  resetBtn.disabled = false;
+  source.addEventListener("done", (event) => {
+    const result = JSON.parse(event.data);
+    if (result.stopped_for_human) {
+      applyState({ ...result.state, stopped_for_human: true });
+    }
+    finish();
+  });
+  
+  source.onerror = () => {
+    finish();
+    if (lastState) {
+      renderState(lastState);
+    }
+  };
 });
 
 resetBtn.addEventListener("click", async () => {
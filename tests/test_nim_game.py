@@ -0,0 +1,31 @@
+from arena.nim_game import BLUE, RED, NimGame
+from arena.policy import legal_moves
+
+
+def test_variant_b_player_without_legal_move_loses():
+    game = NimGame(variant="b", n=2)
+    game.pick(1)
+    assert game.valid_moves() == []
+    assert not game.is_active()
+    assert game.winner == RED
+    assert not game.forfeited
+
+
+def test_variant_b_continues_when_a_move_is_left():
+    game = NimGame(variant="b", n=3)
+    game.pick(2)
+    assert game.valid_moves() == [1]
+    assert game.is_active()
+    game.pick(1)
+    assert game.winner == BLUE
+
+
+def test_last_stick_wins():
+    game = NimGame(variant="normal", n=2)
+    game.pick(2)
+    assert game.winner == RED
+
+
+def test_policy_sees_the_same_dead_end():
+    # arena.policy compte une position sans coup permis comme perdue pour le joueur à jouer
+    assert legal_moves("b", 1, 1) == ()